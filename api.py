@@ -1,17 +1,36 @@
-from flask import current_app, jsonify, request
+from flask import current_app, jsonify, request, Response, stream_with_context
 from flask_restful import Resource, reqparse, Api
 from flask_security import hash_password, verify_password
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 from datetime import datetime, timedelta
-from sqlalchemy.orm import joinedload
+from werkzeug.datastructures import ContentRange
+from sqlalchemy.orm import load_only, contains_eager, selectinload
 from sqlalchemy.exc import SQLAlchemyError
 import traceback
+import base64
+import io
 from models import db, User, Role, Section, Ebook, Request, Feedback
+from content import content_length, iter_content, set_ebook_content
+from cache import cache, read_through, bump, is_shared, cache_stats
+from stats import user_totals, dashboard_totals
+from expiry import expire_requests
+from cascade import delete_ebooks, delete_section
+from borrowing import (BorrowingError, request_ebook, grant_request, revoke_request, return_request,
+                       grant_requests, revoke_requests)
+from rollups import daily_trend
+from search import search_ebooks
+from ratings import (RATING_FIELDS, RANKING_ORDERS, RANKING_LIMIT, MAX_RANKING_LIMIT, RANKING_MIN_RATINGS,
+                     top_ebooks)
+from recommendations import similar_ebooks, recommend_for_user, RECOMMENDATION_NEIGHBOURS, MAX_RECOMMENDATIONS
+from database import retry_on_busy
+from auth import current_principal, token_claims
+from catalog import (parse_rows, detect_format, import_catalog, export_catalog, RowError,
+                     IMPORT_BATCH_SIZE)
 
 api = Api()
 
 def get_cache():
-    return current_app.extensions['cache']
+    return cache
 
 def get_security():
     return current_app.extensions['security']
@@ -40,19 +59,113 @@ ebook_post_args.add_argument('content', required=True, help="Content required")
 ebook_post_args.add_argument('author', required=True, help="Author required")
 ebook_post_args.add_argument('section_id', type=int, required=True, help="Section ID required")
 
+def iso_datetime(value):
+    # Accepts a bare date or a full timestamp; stored dates are naive
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+page_args = reqparse.RequestParser()
+page_args.add_argument('cursor', type=str, location='args')
+page_args.add_argument('limit', type=int, default=50, location='args')
+
+ebook_list_args = page_args.copy()
+ebook_list_args.add_argument('fields', type=str, location='args')
+
+search_args = page_args.copy()
+search_args.add_argument('q', type=str, required=True, location='args', help="Search query required")
+search_args.add_argument('section_id', type=int, location='args')
+
+request_list_args = page_args.copy()
+request_list_args.add_argument('status', type=str, location='args')
+request_list_args.add_argument('user_id', type=int, location='args')
+request_list_args.add_argument('date_from', type=iso_datetime, location='args')
+request_list_args.add_argument('date_to', type=iso_datetime, location='args')
+
+feedback_list_args = page_args.copy()
+feedback_list_args.add_argument('user_id', type=int, location='args')
+feedback_list_args.add_argument('ebook_id', type=int, location='args')
+feedback_list_args.add_argument('date_from', type=iso_datetime, location='args')
+feedback_list_args.add_argument('date_to', type=iso_datetime, location='args')
+
 request_post_args = reqparse.RequestParser()
 request_post_args.add_argument('ebook_id', type=int, required=True, help="Ebook ID required")
 
 request_put_args = reqparse.RequestParser()
 request_put_args.add_argument('status', type=str, required=True, help="Status required")
 
+request_batch_args = reqparse.RequestParser()
+request_batch_args.add_argument('action', type=str, required=True, choices=('grant', 'revoke'), location='json',
+                                help="Action must be grant or revoke")
+request_batch_args.add_argument('request_ids', type=int, action='append', location='json')
+request_batch_args.add_argument('status', type=str, location='json')
+request_batch_args.add_argument('section_id', type=int, location='json')
+request_batch_args.add_argument('user_id', type=int, location='json')
+
 feedback_post_args = reqparse.RequestParser()
 feedback_post_args.add_argument('ebook_id', type=int, required=True, help="Ebook ID required")
 feedback_post_args.add_argument('rating', type=int, required=True, help="Rating required")
 feedback_post_args.add_argument('comment', type=str)
 
+ranking_args = reqparse.RequestParser()
+ranking_args.add_argument('by', type=str, default='rating', choices=tuple(RANKING_ORDERS), location='args',
+                          help="Rank by rating or borrows")
+ranking_args.add_argument('section_id', type=int, location='args')
+ranking_args.add_argument('limit', type=int, default=RANKING_LIMIT, location='args')
+ranking_args.add_argument('min_ratings', type=int, default=RANKING_MIN_RATINGS, location='args')
+
 print("api.py is being imported")
 
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 1000
+
+# Fields the catalog listing can project. `content` is deliberately absent,
+# book bodies are only served through EbookContentAPI.
+EBOOK_LIST_FIELDS = {
+    'id': lambda ebook: ebook.ebook_id,
+    'ebook_name': lambda ebook: ebook.ebook_name,
+    'author': lambda ebook: ebook.author,
+    'section_id': lambda ebook: ebook.section_id,
+    'section_name': lambda ebook: ebook.section.section_name,
+    'date_issued': lambda ebook: ebook.date_issued.isoformat() if ebook.date_issued else None,
+    'date_returned': lambda ebook: ebook.date_returned.isoformat() if ebook.date_returned else None,
+    **{field: (lambda ebook, value=value: value(ebook.stats)) for field, value in RATING_FIELDS.items()},
+}
+
+EBOOK_LIST_COLUMNS = {
+    'ebook_name': Ebook.ebook_name,
+    'author': Ebook.author,
+    'date_issued': Ebook.date_issued,
+    'date_returned': Ebook.date_returned,
+}
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def page_limit(limit):
+    return max(1, min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE))
+
+def parse_page(args):
+    after = 0
+    if args.get('cursor'):
+        after = decode_cursor(args['cursor'])
+    return after, page_limit(args.get('limit'))
+
+def keyset_page(query, key_column, after, limit):
+    rows = query.filter(key_column > after).order_by(key_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], key_column.key))
+    return rows, next_cursor
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
 class LoginAPI(Resource):
     def post(self):
         args = user_req_args.parse_args()
@@ -66,7 +179,7 @@ class LoginAPI(Resource):
             is_librarian = 'librarian' in [role.name for role in user.roles]
             
             if is_librarian or (username and user.username == username):
-                access_token = create_access_token(identity=user.user_id)
+                access_token = create_access_token(identity=user.user_id, additional_claims=token_claims(user))
                 return {
                     'message': 'Logged in successfully',
                     'role': 'librarian' if is_librarian else 'user',
@@ -79,6 +192,7 @@ class LoginAPI(Resource):
         return {'message': 'Invalid credentials'}, 401
 
 class RegisterAPI(Resource):
+    @retry_on_busy
     def post(self):
         args = register_args.parse_args()
         email = args.get("email")
@@ -108,13 +222,21 @@ class RegisterAPI(Resource):
 class UserAPI(Resource):
     @jwt_required()
     def get(self):
-        users = User.query.all()
-        return jsonify([{
-            'id': user.user_id,
-            'email': user.email,
-            'username': user.username,
-            'role': 'librarian' if 'librarian' in [role.name for role in user.roles] else 'user'
-        } for user in users])
+        after, limit = parse_page(page_args.parse_args())
+        if after is None:
+            return {'message': 'Invalid cursor'}, 400
+
+        query = User.query.options(selectinload(User.roles))
+        users, next_cursor = keyset_page(query, User.user_id, after, limit)
+        return jsonify({
+            'users': [{
+                'id': user.user_id,
+                'email': user.email,
+                'username': user.username,
+                'role': 'librarian' if 'librarian' in [role.name for role in user.roles] else 'user'
+            } for user in users],
+            'next_cursor': next_cursor
+        })
     
 class UserProfileAPI(Resource):
     @jwt_required()
@@ -171,246 +293,482 @@ class UserProfileAPI(Resource):
 class UserStatsAPI(Resource):
     @jwt_required()
     def get(self):
-        user_id = get_jwt_identity()
-        user = User.query.get_or_404(user_id)
-        
-        books_requested = Request.query.filter_by(user_id=user_id).count()
-        requests_granted = Request.query.filter_by(user_id=user_id, status='granted').count()
-        requests_revoked = Request.query.filter_by(user_id=user_id, status='revoked').count()
-        books_returned = Request.query.filter_by(user_id=user_id, status='returned').count()  # New line
-        feedbacks_given = Feedback.query.filter_by(user_id=user_id).count()
-        
-        return {
-            'books_requested': books_requested,
-            'requests_granted': requests_granted,
-            'requests_revoked': requests_revoked,
-            'books_returned': books_returned,  # New line
-            'feedbacks_given': feedbacks_given
-        }
+        principal = current_principal()
+        if principal is None:
+            return {'message': 'User not found'}, 404
+        return user_totals(principal.user_id)
+
+class UserRecommendationsAPI(Resource):
+    @jwt_required()
+    def get(self):
+        principal = current_principal()
+        if principal is None:
+            return {'message': 'User not found'}, 404
+        limit = max(1, min(request.args.get('limit', RECOMMENDATION_NEIGHBOURS, type=int), MAX_RECOMMENDATIONS))
+        return jsonify({'recommendations': recommend_for_user(principal.user_id, limit)})
 
 class SectionAPI(Resource):
     def get(self):
-        sections = Section.query.all()
-        return jsonify([{
-            'id': section.section_id,
-            'section_name': section.section_name,
-            'section_description': section.section_description,
-            'date_created': section.date_created
-        } for section in sections])
+        def load_sections():
+            return [{
+                'id': section.section_id,
+                'section_name': section.section_name,
+                'section_description': section.section_description,
+                'date_created': section.date_created
+            } for section in Section.query.all()]
+
+        return jsonify(read_through('sections', 'all', load_sections))
     
     @jwt_required()    
+    @retry_on_busy
     def post(self):
         args = section_post_args.parse_args()
         new_section = Section(section_name=args.get("section_name"), section_description=args.get("section_description"))
         db.session.add(new_section)
         db.session.commit()
+        bump('sections')
         return jsonify({'message': 'Section created successfully', 'section_id': new_section.section_id})
     
     @jwt_required()    
+    @retry_on_busy
     def put(self, section_id):
         section = Section.query.get_or_404(section_id)
         args = section_post_args.parse_args()
         section.section_name = args.get("section_name")
         section.section_description = args.get("section_description")
         db.session.commit()
+        bump('sections', 'ebooks')
         return jsonify({'message': 'Section has been updated'})
 
     @jwt_required()    
+    @retry_on_busy
     def delete(self, section_id):
-        section = Section.query.options(joinedload(Section.ebooks)).get_or_404(section_id)
-        for ebook in section.ebooks:
-            Feedback.query.filter_by(ebook_id=ebook.ebook_id).delete()
-            Request.query.filter_by(ebook_id=ebook.ebook_id).delete()
-            db.session.delete(ebook)
-        db.session.delete(section)
+        Section.query.get_or_404(section_id)
+        if request.args.get('background', '').lower() == 'true':
+            # Large sections: delete in committed chunks from a worker, whose
+            # bump on completion only reaches this process through a shared cache
+            if not is_shared():
+                return {'message': 'Background deletes need a shared cache, set CACHE_TYPE=RedisCache'}, 409
+            from tasks import delete_section_in_background
+            task = delete_section_in_background.delay(section_id)
+            bump('sections', 'ebooks', 'dashboard')
+            return {'message': 'Section deletion has been queued', 'task_id': task.id}, 202
+        delete_section(section_id)
         db.session.commit()
+        bump('sections', 'ebooks', 'dashboard')
         return jsonify({'message': 'Section and all its books have been deleted'})
             
 class EbookAPI(Resource):
     def get(self):
-        ebooks = Ebook.query.join(Section).all()
-        return jsonify([{
-            'id': ebook.ebook_id,
-            'ebook_name': ebook.ebook_name,
-            'content': ebook.content,
-            'author': ebook.author,
-            'section_id': ebook.section_id,
-            'section_name': ebook.section.section_name,
-            'date_issued': ebook.date_issued.isoformat() if ebook.date_issued else None,
-            'date_returned': ebook.date_returned.isoformat() if ebook.date_returned else None
-        } for ebook in ebooks])
+        args = ebook_list_args.parse_args()
+        fields = list(EBOOK_LIST_FIELDS)
+        if args.get('fields'):
+            fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+            unknown = [field for field in fields if field not in EBOOK_LIST_FIELDS]
+            if unknown:
+                return {'message': f"Unknown fields: {', '.join(unknown)}"}, 400
+
+        after, limit = parse_page(args)
+        if after is None:
+            return {'message': 'Invalid cursor'}, 400
+
+        def load_page():
+            columns = [EBOOK_LIST_COLUMNS[field] for field in fields if field in EBOOK_LIST_COLUMNS]
+            query = Ebook.query.join(Section).options(load_only(Ebook.section_id, *columns))
+            if 'section_name' in fields:
+                query = query.options(contains_eager(Ebook.section).load_only(Section.section_name))
+            if any(field in RATING_FIELDS for field in fields):
+                query = query.outerjoin(Ebook.stats).options(contains_eager(Ebook.stats))
+            ebooks, next_cursor = keyset_page(query, Ebook.ebook_id, after, limit)
+
+            return {
+                'ebooks': [{field: EBOOK_LIST_FIELDS[field](ebook) for field in fields} for ebook in ebooks],
+                'next_cursor': next_cursor
+            }
+
+        return jsonify(read_through('ebooks', f"{after}:{limit}:{','.join(fields)}", load_page))
 
     @jwt_required()    
+    @retry_on_busy
     def post(self):
         args = ebook_post_args.parse_args()
         new_ebook = Ebook(
             ebook_name=args.get("title"),
-            content=args.get("content"),
             author=args.get("author"),
             section_id=args.get("section_id")
         )
         db.session.add(new_ebook)
+        set_ebook_content(new_ebook, args.get("content"))
         db.session.commit()
+        bump('ebooks')
         return jsonify({'message': 'Ebook created successfully', 'id': new_ebook.ebook_id})
     
     @jwt_required()    
+    @retry_on_busy
     def put(self, ebook_id):
         ebook = Ebook.query.get_or_404(ebook_id)
         args = ebook_post_args.parse_args()
         ebook.ebook_name = args.get("title")
-        ebook.content = args.get("content")
         ebook.author = args.get("author")
         ebook.section_id = args.get("section_id")
+        set_ebook_content(ebook, args.get("content"))
         db.session.commit()
+        bump('ebooks')
         return jsonify({'message': 'Ebook has been updated'})
         
     @jwt_required()    
+    @retry_on_busy
     def delete(self, ebook_id):
-        ebook = Ebook.query.get_or_404(ebook_id)
-        Feedback.query.filter_by(ebook_id=ebook_id).delete()
-        Request.query.filter_by(ebook_id=ebook_id).delete()        
-        db.session.delete(ebook)
+        Ebook.query.get_or_404(ebook_id)
+        delete_ebooks([ebook_id])
         db.session.commit()
+        bump('ebooks', 'dashboard')
         return jsonify({'message': 'Ebook along with its feedback and requests (if any) has been deleted'})
     
+class CatalogImportAPI(Resource):
+    @jwt_required()
+    def post(self):
+        """Uploads are capped by MAX_CONTENT_LENGTH (16MB) like every other
+        request; larger catalogs go through ``flask import-catalog``."""
+        principal = current_principal()
+        if not principal or not principal.has_role('librarian'):
+            return {'message': 'Insufficient permissions'}, 403
+        batch_size = max(1, min(request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int), 5000))
+        fmt = request.args.get('format')
+
+        load_content = None
+        if request.files:
+            catalog = request.files.get('catalog')
+            if not catalog:
+                return {'message': 'A catalog file is required'}, 400
+            uploads = {upload.filename: upload for upload in request.files.getlist('content_files')}
+
+            def load_content(name):
+                if name not in uploads:
+                    raise RowError(f'Content file not uploaded: {name}')
+                return uploads[name].read().decode('utf-8')
+
+            rows = parse_rows(catalog.stream, fmt or detect_format(catalog.filename, catalog.mimetype))
+        else:
+            rows = parse_rows(io.BufferedReader(request.stream), fmt or detect_format(None, request.mimetype))
+
+        report = import_catalog(rows, load_content, batch_size)
+        bump('sections', 'ebooks')
+        return jsonify(report)
+
+class CatalogExportAPI(Resource):
+    @jwt_required()
+    def get(self):
+        principal = current_principal()
+        if not principal or not principal.has_role('librarian'):
+            return {'message': 'Insufficient permissions'}, 403
+        fmt = 'csv' if request.args.get('format') == 'csv' else 'jsonl'
+        include_content = request.args.get('content', 'true').lower() != 'false'
+
+        response = Response(
+            stream_with_context(export_catalog(fmt, include_content)),
+            mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=catalog.{fmt}'
+        return response
+
+class SearchAPI(Resource):
+    def get(self):
+        args = search_args.parse_args()
+        # Signed-in readers see body snippets for the books they have been granted
+        principal = current_principal() if verify_jwt_in_request(optional=True) else None
+        # Ranked results page by offset, carried in the same opaque cursor token
+        offset, limit = parse_page(args)
+        if offset is None:
+            return {'message': 'Invalid cursor'}, 400
+        limit = min(limit, 50)
+
+        results = search_ebooks(args['q'], section_id=args.get('section_id'), offset=offset, limit=limit + 1,
+                                user_id=principal.user_id if principal else None,
+                                librarian=bool(principal and principal.has_role('librarian')))
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(offset + limit)
+        return jsonify({'results': results, 'next_cursor': next_cursor})
+
+class EbookRankingAPI(Resource):
+    def get(self):
+        args = ranking_args.parse_args()
+        limit = max(1, min(args['limit'], MAX_RANKING_LIMIT))
+        return jsonify({'sections': top_ebooks(args['by'], section_id=args.get('section_id'), limit=limit,
+                                               min_ratings=args['min_ratings'])})
+
+class EbookSimilarAPI(Resource):
+    def get(self, ebook_id):
+        if db.session.get(Ebook, ebook_id) is None:
+            return {'message': 'Ebook not found'}, 404
+        limit = max(1, min(request.args.get('limit', RECOMMENDATION_NEIGHBOURS, type=int), MAX_RECOMMENDATIONS))
+        return jsonify({'ebook_id': ebook_id, 'similar': similar_ebooks(ebook_id, limit)})
+
+class EbookContentAPI(Resource):
+    @jwt_required()
+    def get(self, ebook_id):
+        user_id = get_jwt_identity()
+        principal = current_principal()
+        if principal is None:
+            return {'message': 'User not found'}, 404
+        if not principal.has_role('librarian'):
+            granted_request = Request.query.filter_by(user_id=user_id, ebook_id=ebook_id, status='granted').first()
+            if not granted_request:
+                return {'message': 'You have not been granted access to this book'}, 403
+
+        ebook = Ebook.query.options(load_only(Ebook.content_hash, Ebook.date_modified)).get_or_404(ebook_id)
+        if ebook.content_hash is None:
+            return {'message': 'This ebook has no content'}, 404
+        etag = ebook.content_hash
+        last_modified = ebook.date_modified.replace(microsecond=0) if ebook.date_modified else None
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(last_modified and request.if_modified_since
+                                and last_modified <= request.if_modified_since.replace(tzinfo=None))
+        if not_modified:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+
+        length = content_length(etag)
+        start, stop = 0, length
+        byte_range = request.range
+        if_range = request.if_range
+        if byte_range and (if_range.etag or if_range.date):
+            # A stale If-Range validator means the client's partial copy is out of date
+            if if_range.etag != etag and not (if_range.date and last_modified
+                                               and last_modified <= if_range.date.replace(tzinfo=None)):
+                byte_range = None
+        if byte_range:
+            bounds = byte_range.range_for_length(length)
+            if bounds is None:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{length}'
+                return response
+            start, stop = bounds
+
+        response = Response(
+            stream_with_context(iter_content(etag, start, stop)),
+            status=206 if byte_range else 200,
+            mimetype='text/plain'
+        )
+        response.content_length = stop - start
+        if byte_range:
+            response.content_range = ContentRange('bytes', start, stop, length)
+        response.accept_ranges = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+
 class RequestAPI(Resource):
     @jwt_required()
     def get(self):
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if 'librarian' in [role.name for role in user.roles]:
-            requests = Request.query.all()
+        principal = current_principal()
+        if principal is None:
+            return {'message': 'User not found'}, 404
+        args = request_list_args.parse_args()
+        after, limit = parse_page(args)
+        if after is None:
+            return {'message': 'Invalid cursor'}, 400
+
+        query = db.session.query(
+            Request.request_id, Request.ebook_id, User.username, Ebook.ebook_name, Request.status,
+            Request.date_requested, Request.date_granted, Request.date_revoked, Request.return_date
+        ).join(User, Request.user_id == User.user_id).join(Ebook, Request.ebook_id == Ebook.ebook_id)
+        if principal.has_role('librarian'):
+            if args.get('user_id'):
+                query = query.filter(Request.user_id == args['user_id'])
         else:
-            requests = Request.query.filter_by(user_id=user_id).all()
-        
-        result = [{
-            'request_id': req.request_id,
-            'ebook_id': req.ebook_id,
-            'username': req.user.username,
-            'ebook_name': req.ebook.ebook_name,
-            'status': req.status,
-            'date_requested': req.date_requested.isoformat(),
-            'date_granted': req.date_granted.isoformat() if req.date_granted else None,
-            'date_revoked': req.date_revoked.isoformat() if req.date_revoked else None,
-            'return_date': req.return_date.isoformat() if req.return_date else None
-        } for req in requests]
-        
-        print('Requests:', result)
-        return jsonify(result)
+            query = query.filter(Request.user_id == user_id)
+        if args.get('status'):
+            query = query.filter(Request.status == args['status'])
+        if args.get('date_from'):
+            query = query.filter(Request.date_requested >= args['date_from'])
+        if args.get('date_to'):
+            query = query.filter(Request.date_requested < args['date_to'])
+
+        requests, next_cursor = keyset_page(query, Request.request_id, after, limit)
+        return jsonify({
+            'requests': [{
+                'request_id': req.request_id,
+                'ebook_id': req.ebook_id,
+                'username': req.username,
+                'ebook_name': req.ebook_name,
+                'status': req.status,
+                'date_requested': req.date_requested.isoformat(),
+                'date_granted': isoformat(req.date_granted),
+                'date_revoked': isoformat(req.date_revoked),
+                'return_date': isoformat(req.return_date)
+            } for req in requests],
+            'next_cursor': next_cursor
+        })
 
 
     @jwt_required()    
+    @retry_on_busy
     def post(self):
         args = request_post_args.parse_args()
         user_id = get_jwt_identity()
-        ebook_id = args.get("ebook_id")
-        
-        active_requests = Request.query.filter_by(user_id=user_id, status='granted').count()
-        if active_requests >= 5:
-            return jsonify({'message': 'You have reached the maximum limit of 5 active e-book requests'}), 400
-        
-        existing_request = Request.query.filter_by(user_id=user_id, ebook_id=ebook_id, status='requested').first()
-        if existing_request:
-            return jsonify({'message': 'You have already requested this e-book'}), 400
-
-        new_request = Request(user_id=user_id, ebook_id=ebook_id, status='requested', date_requested=datetime.utcnow())
-        db.session.add(new_request)
+        try:
+            request_id = request_ebook(user_id, args.get("ebook_id"))
+        except BorrowingError as e:
+            return {'message': str(e)}, 400
         db.session.commit()
-        return jsonify({'message': 'Request submitted successfully', 'request_id': new_request.request_id})
+        bump('dashboard')
+        return jsonify({'message': 'Request submitted successfully', 'request_id': request_id})
 
     @jwt_required()    
+    @retry_on_busy
     def put(self, request_id):
-        req = Request.query.get_or_404(request_id)
+        Request.query.get_or_404(request_id)
         args = request_put_args.parse_args()
         status = args.get("status")
-        
-        user = User.query.get(req.user_id)
-        if status == 'granted':
-            if user.no_of_books >= 5:
-                return jsonify({'message': 'User has already borrowed the maximum number of books'}), 400
-            
-            req.status = 'granted'
-            req.date_granted = datetime.now()
-            req.return_date = datetime.now() + timedelta(days=7)
-            user.no_of_books = Request.query.filter_by(user_id=user.user_id, status='granted').count() + 1
-        elif status == 'revoked':
-            if req.status == 'granted':
-                user.no_of_books = max(0, user.no_of_books - 1)
-            req.status = 'revoked'
-            req.date_revoked = datetime.now()
-        
+        try:
+            if status == 'granted':
+                grant_request(request_id)
+            elif status == 'revoked':
+                revoke_request(request_id)
+        except BorrowingError as e:
+            return {'message': str(e)}, 400
+
         db.session.commit()
+        bump('dashboard')
         return jsonify({'message': f'Request status updated to {status}'})
     
+class RequestBatchAPI(Resource):
+    @jwt_required()
+    @retry_on_busy
+    def post(self):
+        principal = current_principal()
+        if not principal or not principal.has_role('librarian'):
+            return {'message': 'Insufficient permissions'}, 403
+        args = request_batch_args.parse_args()
+
+        request_ids = args.get('request_ids')
+        if not request_ids:
+            # No explicit ids, so the filters pick the queue: pending requests unless told otherwise
+            query = db.select(Request.request_id).where(Request.status == (args.get('status') or 'requested'))
+            if args.get('section_id'):
+                query = query.join(Ebook, Request.ebook_id == Ebook.ebook_id).where(
+                    Ebook.section_id == args['section_id'])
+            if args.get('user_id'):
+                query = query.where(Request.user_id == args['user_id'])
+            request_ids = db.session.execute(
+                query.order_by(Request.request_id).limit(MAX_BATCH_SIZE + 1)).scalars().all()
+        request_ids = list(dict.fromkeys(request_ids))
+        if len(request_ids) > MAX_BATCH_SIZE:
+            return {'message': f'At most {MAX_BATCH_SIZE} requests can be updated at once'}, 400
+
+        try:
+            if args['action'] == 'grant':
+                outcomes = grant_requests(request_ids)
+            else:
+                outcomes = revoke_requests(request_ids)
+        except BorrowingError as e:
+            db.session.rollback()
+            return {'message': str(e)}, 409
+        db.session.commit()
+        bump('dashboard')
+
+        done = 'granted' if args['action'] == 'grant' else 'revoked'
+        return jsonify({
+            'action': args['action'],
+            'processed': sum(1 for outcome in outcomes.values() if outcome == done),
+            'results': [{'request_id': request_id, 'outcome': outcomes[request_id]} for request_id in request_ids]
+        })
+
 class ReturnAPI(Resource):
     @jwt_required()
+    @retry_on_busy
     def post(self, request_id):
         user_id = get_jwt_identity()
-        req = Request.query.get_or_404(request_id)
-        
-        if req.user_id == user_id and req.status == 'granted':
-            req.status = 'returned'
-            req.date_revoked = datetime.now()
-            user = User.query.get(req.user_id)
-            user.no_of_books = max(0, Request.query.filter_by(user_id=user.user_id, status='granted').count() - 1)
-            db.session.commit()
-            return jsonify({'message': 'E-book returned successfully'})
-        else:
-            return jsonify({'message': 'Invalid return request'}), 400
+        Request.query.get_or_404(request_id)
+        try:
+            return_request(request_id, user_id)
+        except BorrowingError as e:
+            return {'message': str(e)}, 400
+        db.session.commit()
+        bump('dashboard')
+        return jsonify({'message': 'E-book returned successfully'})
         
 class AutoReturnAPI(Resource):
+    @retry_on_busy
     def post(self):
         current_date = datetime.utcnow()
-        overdue_requests = Request.query.filter(
-            Request.status == 'granted',
-            Request.date_granted <= current_date - timedelta(days=7)
-        ).all()
-
-        returned_books = []
-        for request in overdue_requests:
-            request.status = 'returned'
-            request.date_revoked = current_date
-            user = User.query.get(request.user_id)
-            user.no_of_books = max(0, user.no_of_books - 1)
-            returned_books.append({
-                'request_id': request.request_id,
-                'ebook_name': request.ebook.ebook_name,
-                'user': request.user.username
-            })
-
-        db.session.commit()
+        report = expire_requests(
+            Request.date_granted <= current_date - timedelta(days=7), 'returned',
+            now=current_date, details=True
+        )
+        if report['processed']:
+            bump('dashboard')
 
         return jsonify({
-            'message': f'{len(returned_books)} overdue books returned automatically',
-            'returned_books': returned_books
+            'message': f"{report['processed']} overdue books returned automatically",
+            'returned_books': [{
+                'request_id': row.request_id,
+                'ebook_name': row.ebook_name,
+                'user': row.username
+            } for row in report['requests']],
+            'batches': report['batches']
         })
 
 class FeedbackAPI(Resource):
     @jwt_required()
     def get(self):
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if 'librarian' in [role.name for role in user.roles]:
-            feedbacks = Feedback.query.all()
+        principal = current_principal()
+        if principal is None:
+            return {'message': 'User not found'}, 404
+        args = feedback_list_args.parse_args()
+        after, limit = parse_page(args)
+        if after is None:
+            return {'message': 'Invalid cursor'}, 400
+
+        query = db.session.query(
+            Feedback.feedback_id, Feedback.user_id, User.username, Feedback.ebook_id, Ebook.ebook_name,
+            Feedback.rating, Feedback.comment, Feedback.date_created
+        ).join(User, Feedback.user_id == User.user_id).join(Ebook, Feedback.ebook_id == Ebook.ebook_id)
+        if principal.has_role('librarian'):
+            if args.get('user_id'):
+                query = query.filter(Feedback.user_id == args['user_id'])
         else:
-            feedbacks = Feedback.query.filter_by(user_id=user_id).all()
-        
-        return jsonify([{
-            'feedback_id': feedback.feedback_id,
-            'user_id': feedback.user_id,
-            'username': feedback.user.username,
-            'ebook_id': feedback.ebook_id,
-            'ebook_name': feedback.ebook.ebook_name,
-            'rating': feedback.rating,
-            'comment': feedback.comment,
-            'date_created': feedback.date_created.isoformat()
-        } for feedback in feedbacks])
+            query = query.filter(Feedback.user_id == user_id)
+        if args.get('ebook_id'):
+            query = query.filter(Feedback.ebook_id == args['ebook_id'])
+        if args.get('date_from'):
+            query = query.filter(Feedback.date_created >= args['date_from'])
+        if args.get('date_to'):
+            query = query.filter(Feedback.date_created < args['date_to'])
+
+        feedbacks, next_cursor = keyset_page(query, Feedback.feedback_id, after, limit)
+        return jsonify({
+            'feedbacks': [{
+                'feedback_id': feedback.feedback_id,
+                'user_id': feedback.user_id,
+                'username': feedback.username,
+                'ebook_id': feedback.ebook_id,
+                'ebook_name': feedback.ebook_name,
+                'rating': feedback.rating,
+                'comment': feedback.comment,
+                'date_created': feedback.date_created.isoformat()
+            } for feedback in feedbacks],
+            'next_cursor': next_cursor
+        })
 
     @jwt_required()
+    @retry_on_busy
     def post(self):
         user_id = get_jwt_identity()
         args = feedback_post_args.parse_args()
         ebook_id = args.get("ebook_id")
+        if args.get("rating") not in range(1, 6):
+            return {'message': 'Rating must be between 1 and 5'}, 400
         
         # Check if the user has been granted access to this book
         granted_request = Request.query.filter_by(
@@ -440,48 +798,66 @@ class FeedbackAPI(Resource):
         )
         db.session.add(new_feedback)
         db.session.commit()
+        bump('dashboard', 'ebooks')
         return jsonify({'message': 'Feedback submitted successfully', 'feedback_id': new_feedback.feedback_id})
 
     @jwt_required()    
+    @retry_on_busy
     def delete(self, feedback_id):
         feedback = Feedback.query.get_or_404(feedback_id)
         db.session.delete(feedback)
         db.session.commit()
+        bump('dashboard', 'ebooks')
         return jsonify({'message': 'Feedback has been deleted'})
 
 class LibrarianDashboardAPI(Resource):
     @jwt_required()
     def get(self):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or not user.has_role('librarian'):
+        principal = current_principal()
+        if not principal or not principal.has_role('librarian'):
             return {'message': 'Insufficient permissions'}, 403
-            
-        active_users = User.query.join(Request).filter(Request.status == 'granted').distinct().count()
-        pending_requests = Request.query.filter_by(status='requested').count()
-        granted_requests = Request.query.filter_by(status='granted').count()
-        revoked_requests = Request.query.filter_by(status='revoked').count()
-        total_returns = Request.query.filter_by(status='returned').count()  
-        total_feedbacks = Feedback.query.count()
-            
-        return jsonify({
-            'active_users': active_users,
-            'pending_requests': pending_requests,
-            'granted_requests': granted_requests,
-            'revoked_requests': revoked_requests,
-            'total_returns': total_returns,
-            'total_feedbacks': total_feedbacks
-            })
+
+        def load_dashboard():
+            return dashboard_totals(use_counters=current_app.config.get('DASHBOARD_COUNTERS', False))
+
+        return jsonify(read_through('dashboard', 'totals', load_dashboard))
+
+class LibrarianTrendsAPI(Resource):
+    @jwt_required()
+    def get(self):
+        principal = current_principal()
+        if not principal or not principal.has_role('librarian'):
+            return {'message': 'Insufficient permissions'}, 403
+        days = max(1, min(request.args.get('days', 30, type=int), 366))
+        return jsonify(daily_trend(days))
+
+class CacheStatsAPI(Resource):
+    @jwt_required()
+    def get(self):
+        principal = current_principal()
+        if not principal or not principal.has_role('librarian'):
+            return {'message': 'Insufficient permissions'}, 403
+        return jsonify(cache_stats())
     
 api.add_resource(LoginAPI, '/api/login')
 api.add_resource(RegisterAPI, '/api/register')
 api.add_resource(UserAPI, '/api/users')
 api.add_resource(UserProfileAPI, '/api/user/profile')
 api.add_resource(UserStatsAPI, '/api/user/stats')
+api.add_resource(UserRecommendationsAPI, '/api/user/recommendations')
 api.add_resource(SectionAPI, '/api/section', '/api/section/<int:section_id>')
 api.add_resource(EbookAPI, '/api/ebook', '/api/ebook/<int:ebook_id>')
+api.add_resource(CatalogImportAPI, '/api/ebook/import')
+api.add_resource(CatalogExportAPI, '/api/ebook/export')
+api.add_resource(SearchAPI, '/api/search')
+api.add_resource(EbookRankingAPI, '/api/ebook/top')
+api.add_resource(EbookContentAPI, '/api/ebook/<int:ebook_id>/content')
+api.add_resource(EbookSimilarAPI, '/api/ebook/<int:ebook_id>/similar')
 api.add_resource(RequestAPI, '/api/request', '/api/request/<int:request_id>')
+api.add_resource(RequestBatchAPI, '/api/request/batch')
 api.add_resource(ReturnAPI, '/api/return/<int:request_id>')
 api.add_resource(AutoReturnAPI, '/api/auto-return')
 api.add_resource(FeedbackAPI, '/api/feedback', '/api/feedback/<int:feedback_id>')
-api.add_resource(LibrarianDashboardAPI, '/api/librarian/dashboard')
\ No newline at end of file
+api.add_resource(LibrarianDashboardAPI, '/api/librarian/dashboard')
+api.add_resource(LibrarianTrendsAPI, '/api/librarian/trends')
+api.add_resource(CacheStatsAPI, '/api/librarian/cache-stats')
\ No newline at end of file
@@ -1,4 +1,5 @@
-from flask import Flask
+from flask import Flask, request
+import click
 from flask_cors import CORS
 from flask_security import Security, SQLAlchemyUserDatastore, hash_password
 from flask_jwt_extended import JWTManager
@@ -8,15 +9,39 @@ from celery.schedules import crontab
 from flask_apscheduler import APScheduler
 from api import api
 from models import db
+from migrations import upgrade
+from cache import cache, bump
+import database
+import instrumentation
+from database import engine_options, replica_binds
+from routing import READ_METHODS, request_identity, mark_write
+from expiry import revoke_overdue
 from datetime import timedelta
+import os
 from flask_swagger_ui import get_swaggerui_blueprint
 
 app = Flask(__name__)
+# 'production' turns on WAL and the tuned pragmas in database.py, 'default' leaves SQLite as it ships
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+# Point at another database file, e.g. one made by `flask benchmark-generate`
+DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(app.instance_path, 'lib.sqlite3'))
+# Comma-separated replica URLs for GET requests; unset reads from a read-only engine on the primary file
+REPLICA_BINDS = replica_binds(
+    [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url],
+    DATABASE_PATH,
+    SQLITE_PROFILE
+)
 app.config.update(
     SECRET_KEY="abcdefghijklmnop",
     WTF_CSRF_ENABLED=False,
-    SQLALCHEMY_DATABASE_URI='sqlite:///lib.sqlite3',
+    SQLALCHEMY_DATABASE_URI=f'sqlite:///{DATABASE_PATH}',
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    SQLITE_PROFILE=SQLITE_PROFILE,
+    SQLALCHEMY_ENGINE_OPTIONS=engine_options(SQLITE_PROFILE),
+    SQLALCHEMY_BINDS=REPLICA_BINDS,
+    SQLALCHEMY_REPLICAS=list(REPLICA_BINDS),
+    # How long a user's reads stay on the primary after they write
+    REPLICA_LAG_WINDOW=5,
     SECURITY_PASSWORD_SALT='abcdefghijklmnop',
     SECURITY_TOKEN_AUTHENTICATION_HEADER='Authorization',
     SECURITY_TOKEN_AUTHENTICATION_KEY='Bearer',
@@ -28,12 +53,26 @@ app.config.update(
     MAX_CONTENT_LENGTH = 16*1024*1024,
     CORS_HEADERS='Content-Type',
     CELERY_BROKER_URL='redis://localhost:6379/1',
-    CELERY_RESULT_BACKEND='redis://localhost:6379/2'
+    CELERY_RESULT_BACKEND='redis://localhost:6379/2',
+    # Celery and the scheduler bump generations from other processes, so the cache is
+    # shared through Redis; 'cache.LRUCache' is for a single process without workers
+    CACHE_TYPE=os.environ.get('CACHE_TYPE', 'RedisCache'),
+    CACHE_DEFAULT_TIMEOUT=300,
+    CACHE_THRESHOLD=1024,
+    CACHE_REDIS_URL=os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/3'),
+    CACHE_KEY_PREFIX='lms:',
+    # Serve the librarian dashboard from the trigger-maintained dashboard_counter table
+    DASHBOARD_COUNTERS=True,
+    # Requests slower than this are logged with their slowest SQL statements
+    SLOW_REQUEST_SECONDS=float(os.environ.get('SLOW_REQUEST_SECONDS', 0.5))
 )
 
 CORS(app, supports_credentials=True, origins=["http://localhost:8080"])
 
 db.init_app(app)
+database.init_app(app)
+instrumentation.init_app(app)
+cache.init_app(app)
 api.init_app(app)
 
 from models import User, Role, Section, Ebook, Request, Feedback
@@ -49,7 +88,7 @@ celery.conf.update(
 celery.Task = workers.ContextTask
 app.app_context().push()
 
-from tasks import daily_reminders, monthly_report
+from tasks import daily_reminders, monthly_report, refresh_rollups, reconcile_loan_counts, refresh_recommendations
 
 datastore = SQLAlchemyUserDatastore(db, User, Role)
 security = Security(app, datastore)
@@ -60,6 +99,10 @@ scheduler.start()
 
 @app.after_request
 def after_request(response):
+    if request.method not in READ_METHODS and response.status_code < 400:
+        identity = request_identity()
+        if identity is not None:
+            mark_write(identity)
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -85,7 +128,7 @@ jwt = JWTManager(app)
 @celery.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(
-        crontab(minute='*'),
+        crontab(hour=8, minute=0),
         daily_reminders.s(),
         name="daily reminder"
     )
@@ -94,24 +137,188 @@ def setup_periodic_tasks(sender, **kwargs):
         monthly_report.s(),
         name="monthly report"
     )
-
-def revoke_access(request_id):
-    with app.app_context():
-        req = Request.query.get(request_id)
-        if req and req.status == 'granted':
-            req.status = 'revoked'
-            req.date_revoked = datetime.now()
-            db.session.commit()
+    sender.add_periodic_task(
+        crontab(minute=0),
+        refresh_rollups.s(),
+        name="refresh daily rollups"
+    )
+    sender.add_periodic_task(
+        crontab(hour=3, minute=30),
+        reconcile_loan_counts.s(),
+        name="reconcile loan counters"
+    )
+    sender.add_periodic_task(
+        crontab(minute=15),
+        refresh_recommendations.s(),
+        name="refresh similar ebooks"
+    )
+    sender.add_periodic_task(
+        crontab(hour=4, minute=0, day_of_week=0),
+        refresh_recommendations.s(full=True),
+        name="rebuild similar ebooks"
+    )
 
 @scheduler.task('cron', id='revoke_expired_requests', hour='0')
 def revoke_expired_requests():
+    # Scheduler jobs run in a thread of their own, so the context has to be
+    # pushed before retry_on_busy can roll the session back
     with app.app_context():
-        expired_requests = Request.query.filter(
-            Request.status == 'granted',
-            Request.return_date <= datetime.now()
-        ).all()
-        for req in expired_requests:
-            revoke_access(req.request_id)
+        report = revoke_overdue()
+        if report['processed']:
+            bump('dashboard')
+        app.logger.info(f"Revoked {report['processed']} expired requests in {len(report['batches'])} batches: "
+                        f"{[batch['seconds'] for batch in report['batches']]}s")
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    import query_plans
+    failures = query_plans.check()
+    for name, scans in failures.items():
+        print(f"{name}: {'; '.join(scans)}")
+    if failures:
+        raise SystemExit(1)
+    print(f"{len(query_plans.REGISTERED_QUERIES)} queries checked, no table scans")
+
+@app.cli.command('benchmark-sqlite')
+@click.option('--threads', default=8, show_default=True)
+@click.option('--seconds', default=5.0, show_default=True)
+@click.option('--write-ratio', default=0.2, show_default=True, help='Share of operations that write')
+def benchmark_sqlite_command(threads, seconds, write_ratio):
+    from benchmark import sqlite_concurrency
+    for profile in ('default', 'production'):
+        result = sqlite_concurrency(profile, threads=threads, seconds=seconds, write_ratio=write_ratio)
+        print(f"{profile:>10}: {result['ops_per_second']:8.1f} ops/s, {result['reads']} reads, "
+              f"{result['writes']} writes, {result['busy_errors']} busy errors, {result['retries']} retries")
+
+@app.cli.command('benchmark-http')
+@click.argument('urls', nargs=-1, required=True)
+@click.option('--concurrency', default=100, show_default=True)
+@click.option('--requests', 'total', default=2000, show_default=True)
+@click.option('--token', help='Bearer token for endpoints that need one')
+def benchmark_http_command(urls, concurrency, total, token):
+    from benchmark import http_load
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    for url in urls:
+        result = http_load(url, concurrency=concurrency, total=total, headers=headers)
+        print(f"{url}: {result['requests_per_second']} req/s, p50 {result['p50_ms']} ms, "
+              f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, {result['errors']} errors")
+
+@app.cli.command('reconcile-loans')
+@click.option('--dry-run', is_flag=True, help='Report drifted counters without fixing them')
+def reconcile_loans_command(dry_run):
+    from borrowing import reconcile_loans
+    drift = reconcile_loans(fix=not dry_run)
+    for row in drift:
+        print(f"user {row.user_id}: no_of_books={row.counted}, granted={row.actual}")
+    print(f"{len(drift)} users {'drifted' if dry_run else 'reconciled'}")
+
+@app.cli.command('stress-borrowing')
+@click.option('--threads', default=16, show_default=True)
+@click.option('--requests', 'total', default=50, show_default=True, help='Pending requests granted at once')
+def stress_borrowing_command(threads, total):
+    from benchmark import borrowing_stress
+    result = borrowing_stress(threads=threads, total=total)
+    print(f"{result['granted']} granted, {result['refused']} refused in {result['seconds']}s; "
+          f"no_of_books={result['no_of_books']}, granted rows={result['granted_rows']}")
+    if result['granted_rows'] > result['limit'] or result['no_of_books'] != result['granted_rows']:
+        raise SystemExit('Loan limit violated')
+
+@app.cli.command('benchmark-generate')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--sections', default=20, show_default=True)
+@click.option('--ebooks', default=2000, show_default=True)
+@click.option('--users', default=500, show_default=True)
+@click.option('--requests', default=10000, show_default=True)
+@click.option('--feedback', default=5000, show_default=True)
+@click.option('--content-kb', default=20, show_default=True, help='Median ebook content size')
+@click.option('--seed', default=42, show_default=True)
+def benchmark_generate_command(path, **params):
+    from datagen import generate_library
+    result = generate_library(path, **params)
+    print(f"{result['path']}: {result['sections']} sections, {result['ebooks']} ebooks, {result['users']} users, "
+          f"{result['requests']} requests, {result['feedback']} feedback in {result['seconds']}s")
+    print(f"Benchmark it with DATABASE_PATH={result['path']} flask benchmark-run")
+
+@app.cli.command('benchmark-run')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='Write the results as JSON')
+@click.option('--url', help='Base URL of a server on the same database; defaults to the test client')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--requests', 'total', default=200, show_default=True, help='Requests per endpoint')
+@click.option('--only', multiple=True, help='Run just these scenarios')
+@click.option('--writes', is_flag=True, help='Include endpoints that write')
+@click.option('--seed', default=0, show_default=True)
+def benchmark_run_command(output, url, concurrency, total, only, writes, seed):
+    import json
+    from benchmark import run_suite
+    result = run_suite(app, base_url=url, concurrency=concurrency, total=total, only=only, writes=writes, seed=seed)
+    for name, summary in result['endpoints'].items():
+        print(f"{name:>22}: {summary['requests_per_second']:8} req/s, p50 {summary['p50_ms']} ms, "
+              f"p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms, {summary['errors']} errors")
+    if output:
+        with open(output, 'w') as file:
+            json.dump(result, file, indent=2)
+
+@app.cli.command('benchmark-compare')
+@click.argument('baseline', type=click.File())
+@click.argument('candidate', type=click.File())
+def benchmark_compare_command(baseline, candidate):
+    import json
+    from benchmark import compare_results
+    baseline, candidate = json.load(baseline), json.load(candidate)
+    print(f"{baseline['meta']['commit']} -> {candidate['meta']['commit']}")
+    for name, rows in compare_results(baseline, candidate).items():
+        changes = ', '.join(f"{metric} {before} -> {after}" + (f" ({change:+}%)" if change is not None else '')
+                            for metric, (before, after, change) in rows.items())
+        print(f"{name:>22}: {changes}")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    from search import rebuild_search_index
+    print(f"Indexed {rebuild_search_index()} ebooks")
+
+@app.cli.command('refresh-ebook-stats')
+def refresh_ebook_stats_command():
+    from ratings import refresh_ebook_stats
+    refresh_ebook_stats()
+    db.session.commit()
+    print("Recomputed ebook ratings and borrow counts")
+
+@app.cli.command('refresh-recommendations')
+@click.option('--full', is_flag=True, help='Rebuild every ebook, not just those touched since the last run')
+def refresh_recommendations_command(full):
+    from recommendations import refresh_similar_ebooks
+    result = refresh_similar_ebooks(full=full)
+    print(f"{result['mode']}: {result['rows']} neighbours for {result['ebooks']} ebooks "
+          f"from {result['users']} readers in {result['seconds']}s")
+
+@app.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension')
+@click.option('--content-dir', type=click.Path(exists=True, file_okay=False),
+              help='Where content_file entries are resolved, defaults to the catalog file\'s directory')
+@click.option('--batch-size', default=500, show_default=True)
+def import_catalog_command(path, fmt, content_dir, batch_size):
+    from catalog import parse_rows, detect_format, import_catalog, directory_content_loader
+    load_content = directory_content_loader(content_dir or os.path.dirname(os.path.abspath(path)))
+    with open(path, 'rb') as f:
+        report = import_catalog(parse_rows(f, fmt or detect_format(path)), load_content, batch_size)
+    bump('sections', 'ebooks')
+    for batch in report['batches']:
+        for error in batch['errors']:
+            print(f"line {error['line']}: {error['error']}")
+    seconds = sum(batch['seconds'] for batch in report['batches'])
+    print(f"Imported {report['imported']} ebooks, {report['failed']} failed, "
+          f"{len(report['batches'])} batches in {seconds:.1f}s")
+
+@app.cli.command('export-catalog')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension')
+@click.option('--no-content', is_flag=True, help='Leave ebook content out of the export')
+def export_catalog_command(path, fmt, no_content):
+    from catalog import export_catalog, detect_format
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in export_catalog(fmt or detect_format(path), include_content=not no_content):
+            f.write(chunk)
 
 SWAGGER_URL = '/api/docs'
 API_URL = '/swagger.yaml'
@@ -127,7 +334,6 @@ app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
 # To serve the swagger.yaml file
 from flask import send_from_directory
-import os
 
 @app.route('/swagger.yaml')
 def send_static():
@@ -136,6 +342,7 @@ def send_static():
 if __name__ == "__main__":  
     with app.app_context():
         db.create_all()
+        upgrade()
         create_user()
     app.run(debug=True)
     
@@ -144,6 +351,7 @@ if __name__ == "__main__":
 # celery -A app.celery beat --max-interval 1 -l info
 # mailhog
 # python3 app.py
+# uvicorn asgi:app --port 5001
 # npm run serve
 # redis-server
 # ~/go/bin/MailHog
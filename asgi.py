@@ -0,0 +1,251 @@
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from sqlalchemy import select
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine
+from contextlib import asynccontextmanager
+from werkzeug.http import parse_date, parse_etags, parse_if_range_header, parse_range_header, http_date
+import jwt
+from a2wsgi import WSGIMiddleware
+from app import app as flask_app, SQLITE_PROFILE, DATABASE_PATH
+from models import Role, RolesUsers, Section, Ebook, EbookStats, Request, ContentBlob
+from api import encode_cursor, decode_cursor, page_limit
+from content import chunk_span, chunk_query, inflate_chunk
+from database import configure_engine
+from search import search_statement, search_result
+from ratings import RATINGS, RATING_FIELDS
+
+# The catalog, search and content read endpoints served from asyncio, so
+# thousands of idle or slow readers cost a coroutine each instead of a
+# thread. Queries go through aiosqlite on a read-only connection to the same
+# database file; the pool, not the number of clients, bounds the threads it
+# uses. Everything else falls through to the Flask app.
+#
+#   uvicorn asgi:app --port 5001
+
+ASYNC_POOL_SIZE = 8
+
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///file:{DATABASE_PATH}?mode=ro&uri=true",
+    # aiosqlite defaults to a connection per checkout; keep a pool of them instead
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_POOL_SIZE
+)
+configure_engine(engine.sync_engine, SQLITE_PROFILE, readonly=True)
+
+EBOOK_LIST_COLUMNS = {
+    'id': Ebook.ebook_id,
+    'ebook_name': Ebook.ebook_name,
+    'author': Ebook.author,
+    'section_id': Ebook.section_id,
+    'section_name': Section.section_name,
+    'date_issued': Ebook.date_issued,
+    'date_returned': Ebook.date_returned,
+}
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+def message(text, status):
+    return JSONResponse({'message': text}, status_code=status)
+
+def token_identity(request):
+    """The user id of a valid Bearer access token, or None."""
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme != 'Bearer' or not token:
+        return None
+    try:
+        claims = jwt.decode(token, flask_app.config['JWT_SECRET_KEY'],
+                            algorithms=[flask_app.config.get('JWT_ALGORITHM', 'HS256')])
+    except jwt.InvalidTokenError:
+        return None
+    return claims.get('sub') if claims.get('type') == 'access' else None
+
+class ArgumentError(ValueError):
+    """A query argument that doesn't parse, answered like Flask-RESTful's reqparse."""
+
+    def __init__(self, name, text):
+        super().__init__(text)
+        self.name = name
+
+async def argument_error(request, error):
+    return JSONResponse({'message': {error.name: str(error)}}, status_code=400)
+
+def page_params(request):
+    try:
+        limit = int(request.query_params.get('limit', 50))
+    except ValueError as error:
+        raise ArgumentError('limit', str(error))
+    after = 0
+    if request.query_params.get('cursor'):
+        after = decode_cursor(request.query_params['cursor'])
+    return after, page_limit(limit)
+
+async def sections(request):
+    async with engine.connect() as connection:
+        rows = await connection.execute(
+            select(Section.section_id, Section.section_name, Section.section_description, Section.date_created)
+        )
+        return JSONResponse([{
+            'id': row.section_id,
+            'section_name': row.section_name,
+            'section_description': row.section_description,
+            # Flask's JSON provider writes datetimes as HTTP dates, keep the same shape
+            'date_created': http_date(row.date_created) if row.date_created else None
+        } for row in rows])
+
+async def ebooks(request):
+    fields = [*EBOOK_LIST_COLUMNS, *RATING_FIELDS]
+    if request.query_params.get('fields'):
+        fields = [field.strip() for field in request.query_params['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in EBOOK_LIST_COLUMNS and field not in RATING_FIELDS]
+        if unknown:
+            return message(f"Unknown fields: {', '.join(unknown)}", 400)
+    after, limit = page_params(request)
+    if after is None:
+        return message('Invalid cursor', 400)
+
+    query = select(Ebook.ebook_id, *[EBOOK_LIST_COLUMNS[field].label(field) for field in fields
+                                     if field in EBOOK_LIST_COLUMNS])
+    if 'section_name' in fields:
+        query = query.join(Section, Ebook.section_id == Section.section_id)
+    if any(field in RATING_FIELDS for field in fields):
+        query = query.add_columns(
+            EbookStats.ebook_id.label('stats_ebook_id'), EbookStats.rating_count, EbookStats.rating_average,
+            *[getattr(EbookStats, f'rating_{rating}') for rating in RATINGS]
+        ).outerjoin(EbookStats, EbookStats.ebook_id == Ebook.ebook_id)
+    query = query.where(Ebook.ebook_id > after).order_by(Ebook.ebook_id).limit(limit + 1)
+    async with engine.connect() as connection:
+        rows = (await connection.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].ebook_id)
+    def value(row, field):
+        if field in RATING_FIELDS:
+            return RATING_FIELDS[field](row if row.stats_ebook_id is not None else None)
+        return isoformat(row._mapping[field]) if field.startswith('date_') else row._mapping[field]
+
+    return JSONResponse({
+        'ebooks': [{field: value(row, field) for field in fields} for row in rows],
+        'next_cursor': next_cursor
+    })
+
+async def is_librarian(connection, user_id):
+    return (await connection.execute(
+        select(Role.role_id).join(RolesUsers, RolesUsers.role_id == Role.role_id)
+        .where(RolesUsers.user_id == user_id, Role.name == 'librarian').limit(1)
+    )).first() is not None
+
+async def search(request):
+    query = request.query_params.get('q')
+    if not query:
+        return message('Search query required', 400)
+    offset, limit = page_params(request)
+    if offset is None:
+        return message('Invalid cursor', 400)
+    limit = min(limit, 50)
+    try:
+        section_id = int(request.query_params['section_id']) if request.query_params.get('section_id') else None
+    except ValueError:
+        return message('Invalid section_id', 400)
+
+    user_id = token_identity(request)
+    results = []
+    async with engine.connect() as connection:
+        librarian = user_id is not None and await is_librarian(connection, user_id)
+        statement = search_statement(query, section_id, offset, limit + 1, user_id, librarian)
+        if statement is not None:
+            results = [search_result(row) for row in await connection.execute(*statement)]
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(offset + limit)
+    return JSONResponse({'results': results, 'next_cursor': next_cursor})
+
+async def ebook_content(request):
+    user_id = token_identity(request)
+    if user_id is None:
+        return message('Missing or invalid access token', 401)
+    ebook_id = request.path_params['ebook_id']
+
+    async with engine.connect() as connection:
+        if not await is_librarian(connection, user_id):
+            granted = (await connection.execute(
+                select(Request.request_id).where(Request.user_id == user_id, Request.ebook_id == ebook_id,
+                                                 Request.status == 'granted').limit(1)
+            )).first()
+            if not granted:
+                return message('You have not been granted access to this book', 403)
+        ebook = (await connection.execute(
+            select(Ebook.content_hash, Ebook.date_modified, ContentBlob.size, ContentBlob.chunk_size)
+            .join(ContentBlob, ContentBlob.content_hash == Ebook.content_hash)
+            .where(Ebook.ebook_id == ebook_id)
+        )).first()
+    if ebook is None:
+        return message('Ebook not found', 404)
+
+    etag = ebook.content_hash
+    last_modified = ebook.date_modified.replace(microsecond=0) if ebook.date_modified else None
+    headers = {'ETag': f'"{etag}"', 'Accept-Ranges': 'bytes'}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        not_modified = parse_etags(if_none_match).contains(etag)
+    else:
+        since = parse_date(request.headers.get('if-modified-since'))
+        not_modified = bool(last_modified and since and last_modified <= since.replace(tzinfo=None))
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    length = ebook.size
+    start, stop = 0, length
+    byte_range = parse_range_header(request.headers.get('range'))
+    if_range = parse_if_range_header(request.headers.get('if-range'))
+    if byte_range and (if_range.etag or if_range.date):
+        # A stale If-Range validator means the client's partial copy is out of date
+        if if_range.etag != etag and not (if_range.date and last_modified
+                                           and last_modified <= if_range.date.replace(tzinfo=None)):
+            byte_range = None
+    if byte_range:
+        bounds = byte_range.range_for_length(length)
+        if bounds is None:
+            return Response(status_code=416, headers={'Content-Range': f'bytes */{length}'})
+        start, stop = bounds
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+    headers['Content-Length'] = str(stop - start)
+
+    async def body():
+        # A connection per chunk, so a slow reader doesn't hold one from the pool
+        span_stop, sequence = chunk_span(length, ebook.chunk_size, start, stop)
+        for seq in sequence:
+            async with engine.connect() as connection:
+                data = (await connection.execute(chunk_query(etag, seq))).scalar()
+            yield inflate_chunk(data, seq, ebook.chunk_size, start, span_stop)
+
+    return StreamingResponse(body(), status_code=206 if byte_range else 200,
+                             media_type='text/plain', headers=headers)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+app = Starlette(routes=[
+    Route('/api/section', sections, methods=['GET']),
+    Route('/api/ebook', ebooks, methods=['GET']),
+    Route('/api/search', search, methods=['GET']),
+    Route('/api/ebook/{ebook_id:int}/content', ebook_content, methods=['GET']),
+    Mount('/', WSGIMiddleware(flask_app)),
+], middleware=[
+    Middleware(CORSMiddleware, allow_origins=['http://localhost:8080'], allow_credentials=True,
+               allow_methods=['GET', 'PUT', 'POST', 'DELETE', 'OPTIONS'],
+               allow_headers=['Content-Type', 'Authorization'])
+], exception_handlers={ArgumentError: argument_error}, lifespan=lifespan)
@@ -0,0 +1,88 @@
+from flask import current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.orm import object_session, selectinload
+from typing import NamedTuple
+import time
+from models import db, User
+from routing import RoutingSession
+from cache import cache
+
+# Who is calling, resolved without touching the database. Access tokens carry
+# the user's roles as claims; a principal built from them (or, for tokens
+# from before a change to the user, from the database) is cached for
+# PRINCIPAL_TTL seconds. Committing a change to a user or their roles drops
+# the cached principal and marks every older token's claims as stale.
+
+PRINCIPAL_TTL = 300
+
+class Principal(NamedTuple):
+    user_id: int
+    username: str
+    roles: tuple
+
+    def has_role(self, role):
+        return role in self.roles
+
+def token_claims(user):
+    return {'username': user.username, 'roles': sorted(role.name for role in user.roles)}
+
+def _principal_key(user_id):
+    return f'principal:{user_id}'
+
+def _changed_key(user_id):
+    return f'principal-changed:{user_id}'
+
+def load_principal(user_id):
+    user = db.session.execute(
+        db.select(User).options(selectinload(User.roles)).where(User.user_id == user_id)
+    ).scalar()
+    if user is None:
+        return None
+    return Principal(user.user_id, user.username, tuple(token_claims(user)['roles']))
+
+def current_principal():
+    """The caller of a ``jwt_required`` handler, or None if the user is gone."""
+    user_id = get_jwt_identity()
+    principal = cache.get(_principal_key(user_id))
+    if principal is not None:
+        return principal
+
+    claims = get_jwt()
+    changed = cache.get(_changed_key(user_id))
+    if 'roles' in claims and (changed is None or claims['iat'] > changed):
+        principal = Principal(user_id, claims.get('username'), tuple(claims['roles']))
+    else:
+        principal = load_principal(user_id)
+    if principal is not None:
+        cache.set(_principal_key(user_id), principal, timeout=PRINCIPAL_TTL)
+    return principal
+
+def invalidate_principal(user_id):
+    cache.delete(_principal_key(user_id))
+    # Remembered for as long as a token issued before now can still be used
+    lifetime = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    cache.set(_changed_key(user_id), time.time(), timeout=int(lifetime.total_seconds()) if lifetime else 0)
+
+def _changed(target):
+    session = object_session(target)
+    if session is not None and target.user_id is not None:
+        session.info.setdefault('changed_principals', set()).add(target.user_id)
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _roles_changed(target, value, initiator):
+    _changed(target)
+
+@event.listens_for(User, 'after_update')
+def _user_changed(mapper, connection, target):
+    _changed(target)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_changed(session):
+    for user_id in session.info.pop('changed_principals', ()):
+        invalidate_principal(user_id)
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop('changed_principals', None)
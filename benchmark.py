@@ -0,0 +1,434 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from datetime import datetime
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from models import db
+from database import engine_options, configure_engine, is_busy_error, busy_backoff, BUSY_RETRIES
+
+BENCHMARK_EBOOKS = 500
+BENCHMARK_USERS = 100
+
+def seed_benchmark_database(engine, ebooks=BENCHMARK_EBOOKS, users=BENCHMARK_USERS):
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO section (section_name, date_created) VALUES ('Benchmark', :now)"),
+                           {'now': now})
+        connection.execute(
+            text("INSERT INTO ebook (ebook_name, author, section_id, date_modified) VALUES (:name, :author, 1, :now)"),
+            [{'name': f'Book {i}', 'author': f'Author {i % 50}', 'now': now} for i in range(ebooks)]
+        )
+        connection.execute(
+            text("INSERT INTO user (email, username, password, active, fs_uniquifier, no_of_books) "
+                 "VALUES (:email, :username, '', 1, :email, 0)"),
+            [{'email': f'user{i}@example.com', 'username': f'user{i}'} for i in range(users)]
+        )
+
+def read_catalog(connection, ebooks):
+    connection.execute(text(
+        "SELECT ebook.ebook_id, ebook.ebook_name, ebook.author, section.section_name FROM ebook "
+        "JOIN section ON section.section_id = ebook.section_id WHERE ebook.ebook_id > :after "
+        "ORDER BY ebook.ebook_id LIMIT 50"
+    ), {'after': random.randrange(ebooks)}).all()
+
+def write_feedback(connection, ebooks, users):
+    # Read-then-write, the shape of most api.py handlers
+    user_id = random.randrange(1, users + 1)
+    connection.execute(text("SELECT no_of_books FROM user WHERE user_id = :user_id"), {'user_id': user_id}).all()
+    connection.execute(text(
+        "INSERT INTO feedback (user_id, ebook_id, rating, comment, date_created) "
+        "VALUES (:user_id, :ebook_id, :rating, 'benchmark', :now)"
+    ), {'user_id': user_id, 'ebook_id': random.randrange(1, ebooks + 1), 'rating': random.randint(1, 5),
+        'now': datetime.utcnow()})
+
+def sqlite_concurrency(profile, threads=8, seconds=5.0, write_ratio=0.2,
+                       ebooks=BENCHMARK_EBOOKS, users=BENCHMARK_USERS):
+    """Run a mixed catalog read / feedback write load against a scratch
+    database configured with ``profile`` and report the throughput."""
+    directory = tempfile.mkdtemp(prefix='lms-benchmark-')
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.sqlite3')}", **engine_options(profile))
+    configure_engine(engine, profile)
+    seed_benchmark_database(engine, ebooks, users)
+
+    totals = {'reads': 0, 'writes': 0, 'busy_errors': 0, 'retries': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        counts = dict.fromkeys(totals, 0)
+        while time.perf_counter() < deadline:
+            if random.random() >= write_ratio:
+                with engine.connect() as connection:
+                    read_catalog(connection, ebooks)
+                counts['reads'] += 1
+                continue
+            for attempt in range(BUSY_RETRIES + 1):
+                try:
+                    with engine.begin() as connection:
+                        write_feedback(connection, ebooks, users)
+                    counts['writes'] += 1
+                    break
+                except OperationalError as e:
+                    if not is_busy_error(e):
+                        raise
+                    if attempt == BUSY_RETRIES:
+                        counts['busy_errors'] += 1
+                    else:
+                        counts['retries'] += 1
+                        busy_backoff(attempt)
+        with lock:
+            for name, value in counts.items():
+                totals[name] += value
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+
+    totals['profile'] = profile
+    totals['threads'] = threads
+    totals['seconds'] = round(elapsed, 2)
+    totals['ops_per_second'] = round((totals['reads'] + totals['writes']) / elapsed, 1)
+    return totals
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def latency_summary(latencies, elapsed, errors=0):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+async def _http_load(url, concurrency, total, headers):
+    import httpx
+
+    latencies = []
+    errors = 0
+    issued = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=60) as client:
+        async def user():
+            nonlocal issued, errors
+            while issued < total:
+                issued += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    await response.aread()
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        return latency_summary(latencies, time.perf_counter() - started, errors)
+
+def http_load(url, concurrency=100, total=2000, headers=None):
+    """Hit ``url`` with ``concurrency`` simultaneous keep-alive clients until
+    ``total`` requests are done. Point it at the Flask server and at
+    asgi.py to compare the two under the same load."""
+    return asyncio.run(_http_load(url, concurrency, total, headers or {}))
+
+def borrowing_stress(threads=16, total=50, profile='production'):
+    """Grant ``total`` pending requests of one user from ``threads`` threads
+    at once, every thread trying every request, against a scratch database.
+    The loan limit holds if exactly MAX_ACTIVE_LOANS are granted and the
+    counter agrees with the granted rows."""
+    import database
+    from borrowing import grant_request, BorrowingError, MAX_ACTIVE_LOANS
+    from models import User, Request
+
+    directory = tempfile.mkdtemp(prefix='lms-stress-')
+    scratch = database.scratch_app(os.path.join(directory, 'stress.sqlite3'), profile)
+    with scratch.app_context():
+        seed_benchmark_database(db.engine, ebooks=total, users=1)
+        now = datetime.utcnow()
+        db.session.execute(db.insert(Request), [
+            {'user_id': 1, 'ebook_id': ebook_id, 'status': 'requested', 'date_requested': now}
+            for ebook_id in range(1, total + 1)
+        ])
+        db.session.commit()
+        request_ids = db.session.execute(db.select(Request.request_id)).scalars().all()
+
+    outcomes = {'granted': 0, 'refused': 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    @database.retry_on_busy(retries=20)
+    def grant(request_id):
+        try:
+            grant_request(request_id)
+        except BorrowingError:
+            db.session.rollback()
+            return 'refused'
+        db.session.commit()
+        return 'granted'
+
+    def worker():
+        ids = list(request_ids)
+        random.shuffle(ids)
+        with scratch.app_context():
+            barrier.wait()
+            for request_id in ids:
+                outcome = grant(request_id)
+                with lock:
+                    outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with scratch.app_context():
+        no_of_books = db.session.get(User, 1).no_of_books
+        granted_rows = db.session.execute(
+            db.select(db.func.count()).select_from(Request).where(Request.status == 'granted')
+        ).scalar()
+        db.engine.dispose()
+    return dict(outcomes, seconds=round(elapsed, 2), limit=MAX_ACTIVE_LOANS,
+                no_of_books=no_of_books, granted_rows=granted_rows)
+
+# The endpoint suite: every scenario is one api.py endpoint with arguments
+# drawn from the data it runs against, so the same suite runs on a small
+# sample database or a generated library. Results are written as JSON with
+# enough metadata (commit, dataset, settings) to compare runs across commits.
+SUITE_REQUESTS = 200
+SUITE_CONCURRENCY = 8
+SUITE_WARMUP = 10
+
+def suite_fixtures(seed=0):
+    """Ids, tokens and search terms for the suite, read from the app's database."""
+    from flask_jwt_extended import create_access_token
+    from auth import token_claims
+    from models import User, Role, Ebook, Request
+
+    rng = random.Random(seed)
+    librarian = db.session.execute(
+        db.select(User).where(User.roles.any(Role.name == 'librarian')).order_by(User.user_id).limit(1)
+    ).scalar()
+    readers = db.session.execute(
+        db.select(User).where(User.user_id != librarian.user_id).order_by(User.user_id).limit(200)
+    ).scalars().all()
+    loans = db.session.execute(
+        db.select(Request.user_id, Request.ebook_id).where(Request.status == 'granted').limit(1000)
+    ).all()
+    names = db.session.execute(db.select(Ebook.ebook_name).limit(500)).scalars().all()
+
+    def token(user):
+        return {'Authorization': f'Bearer {create_access_token(identity=user.user_id, additional_claims=token_claims(user))}'}
+
+    loan_users = {user.user_id: user for user in db.session.execute(
+        db.select(User).where(User.user_id.in_({user_id for user_id, _ in loans}))
+    ).scalars()}
+    return {
+        'ebook_ids': db.session.execute(db.select(Ebook.ebook_id)).scalars().all(),
+        'librarian': token(librarian),
+        'readers': [token(user) for user in readers],
+        'loans': [(token(loan_users[user_id]), ebook_id) for user_id, ebook_id in rng.sample(loans, min(50, len(loans)))],
+        'terms': sorted({word.lower() for name in names for word in name.split() if len(word) > 3}) or ['book'],
+    }
+
+def suite_scenarios(fixtures, writes=False):
+    """``{name: (make_request, expected_statuses)}``; ``make_request(rng)``
+    returns the ``(method, path, headers, json)`` of one request."""
+    from api import encode_cursor
+
+    ebook_ids = fixtures['ebook_ids']
+    librarian = fixtures['librarian']
+    readers = fixtures['readers']
+    loans = fixtures['loans']
+    terms = fixtures['terms']
+
+    def after(rng):
+        return encode_cursor(rng.choice(ebook_ids) if ebook_ids else 0)
+
+    scenarios = {
+        'catalog_page': (lambda rng: ('GET', f'/api/ebook?limit=50&cursor={after(rng)}', {}, None), (200,)),
+        'catalog_fields': (lambda rng: ('GET', f'/api/ebook?limit=50&fields=id,ebook_name,author&cursor={after(rng)}',
+                                        {}, None), (200,)),
+        'sections': (lambda rng: ('GET', '/api/section', {}, None), (200,)),
+        'top_rated': (lambda rng: ('GET', '/api/ebook/top?by=rating', {}, None), (200,)),
+        'most_borrowed': (lambda rng: ('GET', '/api/ebook/top?by=borrows&limit=5', {}, None), (200,)),
+        'search': (lambda rng: ('GET', f'/api/search?q={rng.choice(terms)}&limit=20', {}, None), (200,)),
+        'request_list': (lambda rng: ('GET', '/api/request?limit=50', librarian, None), (200,)),
+        'request_list_granted': (lambda rng: ('GET', '/api/request?status=granted&limit=50', librarian, None), (200,)),
+        'feedback_list': (lambda rng: ('GET', '/api/feedback?limit=50', librarian, None), (200,)),
+        'dashboard': (lambda rng: ('GET', '/api/librarian/dashboard', librarian, None), (200,)),
+        'trends': (lambda rng: ('GET', '/api/librarian/trends?days=90', librarian, None), (200,)),
+    }
+    if ebook_ids:
+        scenarios['similar'] = (lambda rng: ('GET', f'/api/ebook/{rng.choice(ebook_ids)}/similar', {}, None), (200,))
+    if readers:
+        scenarios['recommendations'] = (lambda rng: ('GET', '/api/user/recommendations', rng.choice(readers), None),
+                                        (200,))
+        scenarios['user_stats'] = (lambda rng: ('GET', '/api/user/stats', rng.choice(readers), None), (200,))
+        scenarios['own_requests'] = (lambda rng: ('GET', '/api/request?limit=50', rng.choice(readers), None), (200,))
+    if loans:
+        def content(rng, ranged=False):
+            headers, ebook_id = rng.choice(loans)
+            if ranged:
+                headers = dict(headers, Range=f'bytes={rng.randrange(16384)}-{rng.randrange(16384, 65536)}')
+            return 'GET', f'/api/ebook/{ebook_id}/content', headers, None
+
+        scenarios['content'] = (content, (200,))
+        scenarios['content_range'] = (lambda rng: content(rng, ranged=True), (200, 206, 416))
+    if writes and readers:
+        # Refusals at the loan limit or for a repeated request are part of the workload
+        scenarios['request_post'] = (lambda rng: ('POST', '/api/request', rng.choice(readers),
+                                                  {'ebook_id': rng.choice(ebook_ids)}), (200, 400))
+    return scenarios
+
+def run_scenario(send, make_request, expected, concurrency, total, warmup=SUITE_WARMUP, seed=0):
+    """Issue ``total`` requests from ``concurrency`` threads through
+    ``send(method, path, headers, json) -> status``."""
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        send(*make_request(rng))
+
+    latencies = []
+    errors = 0
+    issued = 0
+    lock = threading.Lock()
+
+    def worker(number):
+        nonlocal errors, issued
+        rng = random.Random(seed * 1000 + number)
+        while True:
+            with lock:
+                if issued >= total:
+                    return
+                issued += 1
+            arguments = make_request(rng)
+            started = time.perf_counter()
+            status = send(*arguments)
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status in expected:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latency_summary(latencies, time.perf_counter() - started, errors)
+
+def flask_client_sender(app):
+    clients = threading.local()
+
+    def send(method, path, headers, json):
+        if not hasattr(clients, 'client'):
+            clients.client = app.test_client()
+        response = clients.client.open(path, method=method, headers=headers, json=json)
+        response.get_data()
+        return response.status_code
+    return send
+
+def http_sender(base_url):
+    import httpx
+
+    client = httpx.Client(base_url=base_url, timeout=60)
+
+    def send(method, path, headers, json):
+        try:
+            return client.request(method, path, headers=headers, json=json).status_code
+        except httpx.HTTPError:
+            return None
+    return send
+
+def git_commit():
+    import subprocess
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+def dataset_summary():
+    from models import Section, Ebook, User, Request, Feedback
+
+    return {model.__tablename__: db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+            for model in (Section, Ebook, User, Request, Feedback)}
+
+def run_suite(app, base_url=None, concurrency=SUITE_CONCURRENCY, total=SUITE_REQUESTS, only=None,
+              writes=False, seed=0):
+    """Run the endpoint suite against ``app`` through the test client, or
+    against a server on ``base_url`` serving the same database, and return
+    the results with the metadata needed to compare runs."""
+    import platform
+
+    fixtures = suite_fixtures(seed)
+    scenarios = suite_scenarios(fixtures, writes=writes)
+    if only:
+        scenarios = {name: scenarios[name] for name in only if name in scenarios}
+    send = http_sender(base_url) if base_url else flask_client_sender(app)
+
+    endpoints = {}
+    for name, (make_request, expected) in scenarios.items():
+        endpoints[name] = run_scenario(send, make_request, expected, concurrency, total, seed=seed)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'target': base_url or 'test_client',
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+            'sqlite_profile': app.config.get('SQLITE_PROFILE'),
+            'dataset': dataset_summary(),
+            'concurrency': concurrency,
+            'requests': total,
+            'writes': writes,
+            'seed': seed,
+            'python': platform.python_version(),
+            'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs',
+        },
+        'endpoints': endpoints,
+    }
+
+def compare_results(baseline, candidate, metrics=('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second')):
+    """Per endpoint and metric, ``(baseline, candidate, percent change)`` for
+    the endpoints both runs have."""
+    comparison = {}
+    for name in baseline['endpoints']:
+        if name not in candidate['endpoints']:
+            continue
+        rows = {}
+        for metric in metrics:
+            before = baseline['endpoints'][name][metric]
+            after = candidate['endpoints'][name][metric]
+            change = round((after - before) / before * 100, 1) if before and after is not None else None
+            rows[metric] = (before, after, change)
+        comparison[name] = rows
+    return comparison
@@ -0,0 +1,216 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal
+from models import db, User, Request
+
+# User.no_of_books is the authoritative count of a user's granted requests.
+# Every transition in and out of 'granted' goes through here and moves the
+# counter in the same transaction, with the limit enforced by a conditional
+# UPDATE rather than a count read beforehand, so concurrent grants can't
+# push a user past MAX_ACTIVE_LOANS. The first statement of each transition
+# is a write, which takes SQLite's write lock before anything is decided.
+
+MAX_ACTIVE_LOANS = 5
+LOAN_PERIOD = timedelta(days=7)
+
+loans = func.coalesce(User.no_of_books, 0)
+
+class BorrowingError(ValueError):
+    pass
+
+def _update(statement):
+    return db.session.execute(statement, execution_options={'synchronize_session': False})
+
+def request_ebook(user_id, ebook_id, now=None):
+    """Open a request unless the user is at the limit or already asked for the book."""
+    now = now or datetime.utcnow()
+    pending = db.select(Request.request_id).where(
+        Request.user_id == user_id, Request.ebook_id == ebook_id, Request.status == 'requested'
+    ).exists()
+    result = db.session.execute(
+        db.insert(Request).from_select(
+            ['user_id', 'ebook_id', 'status', 'date_requested'],
+            db.select(User.user_id, literal(ebook_id), literal('requested'), literal(now))
+            .where(User.user_id == user_id, loans < MAX_ACTIVE_LOANS, ~pending)
+        ).returning(Request.request_id)
+    ).scalar()
+    if result is None:
+        if db.session.execute(db.select(pending)).scalar():
+            raise BorrowingError('You have already requested this e-book')
+        raise BorrowingError(f'You have reached the maximum limit of {MAX_ACTIVE_LOANS} active e-book requests')
+    return result
+
+def grant_request(request_id, now=None):
+    now = now or datetime.now()
+    borrower = db.select(Request.user_id).where(
+        Request.request_id == request_id, Request.status != 'granted'
+    ).scalar_subquery()
+    taken = _update(
+        db.update(User).where(User.user_id == borrower, loans < MAX_ACTIVE_LOANS).values(no_of_books=loans + 1)
+    ).rowcount
+    if not taken:
+        status = db.session.execute(db.select(Request.status).where(Request.request_id == request_id)).scalar()
+        if status is None:
+            raise BorrowingError('Request not found')
+        if status == 'granted':
+            raise BorrowingError('Request is already granted')
+        raise BorrowingError('User has already borrowed the maximum number of books')
+    # The counter update holds the write lock, so the request is still ungranted
+    _update(
+        db.update(Request).where(Request.request_id == request_id)
+        .values(status='granted', date_granted=now, return_date=now + LOAN_PERIOD)
+    )
+
+def revoke_request(request_id, now=None):
+    now = now or datetime.now()
+    user_id = _update(
+        db.update(Request)
+        .where(Request.request_id == request_id, Request.status == 'granted')
+        .values(status='revoked', date_revoked=now)
+        .returning(Request.user_id)
+    ).scalar()
+    if user_id is not None:
+        release_loans({user_id: 1})
+    else:
+        _update(
+            db.update(Request)
+            .where(Request.request_id == request_id, Request.status != 'revoked')
+            .values(status='revoked', date_revoked=now)
+        )
+
+def return_request(request_id, user_id, now=None):
+    now = now or datetime.now()
+    returned = _update(
+        db.update(Request)
+        .where(Request.request_id == request_id, Request.user_id == user_id, Request.status == 'granted')
+        .values(status='returned', date_revoked=now)
+    ).rowcount
+    if not returned:
+        raise BorrowingError('Invalid return request')
+    release_loans({user_id: 1})
+
+def _targets(request_ids):
+    return {row.request_id: row for row in db.session.execute(
+        db.select(Request.request_id, Request.user_id, Request.status).where(Request.request_id.in_(request_ids))
+    )}
+
+def grant_requests(request_ids, now=None):
+    """Grant many requests in one transaction, in request id order.
+
+    Each user gets at most what is left of their MAX_ACTIVE_LOANS. The
+    counters are read in one query; the request rows are then granted with
+    one UPDATE ... RETURNING, which takes the write lock, and the counters
+    moved by what it actually granted, under a guard that rejects a
+    concurrent grant that slipped in between. Returns
+    ``{request_id: outcome}``; raises BorrowingError if anything changed
+    under the batch, which the caller rolls back."""
+    now = now or datetime.now()
+    targets = _targets(request_ids)
+    outcomes = {request_id: 'not_found' for request_id in request_ids if request_id not in targets}
+    pending = [targets[request_id] for request_id in sorted(targets)]
+    for row in pending:
+        if row.status == 'granted':
+            outcomes[row.request_id] = 'already_granted'
+    pending = [row for row in pending if row.status != 'granted']
+
+    capacity = {user_id: MAX_ACTIVE_LOANS - counted for user_id, counted in db.session.execute(
+        db.select(User.user_id, loans).where(User.user_id.in_({row.user_id for row in pending}))
+    )}
+    granted = []
+    for row in pending:
+        if capacity.get(row.user_id, 0) > 0:
+            capacity[row.user_id] -= 1
+            granted.append(row)
+            outcomes[row.request_id] = 'granted'
+        else:
+            outcomes[row.request_id] = 'limit_reached'
+    if not granted:
+        return outcomes
+
+    borrowers = _update(
+        db.update(Request)
+        .where(Request.request_id.in_([row.request_id for row in granted]), Request.status != 'granted')
+        .values(status='granted', date_granted=now, return_date=now + LOAN_PERIOD)
+        .returning(Request.user_id)
+    ).scalars().all()
+    if len(borrowers) != len(granted):
+        raise BorrowingError('Requests were granted elsewhere during the batch, retry it')
+
+    taken = Counter(borrowers)
+    users = User.__table__
+    counted = func.coalesce(users.c.no_of_books, 0)
+    result = db.session.execute(
+        db.update(users)
+        .where(users.c.user_id == db.bindparam('borrower'),
+               counted + db.bindparam('count') <= MAX_ACTIVE_LOANS)
+        .values(no_of_books=counted + db.bindparam('count')),
+        [{'borrower': user_id, 'count': count} for user_id, count in taken.items()]
+    )
+    if result.rowcount != len(taken):
+        raise BorrowingError('Loan counters changed during the batch, retry it')
+    return outcomes
+
+def revoke_requests(request_ids, now=None):
+    """Revoke many requests in one transaction, releasing the loans of the
+    granted ones. Returns ``{request_id: outcome}``."""
+    now = now or datetime.now()
+    targets = _targets(request_ids)
+    outcomes = {request_id: 'not_found' for request_id in request_ids if request_id not in targets}
+    for request_id, row in targets.items():
+        outcomes[request_id] = 'already_revoked' if row.status == 'revoked' else 'revoked'
+
+    released = _update(
+        db.update(Request)
+        .where(Request.request_id.in_(targets), Request.status == 'granted')
+        .values(status='revoked', date_revoked=now)
+        .returning(Request.user_id)
+    ).scalars().all()
+    release_loans(Counter(released))
+    _update(
+        db.update(Request)
+        .where(Request.request_id.in_(targets), Request.status != 'revoked')
+        .values(status='revoked', date_revoked=now)
+    )
+    return outcomes
+
+def release_loans(released):
+    """Take ``released[user_id]`` loans off each user's counter."""
+    if released:
+        # Against the table, so the executemany isn't taken for an ORM bulk update by primary key
+        users = User.__table__
+        db.session.execute(
+            db.update(users).where(users.c.user_id == db.bindparam('released_user'))
+            .values(no_of_books=func.max(func.coalesce(users.c.no_of_books, 0) - db.bindparam('count'), 0)),
+            [{'released_user': user_id, 'count': count} for user_id, count in released.items()]
+        )
+
+def recount_loans(user_ids=None):
+    """Reset no_of_books from the granted requests, for ``user_ids`` or everyone."""
+    active_loans = db.select(func.count(Request.request_id)).where(
+        Request.user_id == User.user_id, Request.status == 'granted'
+    ).scalar_subquery()
+    statement = db.update(User).values(no_of_books=active_loans)
+    if user_ids is not None:
+        statement = statement.where(User.user_id.in_(user_ids))
+    _update(statement)
+
+def loan_drift():
+    """Users whose counter disagrees with their granted requests, as
+    ``(user_id, counted, actual)`` rows."""
+    actual = (
+        db.select(Request.user_id, func.count().label('actual'))
+        .where(Request.status == 'granted').group_by(Request.user_id).subquery()
+    )
+    actual_loans = func.coalesce(actual.c.actual, 0)
+    return db.session.execute(
+        db.select(User.user_id, User.no_of_books.label('counted'), actual_loans.label('actual'))
+        .outerjoin(actual, actual.c.user_id == User.user_id)
+        .where(User.no_of_books.is_(None) | (User.no_of_books != actual_loans))
+    ).all()
+
+def reconcile_loans(fix=True):
+    drift = loan_drift()
+    if drift and fix:
+        recount_loans([row.user_id for row in drift])
+        db.session.commit()
+    return drift
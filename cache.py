@@ -1,3 +1,168 @@
+from flask import current_app
 from flask_caching import Cache
+from flask_caching.backends.base import BaseCache
+from collections import OrderedDict
+import threading
+import time
+from routing import use_primary, REPLICA_LAG_WINDOW
 
-cache = Cache()
\ No newline at end of file
+cache = Cache()
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+stats = CacheStats()
+
+
+class LRUCache(BaseCache):
+    """In-process cache bounded to ``threshold`` entries, evicting the least
+    recently used one. Values are stored as-is, so callers must not mutate
+    what they get back. Only for a single process: bumps made by Celery
+    workers or other web workers never reach it."""
+
+    def __init__(self, threshold=1024, default_timeout=300, **kwargs):
+        super().__init__(default_timeout=default_timeout)
+        self._threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(dict(threshold=config['CACHE_THRESHOLD']))
+        return cls(*args, **kwargs)
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, timeout):
+        self._entries[key] = (self._expiry(timeout), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._threshold:
+            self._entries.popitem(last=False)
+            stats.record('evictions')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            return entry[1] if entry else None
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._store(key, value, timeout)
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._live_entry(key):
+                return False
+            self._store(key, value, timeout)
+        return True
+
+    def inc(self, key, delta=1):
+        with self._lock:
+            entry = self._live_entry(key)
+            value = (entry[1] if entry else 0) + delta
+            self._store(key, value, 0)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def has(self, key):
+        with self._lock:
+            return self._live_entry(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+
+# Cached reads are keyed on a per-namespace generation number. Writers bump
+# the generation after committing, which orphans every entry cached under the
+# old one, so a cached value never outlives the write that changed it. A
+# generation is seeded from the clock, so one lost to eviction or a restart
+# cannot come back to an old value. Until the replicas have had time to catch
+# up with a write, misses load from the primary, so a lagging replica can't
+# get its old answer cached under the new generation.
+
+def _generation_key(namespace):
+    return f'generation:{namespace}'
+
+def generation(namespace):
+    value = cache.get(_generation_key(namespace))
+    if value is None:
+        cache.add(_generation_key(namespace), time.time_ns() // 1000, timeout=0)
+        value = cache.get(_generation_key(namespace))
+    return value
+
+def _fresh_key(namespace):
+    return f'fresh:{namespace}'
+
+def bump(*namespaces):
+    window = current_app.config.get('REPLICA_LAG_WINDOW', REPLICA_LAG_WINDOW)
+    for namespace in namespaces:
+        if cache.get(_generation_key(namespace)) is None:
+            generation(namespace)
+        cache.cache.inc(_generation_key(namespace))
+        cache.set(_fresh_key(namespace), True, timeout=window)
+
+def is_shared():
+    """Whether bumps made here reach other processes; LRUCache lives in one."""
+    return not isinstance(cache.cache, LRUCache)
+
+def read_through(namespace, key, loader, timeout=None):
+    cache_key = f'{namespace}:{generation(namespace)}:{key}'
+    value = cache.get(cache_key)
+    if value is not None:
+        stats.record('hits')
+        return value
+    stats.record('misses')
+    if cache.get(_fresh_key(namespace)) is not None:
+        with use_primary():
+            value = loader()
+    else:
+        value = loader()
+    cache.set(cache_key, value, timeout=timeout)
+    return value
+
+def cache_stats():
+    result = stats.as_dict()
+    result['backend'] = type(cache.cache).__name__
+    redis_client = getattr(cache.cache, '_read_client', None)
+    if redis_client is not None:
+        # Redis evicts on its own, so report the server's counter
+        result['evictions'] = redis_client.info('stats').get('evicted_keys')
+    return result
@@ -0,0 +1,48 @@
+from collections import Counter
+from models import db, Section, Ebook, Request, Feedback
+from borrowing import release_loans
+
+# Deleting ebooks takes their feedback and requests with them. Each table is
+# cleared with one DELETE ... WHERE ebook_id IN (...) rather than a statement
+# per book, and the loans of granted requests are released from their
+# borrowers' counters in the same transaction.
+
+CASCADE_CHUNK_SIZE = 500
+
+def _delete(statement):
+    return db.session.execute(statement, execution_options={'synchronize_session': False})
+
+def delete_ebooks(ebook_ids):
+    """Delete the ebooks selected by ``ebook_ids``, a list or a select of ids.
+    Returns how many were deleted; the caller commits."""
+    _delete(db.delete(Feedback).where(Feedback.ebook_id.in_(ebook_ids)))
+    # The loans to release come back from the DELETE itself, so a grant
+    # committed after a separate read could not be missed
+    deleted_requests = _delete(
+        db.delete(Request).where(Request.ebook_id.in_(ebook_ids)).returning(Request.user_id, Request.status)
+    ).all()
+    deleted = _delete(db.delete(Ebook).where(Ebook.ebook_id.in_(ebook_ids))).rowcount
+    release_loans(Counter(row.user_id for row in deleted_requests if row.status == 'granted'))
+    return deleted
+
+def delete_section(section_id):
+    deleted = delete_ebooks(db.select(Ebook.ebook_id).where(Ebook.section_id == section_id))
+    _delete(db.delete(Section).where(Section.section_id == section_id))
+    return deleted
+
+def delete_section_chunks(section_id, chunk_size=CASCADE_CHUNK_SIZE):
+    """Delete a section's ebooks ``chunk_size`` at a time, committing after
+    each chunk so the write lock is only ever held briefly, then the section."""
+    deleted = 0
+    while True:
+        ebook_ids = db.session.execute(
+            db.select(Ebook.ebook_id).where(Ebook.section_id == section_id)
+            .order_by(Ebook.ebook_id).limit(chunk_size)
+        ).scalars().all()
+        if not ebook_ids:
+            break
+        deleted += delete_ebooks(ebook_ids)
+        db.session.commit()
+    _delete(db.delete(Section).where(Section.section_id == section_id))
+    db.session.commit()
+    return deleted
@@ -0,0 +1,223 @@
+from datetime import datetime
+import csv
+import io
+import json
+import os
+import time
+from models import db, Section, Ebook
+from content import store_contents, read_content
+
+IMPORT_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 200
+EXPORT_FIELDS = ['id', 'title', 'author', 'section', 'content']
+MAX_NAME_LENGTH = 100
+
+class RowError(ValueError):
+    pass
+
+def parse_rows(stream, fmt):
+    """Yield ``(line_number, row)`` from a binary JSONL or CSV stream, one row at a time."""
+    reader = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        rows = csv.DictReader(reader)
+        for row in rows:
+            yield rows.line_num, row
+    else:
+        for line_number, line in enumerate(reader, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {'_error': f'Invalid JSON: {e}'}
+            if not isinstance(row, dict):
+                row = {'_error': 'Each line must be a JSON object'}
+            yield line_number, row
+
+def detect_format(filename, content_type=None):
+    if (content_type or '').startswith('text/csv') or (filename or '').lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+def directory_content_loader(directory):
+    root = os.path.realpath(directory)
+
+    def load(name):
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            raise RowError(f'Content file not found: {name}')
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    return load
+
+def text_field(row, name):
+    """A text field of the row, '' when missing or null; JSON rows can hold any type."""
+    value = row.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise RowError(f'{name} must be a string')
+    return value
+
+def validate_row(row, load_content):
+    if '_error' in row:
+        raise RowError(row['_error'])
+    title = (text_field(row, 'title') or text_field(row, 'ebook_name')).strip()
+    author = text_field(row, 'author').strip()
+    section_name = text_field(row, 'section').strip()
+    section_id = row.get('section_id') or None
+    if not title or not author:
+        raise RowError('title and author are required')
+    if len(title) > MAX_NAME_LENGTH or len(author) > MAX_NAME_LENGTH:
+        raise RowError(f'title and author are limited to {MAX_NAME_LENGTH} characters')
+    if section_id is not None:
+        try:
+            section_id = int(section_id)
+        except (TypeError, ValueError):
+            raise RowError(f'Invalid section_id {section_id}')
+    elif not section_name:
+        raise RowError('section or section_id is required')
+    elif len(section_name) > MAX_NAME_LENGTH:
+        raise RowError(f'section is limited to {MAX_NAME_LENGTH} characters')
+
+    content = text_field(row, 'content')
+    content_file = text_field(row, 'content_file')
+    if not content and content_file:
+        if load_content is None:
+            raise RowError('content_file given but no content files were supplied')
+        content = load_content(content_file)
+    if not content:
+        raise RowError('content or content_file is required')
+    return {'title': title, 'author': author, 'section_id': section_id, 'section': section_name, 'content': content}
+
+def resolve_sections(rows, section_ids):
+    """Fill in section_id for rows that name their section, creating sections
+    seen for the first time. ``section_ids`` caches name -> id across batches."""
+    missing = {row['section'] for row in rows if row['section_id'] is None} - section_ids.keys()
+    if missing:
+        for section_id, name in db.session.execute(
+            db.select(Section.section_id, Section.section_name).where(Section.section_name.in_(missing))
+        ):
+            section_ids.setdefault(name, section_id)
+        for name in sorted(missing - section_ids.keys()):
+            section = Section(section_name=name, section_description='Created by catalog import')
+            db.session.add(section)
+            db.session.flush()
+            section_ids[name] = section.section_id
+    for row in rows:
+        if row['section_id'] is None:
+            row['section_id'] = section_ids[row['section']]
+
+def import_batch(batch, load_content, section_ids):
+    errors = []
+    valid = []
+    for line_number, row in batch:
+        try:
+            valid.append((line_number, validate_row(row, load_content)))
+        except RowError as e:
+            errors.append({'line': line_number, 'error': str(e)})
+
+    given_ids = {row['section_id'] for _, row in valid if row['section_id'] is not None}
+    existing_ids = set()
+    if given_ids:
+        existing_ids = set(db.session.execute(
+            db.select(Section.section_id).where(Section.section_id.in_(given_ids))
+        ).scalars())
+    rows = []
+    for line_number, row in valid:
+        if row['section_id'] is not None and row['section_id'] not in existing_ids:
+            errors.append({'line': line_number, 'error': f"Unknown section_id {row['section_id']}"})
+        else:
+            rows.append(row)
+    if not rows:
+        return 0, errors
+    resolve_sections(rows, section_ids)
+
+    now = datetime.utcnow()
+    content_hashes = store_contents([row['content'] for row in rows])
+    ebook_rows = [{
+        'ebook_name': row['title'],
+        'author': row['author'],
+        'section_id': row['section_id'],
+        'content_hash': content_hash,
+        'date_modified': now
+    } for row, content_hash in zip(rows, content_hashes)]
+    # One executemany; RETURNING hands back the new ids in parameter order
+    ebook_ids = db.session.execute(
+        db.insert(Ebook).returning(Ebook.ebook_id, sort_by_parameter_order=True), ebook_rows
+    ).scalars().all()
+    return len(ebook_ids), errors
+
+def import_catalog(rows, load_content=None, batch_size=IMPORT_BATCH_SIZE):
+    """Insert ebooks from ``(line_number, row)`` pairs in batched transactions.
+
+    A batch that fails as a whole is rolled back and reported; the batches
+    before and after it still commit. Memory is bounded by ``batch_size``."""
+    report = {'imported': 0, 'failed': 0, 'batches': []}
+    section_ids = {}
+    batch = []
+
+    def flush(batch):
+        started = time.perf_counter()
+        try:
+            imported, errors = import_batch(batch, load_content, section_ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            section_ids.clear()
+            imported, errors = 0, [{'line': batch[0][0], 'error': f'Batch rolled back: {e}'}]
+        failed = len(batch) - imported
+        report['imported'] += imported
+        report['failed'] += failed
+        report['batches'].append({
+            'batch': len(report['batches']) + 1,
+            'rows': len(batch),
+            'imported': imported,
+            'errors': errors,
+            'seconds': round(time.perf_counter() - started, 4)
+        })
+
+    for item in rows:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return report
+
+def export_catalog(fmt='jsonl', include_content=True, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the catalog as JSONL lines or CSV rows, ``batch_size`` ebooks at a time."""
+    fields = EXPORT_FIELDS if include_content else EXPORT_FIELDS[:-1]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+
+    def encode(record):
+        if fmt != 'csv':
+            return json.dumps(record) + '\n'
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(record)
+        return buffer.getvalue()
+
+    if fmt == 'csv':
+        yield buffer.getvalue()
+
+    last_id = 0
+    while True:
+        ebooks = db.session.execute(
+            db.select(Ebook.ebook_id, Ebook.ebook_name, Ebook.author, Section.section_name, Ebook.content_hash)
+            .join(Section, Ebook.section_id == Section.section_id)
+            .where(Ebook.ebook_id > last_id).order_by(Ebook.ebook_id).limit(batch_size)
+        ).all()
+        if not ebooks:
+            break
+        for ebook in ebooks:
+            record = {'id': ebook.ebook_id, 'title': ebook.ebook_name, 'author': ebook.author,
+                      'section': ebook.section_name}
+            if include_content:
+                record['content'] = read_content(ebook.content_hash) if ebook.content_hash else ''
+            yield encode(record)
+        last_id = ebooks[-1].ebook_id
@@ -3,7 +3,7 @@ from celery.schedules import crontab
 beat_schedule = {
     'daily-reminder': {
         'task': 'tasks.daily_reminders',
-        'schedule': crontab(minute='*'),
+        'schedule': crontab(hour=8, minute=0),
     }
 }
 
@@ -0,0 +1,139 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert
+from datetime import datetime
+import hashlib
+import zlib
+from models import db, ContentBlob, ContentChunk
+
+# Ebook bodies live in a content-addressed store: one content_blob row per
+# distinct text, keyed by its sha256 like checksum.py's directory hashes,
+# and its bytes split into independently zlib-compressed content_chunk rows.
+# Ebooks point at a blob through ebook.content_hash.
+
+CONTENT_CHUNK_SIZE = 64 * 1024
+COMPRESSION_LEVEL = 6
+
+# A blob is dropped once the last ebook pointing at it is deleted or moves
+# to other content.
+CONTENT_BLOB_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS content_blob_release_delete AFTER DELETE ON ebook
+    WHEN NOT EXISTS (SELECT 1 FROM ebook WHERE content_hash = OLD.content_hash)
+    BEGIN
+        DELETE FROM content_chunk WHERE content_hash = OLD.content_hash;
+        DELETE FROM content_blob WHERE content_hash = OLD.content_hash;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS content_blob_release_update AFTER UPDATE OF content_hash ON ebook
+    WHEN OLD.content_hash IS NOT NEW.content_hash
+        AND NOT EXISTS (SELECT 1 FROM ebook WHERE content_hash = OLD.content_hash)
+    BEGIN
+        DELETE FROM content_chunk WHERE content_hash = OLD.content_hash;
+        DELETE FROM content_blob WHERE content_hash = OLD.content_hash;
+    END""",
+]
+
+def inflate(data):
+    return zlib.decompress(data) if data is not None else None
+
+# inflate() as an SQL function on every SQLite connection, for the search
+# index's ebook_search_source view and the triggers that read it. Writes to
+# ebook from a connection without it, like the sqlite3 shell, fail.
+@event.listens_for(Engine, 'connect')
+def _register_inflate(dbapi_connection, connection_record):
+    create_function = getattr(dbapi_connection, 'create_function', None)
+    if create_function is not None:
+        create_function('inflate', 1, inflate, deterministic=True)
+
+def create_content_triggers(connection):
+    for trigger in CONTENT_BLOB_TRIGGERS:
+        connection.execute(text(trigger))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_content_triggers(target, connection, **kw):
+    create_content_triggers(connection)
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def store_contents(contents):
+    """Store each text unless an identical blob exists; return their hashes.
+
+    Existing blobs are looked up with one query and the new ones written with
+    one executemany per table, so bulk loads don't pay a round trip per book."""
+    encoded = {}
+    digests = []
+    for content in contents:
+        data = content.encode('utf-8')
+        digest = content_hash(data)
+        encoded.setdefault(digest, data)
+        digests.append(digest)
+
+    existing = set(db.session.execute(
+        db.select(ContentBlob.content_hash).where(ContentBlob.content_hash.in_(encoded))
+    ).scalars())
+    blobs = []
+    chunks = []
+    now = datetime.utcnow()
+    for digest, data in encoded.items():
+        if digest in existing:
+            continue
+        blob_chunks = [
+            {'content_hash': digest, 'seq': seq, 'data': zlib.compress(data[start:start + CONTENT_CHUNK_SIZE], COMPRESSION_LEVEL)}
+            for seq, start in enumerate(range(0, len(data), CONTENT_CHUNK_SIZE))
+        ]
+        blobs.append({
+            'content_hash': digest,
+            'size': len(data),
+            'stored_size': sum(len(chunk['data']) for chunk in blob_chunks),
+            'chunk_size': CONTENT_CHUNK_SIZE,
+            'date_created': now
+        })
+        chunks.extend(blob_chunks)
+
+    # Concurrent identical uploads race to the same primary key, the loser is a no-op
+    if blobs:
+        db.session.execute(insert(ContentBlob).on_conflict_do_nothing(), blobs)
+    if chunks:
+        db.session.execute(insert(ContentChunk).on_conflict_do_nothing(), chunks)
+    return digests
+
+def store_content(content):
+    return store_contents([content])[0]
+
+def content_length(digest):
+    return db.session.execute(db.select(ContentBlob.size).where(ContentBlob.content_hash == digest)).scalar()
+
+def chunk_span(size, chunk_size, start, stop):
+    """Clamp ``stop`` to the blob and return it with the chunk numbers the range covers."""
+    stop = size if stop is None else min(stop, size)
+    return stop, range(start // chunk_size, (stop - 1) // chunk_size + 1 if stop > start else 0)
+
+def chunk_query(digest, seq):
+    return db.select(ContentChunk.data).where(ContentChunk.content_hash == digest, ContentChunk.seq == seq)
+
+def inflate_chunk(data, seq, chunk_size, start, stop):
+    chunk = zlib.decompress(data)
+    offset = seq * chunk_size
+    return chunk[max(start - offset, 0):stop - offset]
+
+def iter_content(digest, start=0, stop=None):
+    """Yield the UTF-8 bytes of a blob from ``start`` up to ``stop``.
+
+    Only the chunks overlapping the range are read and inflated, one at a
+    time, so memory stays at one chunk whatever the size of the book."""
+    blob = db.session.get(ContentBlob, digest)
+    if blob is None:
+        return
+    stop, sequence = chunk_span(blob.size, blob.chunk_size, start, stop)
+    for seq in sequence:
+        data = db.session.execute(chunk_query(digest, seq)).scalar()
+        yield inflate_chunk(data, seq, blob.chunk_size, start, stop)
+
+def read_content(digest):
+    return b''.join(iter_content(digest)).decode('utf-8')
+
+def set_ebook_content(ebook, content):
+    # The search triggers reindex the body when content_hash changes
+    ebook.content_hash = store_content(content)
+    ebook.date_modified = datetime.utcnow()
+    db.session.flush()
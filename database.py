@@ -0,0 +1,134 @@
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from functools import wraps
+import random
+import time
+from models import db
+
+# Per-connection settings for the SQLite file shared by the web app, the
+# APScheduler jobs and the Celery workers. WAL lets readers run alongside the
+# single writer, and busy_timeout makes a writer wait for the lock instead of
+# failing straight away with "database is locked".
+SQLITE_PROFILES = {
+    'default': {
+        'pragmas': {},
+        'engine_options': {}
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            # Durable at every checkpoint; a power loss can only drop the last commits
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            # Negative sizes are KiB, so 64 MiB of page cache per connection
+            'cache_size': -64 * 1024,
+            'temp_store': 'MEMORY'
+        },
+        'engine_options': {
+            # WAL readers don't block each other, so a pool can serve the
+            # request threads; writes still serialize on the database lock
+            'pool_size': 8,
+            'max_overflow': 8,
+            'pool_timeout': 30,
+            'pool_pre_ping': False,
+            'connect_args': {'timeout': 5}
+        }
+    }
+}
+
+BUSY_RETRIES = 5
+BUSY_BASE_DELAY = 0.05
+BUSY_MAX_DELAY = 1.0
+
+def engine_options(profile):
+    return dict(SQLITE_PROFILES[profile]['engine_options'])
+
+def set_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+def replica_binds(urls, primary_path, profile):
+    """SQLALCHEMY_BINDS entries for the read replicas.
+
+    ``urls`` are replica database URLs, e.g. Postgres streaming replicas.
+    Without any, the production profile reads through a second, read-only
+    engine on the primary SQLite file, which WAL lets run alongside the
+    writer."""
+    if not urls and profile == 'production':
+        urls = [f'sqlite:///file:{primary_path}?mode=ro&uri=true']
+    binds = {}
+    for number, url in enumerate(urls):
+        options = {'url': url}
+        if not url.startswith('sqlite'):
+            options.update(connect_args={}, pool_pre_ping=True)
+        binds[f'replica_{number}'] = options
+    return binds
+
+def configure_engine(engine, profile, readonly=False):
+    """Apply the profile's pragmas to every new connection of ``engine``."""
+    pragmas = dict(SQLITE_PROFILES[profile]['pragmas'])
+    if readonly and pragmas:
+        # The journal mode belongs to the database file and only a writer can change it
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 'ON'
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        set_pragmas(dbapi_connection, pragmas)
+
+def init_app(app):
+    profile = app.config.get('SQLITE_PROFILE', 'default')
+    with app.app_context():
+        configure_engine(db.engine, profile)
+        for key in app.config.get('SQLALCHEMY_REPLICAS', []):
+            configure_engine(db.engines[key], profile, readonly=True)
+
+def scratch_app(path, profile='production'):
+    """A bare Flask app on the SQLite file ``path``, for tools that work on a
+    database other than the app's own."""
+    scratch = Flask(__name__)
+    scratch.config.update(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}',
+        SQLALCHEMY_ENGINE_OPTIONS=engine_options(profile),
+        SQLITE_PROFILE=profile
+    )
+    db.init_app(scratch)
+    init_app(scratch)
+    return scratch
+
+def is_busy_error(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def busy_backoff(attempt, base_delay=BUSY_BASE_DELAY, max_delay=BUSY_MAX_DELAY):
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+def retry_on_busy(func=None, retries=BUSY_RETRIES, base_delay=BUSY_BASE_DELAY, max_delay=BUSY_MAX_DELAY):
+    """Retry a unit of work that lost the race for the SQLite write lock.
+
+    busy_timeout already waits for the lock, but a deferred transaction that
+    read before writing can't be saved by waiting and fails at once. The
+    session is rolled back and the whole function runs again after an
+    exponential backoff with jitter, so it has to do its reads and its
+    commit within the one call."""
+    if func is None:
+        return lambda func: retry_on_busy(func, retries, base_delay, max_delay)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if attempt == retries or not is_busy_error(e):
+                    raise
+                busy_backoff(attempt, base_delay, max_delay)
+    return wrapper
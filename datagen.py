@@ -0,0 +1,164 @@
+from sqlalchemy import text
+from datetime import datetime, timedelta
+import math
+import os
+import random
+import time
+import uuid
+from database import scratch_app
+from models import db, Role, RolesUsers, User, Section, Request, Feedback
+from borrowing import MAX_ACTIVE_LOANS, LOAN_PERIOD, recount_loans
+from catalog import import_catalog
+from migrations import MIGRATIONS
+from rollups import refresh_daily_rollups
+from stats import refresh_dashboard_counters
+from ratings import refresh_ebook_stats
+
+# A synthetic library for benchmarks, written straight into a new SQLite
+# file with the current schema. Everything is drawn from one seeded random
+# generator, so the same parameters always give the same database. Word and
+# book popularity follow Zipf-like curves and content sizes a log-normal one,
+# so searches, hot books and large downloads look like real traffic.
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'vor', 'shi', 'dun', 'el', 'pa', 'qua', 'ber',
+             'nix', 'to', 'sa', 'gor', 'li', 'um', 'fen', 'dro', 'ca', 'wen', 'ith', 'os']
+VOCABULARY_SIZE = 5000
+INSERT_BATCH_SIZE = 2000
+# Unusable as a password; benchmarks authenticate with tokens they mint themselves
+UNUSABLE_PASSWORD = '!'
+
+def vocabulary(rng, size=VOCABULARY_SIZE):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words, [1 / rank for rank in range(1, size + 1)]
+
+def zipf_picker(rng, population, exponent=1.0):
+    weights = [1 / rank ** exponent for rank in range(1, len(population) + 1)]
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return lambda: rng.choices(population, cum_weights=cumulative)[0]
+
+def content_text(rng, words, weights, size):
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            sentence = ' '.join(rng.choices(words, weights, k=rng.randint(6, 20)))
+            sentences.append(sentence[0].upper() + sentence[1:] + '.')
+        paragraph = ' '.join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)[:size]
+
+def content_size(rng, median_kb, spread=0.8, smallest=1024, largest=2 * 1024 * 1024):
+    return int(min(largest, max(smallest, rng.lognormvariate(math.log(median_kb * 1024), spread))))
+
+def _insert(model, rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + INSERT_BATCH_SIZE])
+
+def generate_library(path, sections=20, ebooks=2000, users=500, requests=10000, feedback=5000,
+                     content_kb=20, days=180, seed=42, now=None):
+    """Write a synthetic library to the new SQLite file ``path``; returns what was made."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(microsecond=0)
+    words, word_weights = vocabulary(rng)
+    started = time.perf_counter()
+
+    with scratch_app(path).app_context():
+        db.metadata.create_all(db.engine)
+        db.session.execute(text(f'PRAGMA user_version = {MIGRATIONS[-1][0]}'))
+
+        db.session.add(Role(name='librarian', description='Librarian'))
+        db.session.flush()
+        user_rows = [{
+            'email': 'librarian@iitm.in', 'username': 'librarian', 'password': UNUSABLE_PASSWORD,
+            'active': True, 'fs_uniquifier': uuid.UUID(int=rng.getrandbits(128)).hex, 'no_of_books': 0
+        }]
+        user_rows += [{
+            'email': f'reader{number}@example.com', 'username': f'reader{number}', 'password': UNUSABLE_PASSWORD,
+            'active': True, 'fs_uniquifier': uuid.UUID(int=rng.getrandbits(128)).hex, 'no_of_books': 0
+        } for number in range(1, users + 1)]
+        _insert(User, user_rows)
+        db.session.execute(db.insert(RolesUsers).values(user_id=1, role_id=1))
+
+        section_names = [f'{words[number].title()} Studies' for number in range(sections)]
+        _insert(Section, [{'section_name': name, 'section_description': f'Books on {name.lower()}',
+                           'date_created': now - timedelta(days=days)} for name in section_names])
+        db.session.commit()
+
+        authors = [f'{rng.choice(words).title()} {rng.choice(words).title()}' for _ in range(max(1, ebooks // 8))]
+        pick_section = zipf_picker(rng, section_names, exponent=0.6)
+        rows = ((number, {
+            'title': ' '.join(rng.choices(words, word_weights, k=rng.randint(2, 5))).title()[:100],
+            'author': rng.choice(authors),
+            'section': pick_section(),
+            'content': content_text(rng, words, word_weights, content_size(rng, content_kb))
+        }) for number in range(1, ebooks + 1))
+        report = import_catalog(rows)
+
+        ebook_ids = db.session.execute(text('SELECT ebook_id FROM ebook ORDER BY ebook_id')).scalars().all()
+        rng.shuffle(ebook_ids)
+        pick_ebook = zipf_picker(rng, ebook_ids, exponent=0.8)
+        reader_ids = list(range(2, users + 2))
+        loans = dict.fromkeys(reader_ids, 0)
+        request_rows = []
+        returned = []
+        for _ in range(requests):
+            user_id = rng.choice(reader_ids)
+            requested = now - timedelta(seconds=rng.randrange(days * 86400))
+            row = {'user_id': user_id, 'ebook_id': pick_ebook(), 'date_requested': requested,
+                   'status': 'requested', 'date_granted': None, 'date_revoked': None, 'return_date': None}
+            roll = rng.random()
+            if roll < 0.6 or (roll < 0.75 and loans[user_id] >= MAX_ACTIVE_LOANS):
+                granted = requested + timedelta(hours=rng.uniform(1, 48))
+                row.update(status='returned', date_granted=granted, return_date=granted + LOAN_PERIOD,
+                           date_revoked=granted + timedelta(hours=rng.uniform(1, 7 * 24)))
+                returned.append(row)
+            elif roll < 0.75:
+                # Current loans were granted inside the last loan period
+                granted = now - timedelta(seconds=rng.randrange(int(LOAN_PERIOD.total_seconds())))
+                row.update(status='granted', date_requested=min(requested, granted), date_granted=granted,
+                           return_date=granted + LOAN_PERIOD)
+                loans[user_id] += 1
+            elif roll < 0.85:
+                row.update(status='revoked', date_revoked=requested + timedelta(hours=rng.uniform(1, 72)))
+            request_rows.append(row)
+        request_rows.sort(key=lambda row: row['date_requested'])
+        _insert(Request, request_rows)
+
+        feedback_rows = []
+        for row in rng.sample(returned, min(feedback, len(returned))):
+            feedback_rows.append({
+                'user_id': row['user_id'], 'ebook_id': row['ebook_id'],
+                'rating': rng.choices([1, 2, 3, 4, 5], [5, 8, 20, 37, 30])[0],
+                'comment': ' '.join(rng.choices(words, word_weights, k=rng.randint(3, 30))).capitalize(),
+                'date_created': row['date_revoked']
+            })
+        feedback_rows.sort(key=lambda row: row['date_created'])
+        _insert(Feedback, feedback_rows)
+
+        recount_loans()
+        refresh_dashboard_counters()
+        refresh_ebook_stats()
+        db.session.commit()
+        refresh_daily_rollups(now)
+        db.session.commit()
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        db.engine.dispose()
+
+    return {
+        'path': path, 'seed': seed, 'sections': sections, 'ebooks': report['imported'], 'users': users,
+        'requests': len(request_rows), 'feedback': len(feedback_rows), 'content_kb': content_kb,
+        'seconds': round(time.perf_counter() - started, 1)
+    }
@@ -0,0 +1,57 @@
+from collections import Counter
+from datetime import datetime
+import time
+from models import db, User, Ebook, Request
+from borrowing import release_loans
+from database import retry_on_busy
+
+EXPIRY_BATCH_SIZE = 500
+
+def expire_requests(condition, new_status, now=None, batch_size=EXPIRY_BATCH_SIZE, details=False):
+    """Move granted requests matching ``condition`` to ``new_status``.
+
+    Works through the matches ``batch_size`` rows at a time. Each batch is one
+    bulk UPDATE of request and one executemany taking the released loans off
+    ``no_of_books`` of the users it touched, committed together. With
+    ``details`` the report lists the requests the UPDATE actually moved."""
+    now = now or datetime.now()
+    columns = [Request.request_id, Request.user_id]
+    if details:
+        columns += [Ebook.ebook_name, User.username]
+    report = {'processed': 0, 'batches': [], 'requests': []}
+
+    while True:
+        started = time.perf_counter()
+        query = db.select(*columns).where(Request.status == 'granted', condition)
+        if details:
+            query = query.join(Ebook, Request.ebook_id == Ebook.ebook_id).join(User, Request.user_id == User.user_id)
+        rows = db.session.execute(query.order_by(Request.request_id).limit(batch_size)).all()
+        if not rows:
+            break
+
+        request_ids = [row.request_id for row in rows]
+        # Only the rows still granted at update time release a loan
+        released = db.session.execute(
+            db.update(Request)
+            .where(Request.request_id.in_(request_ids), Request.status == 'granted')
+            .values(status=new_status, date_revoked=now)
+            .returning(Request.request_id, Request.user_id),
+            execution_options={'synchronize_session': False}
+        ).all()
+        release_loans(Counter(row.user_id for row in released))
+        db.session.commit()
+
+        report['processed'] += len(released)
+        report['batches'].append({'rows': len(released), 'seconds': round(time.perf_counter() - started, 4)})
+        if details:
+            changed = {row.request_id for row in released}
+            report['requests'].extend(row for row in rows if row.request_id in changed)
+
+    return report
+
+@retry_on_busy
+def revoke_overdue(now=None):
+    """Revoke every loan past its return date. Needs an app context, which
+    the retry's rollback uses too."""
+    now = now or datetime.now()
+    return expire_requests(Request.return_date <= now, 'revoked', now=now)
@@ -0,0 +1,135 @@
+from flask import Response, current_app, request
+from sqlalchemy import event
+from bisect import bisect_left
+from contextvars import ContextVar
+import heapq
+import threading
+import time
+from models import db
+
+# Per-request timings: wall time, how many SQL statements ran and how long
+# they took, recorded per endpoint and method into histograms served from
+# /metrics in the Prometheus text format. Requests slower than
+# SLOW_REQUEST_SECONDS are logged with their slowest statements. The hot
+# path is a few perf_counter() calls and a heap push per statement.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SLOW_REQUEST_SECONDS = 0.5
+SLOWEST_STATEMENTS = 3
+
+_current = ContextVar('request_stats', default=None)
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'sql_seconds', 'slowest')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.slowest = []
+
+    def record(self, statement, seconds):
+        self.statements += 1
+        self.sql_seconds += seconds
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: ([*counts], total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+request_duration = Histogram('lms_request_duration_seconds', 'Wall time of API requests.', LATENCY_BUCKETS)
+request_sql_duration = Histogram('lms_request_sql_duration_seconds',
+                                 'Time spent in SQL statements per API request.', LATENCY_BUCKETS)
+request_sql_statements = Histogram('lms_request_sql_statements',
+                                   'SQL statements executed per API request.', STATEMENT_BUCKETS)
+HISTOGRAMS = (request_duration, request_sql_duration, request_sql_statements)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None and conn.info.get('query_started'):
+        stats.record(statement, time.perf_counter() - conn.info['query_started'].pop())
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+def _start_request():
+    request.environ['lms.request_stats'] = _current.set(RequestStats())
+
+def _finish_request(response):
+    stats = _current.get()
+    if stats is None or request.endpoint is None or request.endpoint == 'metrics':
+        return response
+    elapsed = time.perf_counter() - stats.started
+    labels = (('endpoint', request.endpoint), ('method', request.method))
+    request_duration.observe(labels, elapsed)
+    request_sql_duration.observe(labels, stats.sql_seconds)
+    request_sql_statements.observe(labels, stats.statements)
+
+    if elapsed >= current_app.config.get('SLOW_REQUEST_SECONDS', SLOW_REQUEST_SECONDS):
+        slowest = ''.join(f'\n  {seconds * 1000:.1f} ms: {" ".join(statement.split())[:300]}'
+                          for seconds, statement in sorted(stats.slowest, reverse=True))
+        current_app.logger.warning(
+            f"Slow request {request.method} {request.full_path.rstrip('?')} ({request.endpoint}): "
+            f"{elapsed * 1000:.1f} ms, {stats.statements} statements, {stats.sql_seconds * 1000:.1f} ms in SQL"
+            f"{slowest}"
+        )
+    return response
+
+def _end_request(error=None):
+    token = request.environ.pop('lms.request_stats', None)
+    if token is not None:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Torn down from another context than the one the request started in
+            _current.set(None)
+
+def metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.exposition())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,146 @@
+from sqlalchemy import inspect, text
+from datetime import datetime
+import hashlib
+from models import (db, Ebook, Request, Feedback, DashboardCounter, create_dashboard_counter_triggers,
+                    DailyRequestRollup, DailyEbookRollup, RollupWatermark, MonthlyReport,
+                    ContentBlob, ContentChunk, EbookStats, EbookSimilarity)
+from stats import refresh_dashboard_counters
+from rollups import refresh_daily_rollups
+from search import rebuild_search_index, create_search_index, drop_search_index
+from content import store_content, create_content_triggers
+from ratings import refresh_ebook_stats, create_ebook_stats_triggers
+from recommendations import create_similarity_triggers
+
+# Schema changes for databases created before a model change. db.create_all()
+# builds new databases with the current schema, so every step has to be safe
+# to run against a database that already has it. The applied version is kept
+# in SQLite's PRAGMA user_version.
+
+def has_column(table, column):
+    return column in [col['name'] for col in inspect(db.session.connection()).get_columns(table)]
+
+def add_column(table, column, ddl):
+    if not has_column(table, column):
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+def add_ebook_content_metadata():
+    add_column('ebook', 'content_hash', 'VARCHAR(64)')
+    add_column('ebook', 'date_modified', 'DATETIME')
+    if not has_column('ebook', 'content'):
+        return
+    now = datetime.utcnow()
+    rows = db.session.execute(
+        text('SELECT ebook_id, content FROM ebook WHERE content_hash IS NULL')
+    ).all()
+    for ebook_id, content in rows:
+        db.session.execute(
+            db.update(Ebook).where(Ebook.ebook_id == ebook_id).values(
+                content_hash=hashlib.sha256(content.encode('utf-8')).hexdigest(),
+                date_modified=now
+            )
+        )
+
+def create_model_indexes(*models):
+    connection = db.session.connection()
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+def add_request_feedback_indexes():
+    create_model_indexes(Request, Feedback)
+    db.session.execute(text('ANALYZE'))
+
+def add_dashboard_counters():
+    DashboardCounter.__table__.create(bind=db.session.connection(), checkfirst=True)
+    create_dashboard_counter_triggers(db.session.connection())
+    refresh_dashboard_counters()
+
+def add_daily_rollups():
+    for model in (DailyRequestRollup, DailyEbookRollup, RollupWatermark, MonthlyReport):
+        model.__table__.create(bind=db.session.connection(), checkfirst=True)
+    refresh_daily_rollups()
+
+def add_search_index():
+    rebuild_search_index()
+
+CONTENT_MIGRATION_BATCH_SIZE = 100
+
+def move_content_to_blob_store():
+    for model in (ContentBlob, ContentChunk):
+        model.__table__.create(bind=db.session.connection(), checkfirst=True)
+    create_model_indexes(Ebook)
+    create_content_triggers(db.session.connection())
+
+    if has_column('ebook', 'content'):
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                text('SELECT ebook_id, content FROM ebook WHERE ebook_id > :last_id ORDER BY ebook_id LIMIT :limit'),
+                {'last_id': last_id, 'limit': CONTENT_MIGRATION_BATCH_SIZE}
+            ).all()
+            if not rows:
+                break
+            for ebook_id, content in rows:
+                db.session.execute(
+                    db.update(Ebook).where(Ebook.ebook_id == ebook_id).values(content_hash=store_content(content))
+                )
+            db.session.commit()
+            last_id = rows[-1].ebook_id
+
+        # The old search triggers read ebook.content, which SQLite won't drop while they exist
+        db.session.execute(text('DROP TRIGGER IF EXISTS ebook_fts_insert'))
+        db.session.execute(text('DROP TRIGGER IF EXISTS ebook_fts_update'))
+        db.session.execute(text('ALTER TABLE ebook DROP COLUMN content'))
+        create_search_index(db.session.connection())
+        db.session.commit()
+        db.session.connection().exec_driver_sql('VACUUM')
+        rebuild_search_index()
+
+def add_ebook_section_index():
+    create_model_indexes(Ebook)
+
+def add_ebook_stats():
+    EbookStats.__table__.create(bind=db.session.connection(), checkfirst=True)
+    create_model_indexes(EbookStats)
+    create_ebook_stats_triggers(db.session.connection())
+    refresh_ebook_stats()
+
+def add_ebook_similarity():
+    # Filled by the refresh_similar_ebooks job, which needs NumPy and SciPy
+    EbookSimilarity.__table__.create(bind=db.session.connection(), checkfirst=True)
+    create_model_indexes(EbookSimilarity)
+    create_similarity_triggers(db.session.connection())
+
+def make_search_index_external():
+    # ebook_fts kept its own uncompressed copy of every body; rebuild it over
+    # the content store and give the space back
+    drop_search_index(db.session.connection())
+    create_search_index(db.session.connection())
+    db.session.commit()
+    rebuild_search_index()
+    db.session.connection().exec_driver_sql('VACUUM')
+
+MIGRATIONS = [
+    (1, add_ebook_content_metadata),
+    (2, add_request_feedback_indexes),
+    (3, add_dashboard_counters),
+    (4, add_daily_rollups),
+    (5, add_search_index),
+    (6, move_content_to_blob_store),
+    (7, add_ebook_section_index),
+    (8, add_ebook_stats),
+    (9, add_ebook_similarity),
+    (10, make_search_index_external),
+]
+
+def upgrade():
+    # New tables first, so a step never reads one a later step would have created
+    db.create_all()
+    version = db.session.execute(text('PRAGMA user_version')).scalar()
+    for number, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        migration()
+        db.session.execute(text(f'PRAGMA user_version = {number}'))
+        db.session.commit()
+        print(f"Applied migration {number}: {migration.__name__}")
@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
 from flask_security import UserMixin, RoleMixin
 import uuid
 from datetime import datetime
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class RolesUsers(db.Model):
     __tablename__ = 'roles_users'
@@ -43,19 +45,49 @@ class Section(db.Model):
     section_description = db.Column(db.String(500))
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
+class ContentBlob(db.Model):
+    __tablename__ = 'content_blob'
+    # sha256 of the UTF-8 text, so identical uploads share one blob
+    content_hash = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    stored_size = db.Column(db.Integer, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ContentChunk(db.Model):
+    __tablename__ = 'content_chunk'
+    content_hash = db.Column(db.String(64), db.ForeignKey('content_blob.content_hash'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    # Each chunk is compressed on its own, so a range read only inflates the chunks it covers
+    data = db.Column(db.LargeBinary, nullable=False)
+
 class Ebook(db.Model):
     __tablename__ = 'ebook'
+    __table_args__ = (
+        db.Index('ix_ebook_content_hash', 'content_hash'),
+        db.Index('ix_ebook_section_id', 'section_id'),
+    )
     ebook_id = db.Column(db.Integer, primary_key=True)
     ebook_name = db.Column(db.String(100), nullable=False)
     author = db.Column(db.String(100), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    content_hash = db.Column(db.String(64), db.ForeignKey('content_blob.content_hash'))
+    date_modified = db.Column(db.DateTime)
     date_issued = db.Column(db.DateTime)
     date_returned = db.Column(db.DateTime)
     section_id = db.Column(db.Integer, db.ForeignKey('section.section_id'), nullable=False)
     section = db.relationship('Section', backref='ebooks')
+    stats = db.relationship('EbookStats', primaryjoin='Ebook.ebook_id == foreign(EbookStats.ebook_id)',
+                            uselist=False, viewonly=True)
 
 class Request(db.Model):
     __tablename__ = 'request'
+    __table_args__ = (
+        # Equality on all three columns, so this also serves (user_id, status) lookups
+        db.Index('ix_request_user_status_ebook', 'user_id', 'status', 'ebook_id'),
+        db.Index('ix_request_status_return_date', 'status', 'return_date'),
+        db.Index('ix_request_status_date_granted', 'status', 'date_granted'),
+        db.Index('ix_request_ebook_id', 'ebook_id'),
+    )
     request_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
     ebook_id = db.Column(db.Integer, db.ForeignKey('ebook.ebook_id'), nullable=False)
@@ -69,6 +101,10 @@ class Request(db.Model):
 
 class Feedback(db.Model):
     __tablename__ = 'feedback'
+    __table_args__ = (
+        db.Index('ix_feedback_user_ebook', 'user_id', 'ebook_id'),
+        db.Index('ix_feedback_ebook_id', 'ebook_id'),
+    )
     feedback_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
     ebook_id = db.Column(db.Integer, db.ForeignKey('ebook.ebook_id'), nullable=False)
@@ -76,4 +112,116 @@ class Feedback(db.Model):
     comment = db.Column(db.Text)
     date_created = db.Column(db.DateTime, nullable=False)
     user = db.relationship('User', backref=db.backref('feedbacks', lazy='dynamic'))
-    ebook = db.relationship('Ebook', backref=db.backref('feedbacks', lazy='dynamic'))
\ No newline at end of file
+    ebook = db.relationship('Ebook', backref=db.backref('feedbacks', lazy='dynamic'))
+
+class EbookStats(db.Model):
+    __tablename__ = 'ebook_stats'
+    __table_args__ = (
+        db.Index('ix_ebook_stats_section_rating', 'section_id', 'rating_average'),
+        db.Index('ix_ebook_stats_section_borrows', 'section_id', 'borrow_count'),
+    )
+    # No foreign key: the triggers in ratings.py add and drop the row with its ebook
+    ebook_id = db.Column(db.Integer, primary_key=True)
+    section_id = db.Column(db.Integer, nullable=False)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    # Stored rather than computed so the per-section ranking can walk an index
+    rating_average = db.Column(db.Float)
+    borrow_count = db.Column(db.Integer, nullable=False, default=0)
+
+class EbookSimilarity(db.Model):
+    __tablename__ = 'ebook_similarity'
+    __table_args__ = (
+        db.Index('ix_ebook_similarity_similar_ebook_id', 'similar_ebook_id'),
+    )
+    # No foreign keys: recommendations.py drops the rows with either ebook
+    ebook_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_ebook_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+class DailyRequestRollup(db.Model):
+    __tablename__ = 'daily_request_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyEbookRollup(db.Model):
+    __tablename__ = 'daily_ebook_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    # No foreign key and a copy of the name, so history outlives a deleted ebook
+    ebook_id = db.Column(db.Integer, primary_key=True)
+    ebook_name = db.Column(db.String(100), nullable=False)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+
+class RollupWatermark(db.Model):
+    __tablename__ = 'rollup_watermark'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
+
+class MonthlyReport(db.Model):
+    __tablename__ = 'monthly_report'
+    month = db.Column(db.String(7), primary_key=True)
+    body = db.Column(db.Text, nullable=False)
+    date_generated = db.Column(db.DateTime, nullable=False)
+    date_sent = db.Column(db.DateTime)
+
+class DashboardCounter(db.Model):
+    __tablename__ = 'dashboard_counter'
+    name = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+DASHBOARD_COUNTER_NAMES = ('requested', 'granted', 'revoked', 'returned', 'active_users', 'feedbacks')
+
+# Triggers keep dashboard_counter in step with every Request state transition
+# and Feedback insert/delete, including bulk UPDATE/DELETE statements that
+# bypass the ORM. 'active_users' moves when a user's first loan is granted
+# or their last one ends.
+DASHBOARD_COUNTER_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS dashboard_counter_request_insert AFTER INSERT ON request
+    BEGIN
+        UPDATE dashboard_counter SET value = value + 1 WHERE name = NEW.status;
+        UPDATE dashboard_counter SET value = value + 1 WHERE name = 'active_users' AND NEW.status = 'granted'
+            AND (SELECT count(*) FROM request WHERE user_id = NEW.user_id AND status = 'granted') = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dashboard_counter_request_delete AFTER DELETE ON request
+    BEGIN
+        UPDATE dashboard_counter SET value = value - 1 WHERE name = OLD.status;
+        UPDATE dashboard_counter SET value = value - 1 WHERE name = 'active_users' AND OLD.status = 'granted'
+            AND (SELECT count(*) FROM request WHERE user_id = OLD.user_id AND status = 'granted') = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dashboard_counter_request_update AFTER UPDATE OF status ON request
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE dashboard_counter SET value = value - 1 WHERE name = OLD.status;
+        UPDATE dashboard_counter SET value = value + 1 WHERE name = NEW.status;
+        UPDATE dashboard_counter SET value = value + 1 WHERE name = 'active_users' AND NEW.status = 'granted'
+            AND (SELECT count(*) FROM request WHERE user_id = NEW.user_id AND status = 'granted') = 1;
+        UPDATE dashboard_counter SET value = value - 1 WHERE name = 'active_users' AND OLD.status = 'granted'
+            AND (SELECT count(*) FROM request WHERE user_id = OLD.user_id AND status = 'granted') = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dashboard_counter_feedback_insert AFTER INSERT ON feedback
+    BEGIN
+        UPDATE dashboard_counter SET value = value + 1 WHERE name = 'feedbacks';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dashboard_counter_feedback_delete AFTER DELETE ON feedback
+    BEGIN
+        UPDATE dashboard_counter SET value = value - 1 WHERE name = 'feedbacks';
+    END""",
+]
+
+def create_dashboard_counter_triggers(connection):
+    for trigger in DASHBOARD_COUNTER_TRIGGERS:
+        connection.execute(text(trigger))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_triggers(target, connection, tables=(), **kw):
+    if DashboardCounter.__table__ in tables:
+        connection.execute(DashboardCounter.__table__.insert(),
+                           [{'name': name, 'value': 0} for name in DASHBOARD_COUNTER_NAMES])
+    create_dashboard_counter_triggers(connection)
@@ -0,0 +1,85 @@
+from datetime import datetime
+from sqlalchemy import func
+from models import db, User, Request, Feedback
+
+# Representative statements for the access patterns the Request/Feedback
+# indexes exist for. check() runs EXPLAIN QUERY PLAN over each one and
+# reports any that fall back to a full scan of a table.
+
+REGISTERED_QUERIES = {}
+
+def register(name):
+    def decorator(build):
+        REGISTERED_QUERIES[name] = build
+        return build
+    return decorator
+
+@register('active requests for user')
+def active_requests_for_user():
+    return db.select(func.count()).select_from(Request).where(
+        Request.user_id == 1, Request.status == 'granted')
+
+@register('existing request for user and ebook')
+def existing_request():
+    return db.select(Request.request_id).where(
+        Request.user_id == 1, Request.ebook_id == 1, Request.status == 'requested').limit(1)
+
+@register('requests by status')
+def requests_by_status():
+    return db.select(func.count()).select_from(Request).where(Request.status == 'requested')
+
+@register('active users')
+def active_users():
+    return db.select(func.count(func.distinct(User.user_id))).join(
+        Request, Request.user_id == User.user_id).where(Request.status == 'granted')
+
+@register('expired by return date')
+def expired_by_return_date():
+    return db.select(Request.request_id).where(
+        Request.status == 'granted', Request.return_date <= datetime.now())
+
+@register('overdue by grant date')
+def overdue_by_grant_date():
+    return db.select(Request.request_id).where(
+        Request.status == 'granted', Request.date_granted <= datetime.now())
+
+@register('requests for ebook')
+def requests_for_ebook():
+    return db.select(Request.request_id).where(Request.ebook_id == 1)
+
+@register('feedback for user and ebook')
+def feedback_for_user_and_ebook():
+    return db.select(Feedback.feedback_id).where(Feedback.user_id == 1, Feedback.ebook_id == 1).limit(1)
+
+@register('feedback by user')
+def feedback_by_user():
+    return db.select(func.count()).select_from(Feedback).where(Feedback.user_id == 1)
+
+@register('feedback for ebook')
+def feedback_for_ebook():
+    return db.select(Feedback.feedback_id).where(Feedback.ebook_id == 1)
+
+def explain(statement):
+    connection = db.session.connection()
+    compiled = statement.compile(dialect=connection.dialect)
+    # Parameter values do not change the plan, only the SQL shape does
+    params = tuple(None for _ in compiled.positiontup or ())
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+    return [row[-1] for row in rows]
+
+def table_scans(plan):
+    tables = set(db.metadata.tables)
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in tables and 'INDEX' not in words:
+            scans.append(detail)
+    return scans
+
+def check():
+    failures = {}
+    for name, build in REGISTERED_QUERIES.items():
+        scans = table_scans(explain(build()))
+        if scans:
+            failures[name] = scans
+    return failures
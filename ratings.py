@@ -0,0 +1,144 @@
+from sqlalchemy import event, func, text
+from models import db, Section, Ebook, EbookStats
+
+# ebook_stats holds each ebook's rating count, sum and histogram and how many
+# times it has been borrowed, so listings and rankings never aggregate
+# feedback or request rows. Triggers keep it in step with every feedback
+# insert, update and delete, every grant, and ebook inserts, moves and
+# deletes, including the set-based deletes in cascade.py.
+
+RATINGS = range(1, 6)
+RANKING_LIMIT = 10
+MAX_RANKING_LIMIT = 50
+# Fewer ratings than this and an average says little about a book
+RANKING_MIN_RATINGS = 3
+
+def _rate(sign, row):
+    return ', '.join(
+        [f'rating_count = rating_count {sign} 1', f'rating_sum = rating_sum {sign} {row}.rating'] +
+        [f'rating_{rating} = rating_{rating} {sign} ({row}.rating = {rating})' for rating in RATINGS] +
+        [f'rating_average = CASE WHEN rating_count {sign} 1 > 0 '
+         f'THEN CAST(rating_sum {sign} {row}.rating AS REAL) / (rating_count {sign} 1) END']
+    )
+
+EBOOK_STATS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS ebook_stats_ebook_insert AFTER INSERT ON ebook
+    BEGIN
+        INSERT OR IGNORE INTO ebook_stats (ebook_id, section_id, rating_count, rating_sum,
+            {', '.join(f'rating_{rating}' for rating in RATINGS)}, borrow_count)
+        VALUES (NEW.ebook_id, NEW.section_id, 0, 0, {', '.join('0' for _ in RATINGS)}, 0);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_stats_ebook_update AFTER UPDATE OF section_id ON ebook
+    BEGIN
+        UPDATE ebook_stats SET section_id = NEW.section_id WHERE ebook_id = NEW.ebook_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_stats_ebook_delete AFTER DELETE ON ebook
+    BEGIN
+        DELETE FROM ebook_stats WHERE ebook_id = OLD.ebook_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ebook_stats_feedback_insert AFTER INSERT ON feedback
+    BEGIN
+        UPDATE ebook_stats SET {_rate('+', 'NEW')} WHERE ebook_id = NEW.ebook_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ebook_stats_feedback_delete AFTER DELETE ON feedback
+    BEGIN
+        UPDATE ebook_stats SET {_rate('-', 'OLD')} WHERE ebook_id = OLD.ebook_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ebook_stats_feedback_update AFTER UPDATE OF rating, ebook_id ON feedback
+    WHEN OLD.rating IS NOT NEW.rating OR OLD.ebook_id IS NOT NEW.ebook_id
+    BEGIN
+        UPDATE ebook_stats SET {_rate('-', 'OLD')} WHERE ebook_id = OLD.ebook_id;
+        UPDATE ebook_stats SET {_rate('+', 'NEW')} WHERE ebook_id = NEW.ebook_id;
+    END""",
+    # A borrow is counted once, when a request is first granted
+    """CREATE TRIGGER IF NOT EXISTS ebook_stats_request_insert AFTER INSERT ON request
+    WHEN NEW.date_granted IS NOT NULL
+    BEGIN
+        UPDATE ebook_stats SET borrow_count = borrow_count + 1 WHERE ebook_id = NEW.ebook_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_stats_request_grant AFTER UPDATE OF date_granted ON request
+    WHEN OLD.date_granted IS NULL AND NEW.date_granted IS NOT NULL
+    BEGIN
+        UPDATE ebook_stats SET borrow_count = borrow_count + 1 WHERE ebook_id = NEW.ebook_id;
+    END""",
+]
+
+def create_ebook_stats_triggers(connection):
+    for trigger in EBOOK_STATS_TRIGGERS:
+        connection.execute(text(trigger))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_ebook_stats_triggers(target, connection, **kw):
+    create_ebook_stats_triggers(connection)
+
+def refresh_ebook_stats():
+    """Recompute ebook_stats from the feedback and request tables."""
+    db.session.execute(text('DELETE FROM ebook_stats'))
+    db.session.execute(text(f"""
+        INSERT INTO ebook_stats (ebook_id, section_id, rating_count, rating_sum,
+            {', '.join(f'rating_{rating}' for rating in RATINGS)}, rating_average, borrow_count)
+        SELECT ebook.ebook_id, ebook.section_id, coalesce(ratings.count, 0), coalesce(ratings.total, 0),
+            {', '.join(f'coalesce(ratings.rating_{rating}, 0)' for rating in RATINGS)},
+            CAST(ratings.total AS REAL) / ratings.count, coalesce(borrows.count, 0)
+        FROM ebook
+        LEFT JOIN (
+            SELECT ebook_id, count(*) AS count, sum(rating) AS total,
+                {', '.join(f'sum(rating = {rating}) AS rating_{rating}' for rating in RATINGS)}
+            FROM feedback GROUP BY ebook_id
+        ) AS ratings ON ratings.ebook_id = ebook.ebook_id
+        LEFT JOIN (
+            SELECT ebook_id, count(*) AS count FROM request WHERE date_granted IS NOT NULL GROUP BY ebook_id
+        ) AS borrows ON borrows.ebook_id = ebook.ebook_id
+    """))
+
+# Listing fields computed from an ebook_stats row, or from None for an
+# ebook without one
+RATING_FIELDS = {
+    'rating_count': lambda stats: stats.rating_count if stats else 0,
+    'rating_average': lambda stats: (
+        round(stats.rating_average, 2) if stats and stats.rating_average is not None else None
+    ),
+    'rating_histogram': lambda stats: {
+        str(rating): getattr(stats, f'rating_{rating}') if stats else 0 for rating in RATINGS
+    },
+}
+
+RANKING_ORDERS = {
+    'rating': (EbookStats.rating_average.desc(), EbookStats.rating_count.desc(), EbookStats.ebook_id),
+    'borrows': (EbookStats.borrow_count.desc(), EbookStats.ebook_id),
+}
+
+def top_ebooks(by='rating', section_id=None, limit=RANKING_LIMIT, min_ratings=RANKING_MIN_RATINGS):
+    """The ``limit`` highest rated or most borrowed ebooks of each section,
+    or of ``section_id`` alone, as ``[{section, ebooks}]``."""
+    order = RANKING_ORDERS[by]
+    conditions = []
+    if by == 'rating':
+        conditions.append(EbookStats.rating_count >= max(1, min_ratings))
+    if section_id is not None:
+        conditions.append(EbookStats.section_id == section_id)
+    ranked = db.select(
+        EbookStats, func.row_number().over(partition_by=EbookStats.section_id, order_by=order).label('rank')
+    ).where(*conditions).subquery()
+    stats = db.aliased(EbookStats, ranked)
+
+    rows = db.session.execute(
+        db.select(stats, Ebook.ebook_name, Ebook.author, Section.section_name)
+        .join(Ebook, Ebook.ebook_id == stats.ebook_id)
+        .join(Section, Section.section_id == stats.section_id)
+        .where(ranked.c.rank <= limit)
+        .order_by(stats.section_id, ranked.c.rank)
+    ).all()
+
+    sections = {}
+    for row in rows:
+        entry = row[0]
+        section = sections.setdefault(entry.section_id, {
+            'section_id': entry.section_id, 'section_name': row.section_name, 'ebooks': []
+        })
+        section['ebooks'].append(dict(
+            {'id': entry.ebook_id, 'ebook_name': row.ebook_name, 'author': row.author,
+             'borrow_count': entry.borrow_count},
+            **{field: value(entry) for field, value in RATING_FIELDS.items()}
+        ))
+    return list(sections.values())
@@ -0,0 +1,165 @@
+from sqlalchemy import event, func, text, union
+from datetime import datetime, timedelta
+import time
+from models import db, Ebook, Request, Feedback, EbookSimilarity, RollupWatermark
+
+# "Readers who borrowed this also borrowed". An offline job builds a sparse
+# user x ebook matrix from every borrow, weighted by the borrower's rating
+# (UNRATED_WEIGHT without one), and scores ebook pairs by the cosine of their
+# columns. Each ebook's top RECOMMENDATION_NEIGHBOURS are stored in
+# ebook_similarity, keyed (ebook_id, rank), so serving them is one primary
+# key range read. NumPy and SciPy are only needed by the job.
+#
+# Only the output of an incremental refresh is incremental: every run still
+# reads the whole interaction matrix, since a changed ebook's scores need
+# the full columns and norms of all its neighbours. What it saves is the
+# scoring and the writes, by redoing only the rows of ebooks borrowed or
+# rated by a user active since the watermark; those are the only pairs
+# whose co-occurrence changed. Other rows keep their scores until the next
+# full rebuild, which also drops the effect of deleted feedback.
+
+RECOMMENDATION_NEIGHBOURS = 20
+MAX_RECOMMENDATIONS = 50
+# A borrow without feedback counts as a middling rating
+UNRATED_WEIGHT = 3
+WATERMARK = 'recommendations'
+# Re-read a little before the mark, for writes that were still in flight
+WATERMARK_OVERLAP = timedelta(minutes=10)
+STORE_BATCH_SIZE = 5000
+
+SIMILARITY_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS ebook_similarity_ebook_delete AFTER DELETE ON ebook
+    BEGIN
+        DELETE FROM ebook_similarity WHERE ebook_id = OLD.ebook_id;
+        DELETE FROM ebook_similarity WHERE similar_ebook_id = OLD.ebook_id;
+    END""",
+]
+
+def create_similarity_triggers(connection):
+    for trigger in SIMILARITY_TRIGGERS:
+        connection.execute(text(trigger))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_similarity_triggers(target, connection, **kw):
+    create_similarity_triggers(connection)
+
+def interaction_matrix():
+    """The weighted user x ebook matrix as CSR, with the user and ebook ids
+    of its rows and columns."""
+    import numpy as np
+    from scipy import sparse
+
+    borrows = (
+        db.select(Request.user_id, Request.ebook_id)
+        .where(Request.date_granted.is_not(None)).distinct().subquery()
+    )
+    rows = db.session.execute(
+        db.select(borrows.c.user_id, borrows.c.ebook_id, func.coalesce(func.max(Feedback.rating), UNRATED_WEIGHT))
+        .outerjoin(Feedback, (Feedback.user_id == borrows.c.user_id) & (Feedback.ebook_id == borrows.c.ebook_id))
+        .group_by(borrows.c.user_id, borrows.c.ebook_id)
+    ).all()
+    pairs = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    user_ids, user_index = np.unique(pairs[:, 0].astype(np.int64), return_inverse=True)
+    ebook_ids, ebook_index = np.unique(pairs[:, 1].astype(np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix((pairs[:, 2], (user_index, ebook_index)), shape=(len(user_ids), len(ebook_ids)))
+    return matrix, user_ids, ebook_ids
+
+def top_neighbours(matrix, columns, neighbours=RECOMMENDATION_NEIGHBOURS):
+    """Cosine similarity of the ebook ``columns`` against every ebook, cut to
+    each one's ``neighbours`` best as ``(column, rank, neighbour, score)``
+    arrays."""
+    import numpy as np
+    from scipy import sparse
+
+    by_ebook = matrix.tocsc()
+    norms = np.sqrt(np.asarray(by_ebook.multiply(by_ebook).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    scores = (
+        sparse.diags(inverse[columns]) @ (by_ebook[:, columns].T @ by_ebook) @ sparse.diags(inverse)
+    ).tocoo()
+
+    rows, neighbour, score = scores.row, scores.col, scores.data
+    keep = (neighbour != columns[rows]) & (score > 0)
+    rows, neighbour, score = rows[keep], neighbour[keep], score[keep]
+    # Best first within each row, then rank = position within the row's run
+    order = np.lexsort((neighbour, -score, rows))
+    rows, neighbour, score = rows[order], neighbour[order], score[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = rank < neighbours
+    return columns[rows[keep]], rank[keep] + 1, neighbour[keep], score[keep]
+
+def changed_users(since):
+    """Users who borrowed or rated since the local time ``since``. Grants are
+    stamped in local time and feedback in UTC."""
+    offset = (datetime.utcnow() - datetime.now()).total_seconds()
+    since_utc = since + timedelta(minutes=round(offset / 60))
+    active = union(
+        db.select(Request.user_id).where(Request.date_granted >= since),
+        db.select(Feedback.user_id).where(Feedback.date_created >= since_utc),
+    )
+    return db.session.execute(active).scalars().all()
+
+def refresh_similar_ebooks(full=False, now=None, neighbours=RECOMMENDATION_NEIGHBOURS):
+    """Rebuild ebook_similarity, in full or for the ebooks touched since the
+    watermark. Either way the whole interaction matrix is read; only the
+    scoring and the rows written are cut down. Commits and returns a
+    summary."""
+    import numpy as np
+
+    started = time.perf_counter()
+    now = now or datetime.now()
+    watermark = db.session.get(RollupWatermark, WATERMARK)
+    full = full or watermark is None
+    matrix, user_ids, ebook_ids = interaction_matrix()
+
+    if full:
+        columns = np.arange(len(ebook_ids))
+    else:
+        users = np.flatnonzero(np.isin(user_ids, changed_users(watermark.value - WATERMARK_OVERLAP)))
+        columns = np.unique(matrix[users].indices)
+
+    if full:
+        db.session.execute(db.delete(EbookSimilarity))
+    elif len(columns):
+        db.session.execute(db.delete(EbookSimilarity).where(EbookSimilarity.ebook_id.in_(ebook_ids[columns].tolist())))
+    stored = 0
+    if len(columns):
+        column, rank, neighbour, score = top_neighbours(matrix, columns, neighbours)
+        rows = [
+            {'ebook_id': int(ebook_id), 'rank': int(position), 'similar_ebook_id': int(similar), 'score': float(value)}
+            for ebook_id, position, similar, value in zip(ebook_ids[column], rank, ebook_ids[neighbour], score)
+        ]
+        for start in range(0, len(rows), STORE_BATCH_SIZE):
+            db.session.execute(db.insert(EbookSimilarity), rows[start:start + STORE_BATCH_SIZE])
+        stored = len(rows)
+    db.session.merge(RollupWatermark(name=WATERMARK, value=now))
+    db.session.commit()
+    return {'mode': 'full' if full else 'incremental', 'ebooks': int(len(columns)), 'rows': stored,
+            'users': int(matrix.shape[0]), 'seconds': round(time.perf_counter() - started, 2)}
+
+def similar_ebooks(ebook_id, limit=RECOMMENDATION_NEIGHBOURS):
+    return [{
+        'id': row.similar_ebook_id, 'ebook_name': row.ebook_name, 'author': row.author,
+        'score': round(row.score, 4)
+    } for row in db.session.execute(
+        db.select(EbookSimilarity.similar_ebook_id, EbookSimilarity.score, Ebook.ebook_name, Ebook.author)
+        .join(Ebook, Ebook.ebook_id == EbookSimilarity.similar_ebook_id)
+        .where(EbookSimilarity.ebook_id == ebook_id)
+        .order_by(EbookSimilarity.rank).limit(limit)
+    )]
+
+def recommend_for_user(user_id, limit=RECOMMENDATION_NEIGHBOURS):
+    """Neighbours of the user's borrowed ebooks they haven't borrowed, by
+    summed similarity."""
+    borrowed = db.select(Request.ebook_id).where(Request.user_id == user_id, Request.date_granted.is_not(None))
+    score = func.sum(EbookSimilarity.score).label('score')
+    return [{
+        'id': row.similar_ebook_id, 'ebook_name': row.ebook_name, 'author': row.author,
+        'score': round(row.score, 4)
+    } for row in db.session.execute(
+        db.select(EbookSimilarity.similar_ebook_id, score, Ebook.ebook_name, Ebook.author)
+        .join(Ebook, Ebook.ebook_id == EbookSimilarity.similar_ebook_id)
+        .where(EbookSimilarity.ebook_id.in_(borrowed), EbookSimilarity.similar_ebook_id.not_in(borrowed))
+        .group_by(EbookSimilarity.similar_ebook_id)
+        .order_by(score.desc(), EbookSimilarity.similar_ebook_id).limit(limit)
+    )]
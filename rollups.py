@@ -0,0 +1,88 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+from models import db, Ebook, Request, DailyRequestRollup, DailyEbookRollup, RollupWatermark
+
+WATERMARK = 'daily_rollups'
+# Request timestamps mix local time and UTC, so re-read a little before the mark
+WATERMARK_OVERLAP = timedelta(days=1)
+
+def _day(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def refresh_daily_rollups(now=None):
+    """Recompute the daily rollups for every day from the watermark onwards.
+
+    Requests only ever land on the current day and a grant only ever sets
+    return_date into the future, so days before the watermark are final and
+    never rescanned. Re-running is idempotent."""
+    now = now or datetime.now()
+    watermark = db.session.get(RollupWatermark, WATERMARK)
+    if watermark:
+        start_day = (watermark.value - WATERMARK_OVERLAP).date()
+    else:
+        earliest = db.session.execute(db.select(func.min(Request.date_requested))).scalar()
+        start_day = earliest.date() if earliest else now.date()
+    start = datetime.combine(start_day, datetime.min.time())
+
+    request_day = func.date(Request.date_requested)
+    return_day = func.date(Request.return_date)
+    totals = {}
+    for day, count in db.session.execute(
+        db.select(request_day, func.count()).where(Request.date_requested >= start).group_by(request_day)
+    ):
+        totals.setdefault(_day(day), [0, 0])[0] = count
+    for day, count in db.session.execute(
+        db.select(return_day, func.count()).where(Request.return_date >= start).group_by(return_day)
+    ):
+        totals.setdefault(_day(day), [0, 0])[1] = count
+
+    per_ebook = db.session.execute(
+        db.select(request_day, Request.ebook_id, Ebook.ebook_name, func.count())
+        .join(Ebook, Request.ebook_id == Ebook.ebook_id)
+        .where(Request.date_requested >= start)
+        .group_by(request_day, Request.ebook_id)
+    ).all()
+
+    db.session.execute(db.delete(DailyRequestRollup).where(DailyRequestRollup.day >= start_day))
+    db.session.execute(db.delete(DailyEbookRollup).where(DailyEbookRollup.day >= start_day))
+    if totals:
+        db.session.execute(db.insert(DailyRequestRollup), [
+            {'day': day, 'requests': requests, 'returns': returns} for day, (requests, returns) in totals.items()
+        ])
+    if per_ebook:
+        db.session.execute(db.insert(DailyEbookRollup), [
+            {'day': _day(day), 'ebook_id': ebook_id, 'ebook_name': ebook_name, 'requests': count}
+            for day, ebook_id, ebook_name, count in per_ebook
+        ])
+    db.session.merge(RollupWatermark(name=WATERMARK, value=now))
+    db.session.commit()
+    return {'from': start_day.isoformat(), 'days': len(totals), 'ebook_days': len(per_ebook)}
+
+def month_summary(start_day, end_day, top=5):
+    in_month = (DailyRequestRollup.day >= start_day, DailyRequestRollup.day < end_day)
+    total_requests, total_returns = db.session.execute(
+        db.select(func.coalesce(func.sum(DailyRequestRollup.requests), 0),
+                  func.coalesce(func.sum(DailyRequestRollup.returns), 0)).where(*in_month)
+    ).one()
+    requests = func.sum(DailyEbookRollup.requests)
+    top_ebooks = db.session.execute(
+        db.select(func.max(DailyEbookRollup.ebook_name), requests)
+        .where(DailyEbookRollup.day >= start_day, DailyEbookRollup.day < end_day)
+        .group_by(DailyEbookRollup.ebook_id)
+        .order_by(requests.desc())
+        .limit(top)
+    ).all()
+    return {
+        'total_requests': total_requests,
+        'total_returns': total_returns,
+        'top_ebooks': [tuple(row) for row in top_ebooks],
+    }
+
+def daily_trend(days, today=None):
+    today = today or date.today()
+    rows = db.session.execute(
+        db.select(DailyRequestRollup.day, DailyRequestRollup.requests, DailyRequestRollup.returns)
+        .where(DailyRequestRollup.day > today - timedelta(days=days), DailyRequestRollup.day <= today)
+        .order_by(DailyRequestRollup.day)
+    ).all()
+    return [{'day': day.isoformat(), 'requests': requests, 'returns': returns} for day, requests, returns in rows]
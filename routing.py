@@ -0,0 +1,70 @@
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_sqlalchemy.session import Session
+from contextlib import contextmanager
+from contextvars import ContextVar
+import random
+
+# Reads in GET/HEAD requests go to a replica bind, everything else to the
+# primary. A user who has just written reads from the primary for
+# REPLICA_LAG_WINDOW seconds so they always see their own changes, however
+# far behind the replicas are.
+
+READ_METHODS = ('GET', 'HEAD')
+REPLICA_LAG_WINDOW = 5
+
+_route = ContextVar('db_route', default=None)
+
+@contextmanager
+def _routed(target):
+    token = _route.set(target)
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+def use_primary():
+    return _routed('primary')
+
+def use_replica():
+    return _routed('replica')
+
+def replica_keys():
+    return current_app.config.get('SQLALCHEMY_REPLICAS') or []
+
+def request_identity():
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+def _written_key(identity):
+    return f'wrote:{identity}'
+
+def mark_write(identity):
+    from cache import cache
+    cache.set(_written_key(identity), True,
+              timeout=current_app.config.get('REPLICA_LAG_WINDOW', REPLICA_LAG_WINDOW))
+
+def recently_wrote(identity):
+    from cache import cache
+    return identity is not None and cache.get(_written_key(identity)) is not None
+
+def wants_replica():
+    route = _route.get()
+    if route is not None:
+        return route == 'replica'
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+    # Decided once per request; g would outlive it when the app context is shared
+    if 'lms.db_replica' not in request.environ:
+        request.environ['lms.db_replica'] = not recently_wrote(request_identity())
+    return request.environ['lms.db_replica']
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not getattr(clause, 'is_dml', False)
+                and replica_keys() and wants_replica()):
+            return self._db.engines[random.choice(replica_keys())]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
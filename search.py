@@ -0,0 +1,166 @@
+from sqlalchemy import event, text
+import html
+from models import db, Ebook
+import content  # registers the inflate() SQL function ebook_search_source uses
+
+# ebook_fts indexes the searchable columns of ebook, rowid = ebook_id. It is
+# an external-content table over the ebook_search_source view, which reads
+# bodies out of the compressed content store through content.py's inflate()
+# SQL function, so the index keeps no second, uncompressed copy of every
+# book; snippet() and highlight() inflate the rows they are asked for. An
+# external-content index is only told about a change with the values it
+# indexed before, so the triggers delete a row's old values before an
+# update or delete touches ebook, and index the new ones after an insert or
+# update. That covers deletes cascaded from a section and content saved
+# through content_hash.
+SEARCH_INDEX_DDL = [
+    # content_chunk is read in primary key order, which is seq order within a blob
+    """CREATE VIEW IF NOT EXISTS ebook_search_source AS
+    SELECT ebook_id, ebook_name, author,
+        (SELECT group_concat(inflate(data), '') FROM content_chunk
+         WHERE content_chunk.content_hash = ebook.content_hash) AS content,
+        section_id
+    FROM ebook""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS ebook_fts USING fts5(
+        ebook_name, author, content, section_id UNINDEXED,
+        content = 'ebook_search_source', content_rowid = 'ebook_id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_fts_insert AFTER INSERT ON ebook
+    BEGIN
+        INSERT INTO ebook_fts (rowid, ebook_name, author, content, section_id)
+        SELECT ebook_id, ebook_name, author, content, section_id FROM ebook_search_source
+        WHERE ebook_id = NEW.ebook_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_fts_unindex BEFORE UPDATE OF ebook_name, author, section_id, content_hash ON ebook
+    WHEN OLD.ebook_name IS NOT NEW.ebook_name OR OLD.author IS NOT NEW.author
+        OR OLD.section_id IS NOT NEW.section_id OR OLD.content_hash IS NOT NEW.content_hash
+    BEGIN
+        INSERT INTO ebook_fts (ebook_fts, rowid, ebook_name, author, content, section_id)
+        SELECT 'delete', ebook_id, ebook_name, author, content, section_id FROM ebook_search_source
+        WHERE ebook_id = OLD.ebook_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_fts_update AFTER UPDATE OF ebook_name, author, section_id, content_hash ON ebook
+    WHEN OLD.ebook_name IS NOT NEW.ebook_name OR OLD.author IS NOT NEW.author
+        OR OLD.section_id IS NOT NEW.section_id OR OLD.content_hash IS NOT NEW.content_hash
+    BEGIN
+        INSERT INTO ebook_fts (rowid, ebook_name, author, content, section_id)
+        SELECT ebook_id, ebook_name, author, content, section_id FROM ebook_search_source
+        WHERE ebook_id = NEW.ebook_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ebook_fts_delete BEFORE DELETE ON ebook
+    BEGIN
+        INSERT INTO ebook_fts (ebook_fts, rowid, ebook_name, author, content, section_id)
+        SELECT 'delete', ebook_id, ebook_name, author, content, section_id FROM ebook_search_source
+        WHERE ebook_id = OLD.ebook_id;
+    END""",
+]
+SEARCH_INDEX_TRIGGERS = ['ebook_fts_insert', 'ebook_fts_unindex', 'ebook_fts_update', 'ebook_fts_delete']
+
+# Snippet highlight markers; control characters can't come from book text
+# once it is escaped, so they are swapped for tags afterwards
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+# bm25 column weights: a title match outranks an author match, which
+# outranks a match in the body
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+def create_search_index(connection):
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(target, connection, tables=(), **kw):
+    # Only with a new ebook table; an existing one gets its index from a
+    # migration, which also fills it, as the triggers need it in step
+    if any(table.name == 'ebook' for table in tables):
+        create_search_index(connection)
+
+def drop_search_index(connection):
+    for trigger in SEARCH_INDEX_TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+    connection.execute(text('DROP TABLE IF EXISTS ebook_fts'))
+    connection.execute(text('DROP VIEW IF EXISTS ebook_search_source'))
+
+def rebuild_search_index():
+    """Reindex every ebook from ebook_search_source; returns how many."""
+    create_search_index(db.session.connection())
+    db.session.execute(text("INSERT INTO ebook_fts (ebook_fts) VALUES ('rebuild')"))
+    db.session.execute(text("INSERT INTO ebook_fts (ebook_fts) VALUES ('optimize')"))
+    db.session.commit()
+    return db.session.execute(db.select(db.func.count()).select_from(Ebook)).scalar()
+
+def match_expression(query):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every term is quoted so user input can't inject FTS5 syntax; a trailing
+    ``*`` on a term makes it a prefix query."""
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def search_statement(query, section_id=None, offset=0, limit=20, user_id=None, librarian=False):
+    """The ranked search as ``(statement, params)``, or None for a query with no terms.
+
+    Snippets come from the body only for librarians and for the books
+    ``user_id`` has been granted; everyone else gets the highlighted title,
+    so search can't be used to read books page by page."""
+    expression = match_expression(query)
+    if not expression:
+        return None
+    section_filter = 'AND ebook_fts.section_id = :section_id' if section_id else ''
+    body = f"snippet(ebook_fts, 2, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '...', 16)"
+    title = f"highlight(ebook_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}')"
+    if librarian:
+        snippet = body
+    elif user_id is not None:
+        snippet = (f"CASE WHEN EXISTS (SELECT 1 FROM request WHERE request.user_id = :user_id "
+                   f"AND request.ebook_id = ebook.ebook_id AND request.status = 'granted') "
+                   f"THEN {body} ELSE {title} END")
+    else:
+        snippet = title
+    # Rank first and only then build snippets, for the page alone: snippet()
+    # and highlight() inflate the body of every row they are evaluated on
+    return text(f"""
+        WITH page AS (
+            SELECT rowid, bm25(ebook_fts, {', '.join(str(weight) for weight in BM25_WEIGHTS)}) AS score
+            FROM ebook_fts
+            WHERE ebook_fts MATCH :expression {section_filter}
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT ebook.ebook_id, ebook.ebook_name, ebook.author, ebook.section_id, section.section_name,
+               {snippet} AS snippet, page.score
+        FROM page
+        JOIN ebook_fts ON ebook_fts.rowid = page.rowid
+        JOIN ebook ON ebook.ebook_id = page.rowid
+        JOIN section ON section.section_id = ebook.section_id
+        WHERE ebook_fts MATCH :expression
+        ORDER BY page.score, page.rowid
+    """), {'expression': expression, 'section_id': section_id, 'user_id': user_id, 'limit': limit, 'offset': offset}
+
+def snippet_html(snippet):
+    """The snippet HTML-escaped, with matches wrapped in <b></b>."""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(HIGHLIGHT_START, '<b>').replace(HIGHLIGHT_END, '</b>')
+
+def search_result(row):
+    return {
+        'id': row.ebook_id,
+        'ebook_name': row.ebook_name,
+        'author': row.author,
+        'section_id': row.section_id,
+        'section_name': row.section_name,
+        'snippet': snippet_html(row.snippet),
+        'score': round(-row.score, 4)
+    }
+
+def search_ebooks(query, section_id=None, offset=0, limit=20, user_id=None, librarian=False):
+    statement = search_statement(query, section_id, offset, limit, user_id, librarian)
+    if statement is None:
+        return []
+    return [search_result(row) for row in db.session.execute(*statement)]
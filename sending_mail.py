@@ -1,20 +1,30 @@
 from email import encoders
 from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart 
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-import smtplib 
+from collections import deque
+from contextlib import contextmanager
+import queue
+import smtplib
+import threading
+import time
 
 SERVER_SMTP_HOST = 'localhost'
 SERVER_SMTP_PORT = 1025
 SENDER_ADDRESS='librarian@iitm.in'
 SENDER_PASSWORD=''
 
-def sending_mail(to_address,subject,message,content="text",attachment=None):
+SMTP_POOL_SIZE = 2
+SMTP_TIMEOUT = 30
+# Idle connections older than this are probed with NOOP before reuse
+SMTP_KEEPALIVE = 60
+
+def build_message(to_address,subject,message,content="text",attachment=None):
     msg = MIMEMultipart()
     msg['To']=to_address
     msg['From']=SENDER_ADDRESS
     msg['Subject']=subject
-    
+
     if content == "html":
         msg.attach(MIMEText(message, 'html'))
     else:
@@ -27,9 +37,123 @@ def sending_mail(to_address,subject,message,content="text",attachment=None):
         part.add_header("Content-Disposition", f"attachment; filename={attachment[0]}")
         msg.attach(part)
 
-    s = smtplib.SMTP(host=SERVER_SMTP_HOST, port=SERVER_SMTP_PORT)
-    s.login(SENDER_ADDRESS, SENDER_PASSWORD)
-    s.send_message(msg)
-    s.quit()
+    return msg
+
+class SMTPPool:
+    """A small pool of logged-in SMTP sessions, reused across messages.
+
+    Connections are opened lazily, so a pool created at import time is safe
+    in forked Celery workers. A connection that fails is dropped and a fresh
+    one takes its place."""
+
+    def __init__(self, host=SERVER_SMTP_HOST, port=SERVER_SMTP_PORT, username=SENDER_ADDRESS,
+                 password=SENDER_PASSWORD, size=SMTP_POOL_SIZE, retries=2):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.retries = retries
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(host=self.host, port=self.port, timeout=SMTP_TIMEOUT)
+        smtp.ehlo()
+        if smtp.has_extn('auth'):
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _checkout(self):
+        while True:
+            try:
+                smtp, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < SMTP_KEEPALIVE:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._discard(smtp)
+
+    def _discard(self, smtp):
+        try:
+            smtp.close()
+        except Exception:
+            pass
 
-    return True
\ No newline at end of file
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            smtp = self._checkout()
+            try:
+                yield smtp
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._discard(smtp)
+                raise
+            else:
+                self._idle.put((smtp, time.monotonic()))
+
+    def send_many(self, messages):
+        """Send every message, reconnecting on dropped sessions.
+
+        Returns ``(sent, failures)`` where failures is a list of
+        ``(message, error)`` pairs for messages the server refused, plus
+        everything left unsent once ``retries`` reconnects in a row failed."""
+        sent = 0
+        failures = []
+        pending = deque(messages)
+        attempts = 0
+        while pending:
+            try:
+                with self.connection() as smtp:
+                    while pending:
+                        try:
+                            smtp.send_message(pending[0])
+                            sent += 1
+                            attempts = 0
+                        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                                smtplib.SMTPDataError) as e:
+                            failures.append((pending[0], e))
+                        pending.popleft()
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                attempts += 1
+                if attempts > self.retries:
+                    # The server is unreachable, don't retry every message in turn
+                    failures.extend((message, e) for message in pending)
+                    pending.clear()
+        return sent, failures
+
+    def close(self):
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                self._discard(smtp)
+
+def is_transient(error):
+    """Whether a failed message never reached a server that answered, so
+    sending it again later may work. SMTPException subclasses OSError, so a
+    refusal has to be told apart before the network errors."""
+    if isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+        return False
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+mail_pool = SMTPPool()
+
+def send_many(messages):
+    return mail_pool.send_many(messages)
+
+def sending_mail(to_address,subject,message,content="text",attachment=None):
+    sent, failures = send_many([build_message(to_address, subject, message, content, attachment)])
+    if failures:
+        raise failures[0][1]
+    return True
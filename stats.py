@@ -0,0 +1,61 @@
+from sqlalchemy import case, func
+from models import db, Request, Feedback, DashboardCounter, DASHBOARD_COUNTER_NAMES
+
+# Each endpoint's numbers come from one statement: per-status totals are
+# SUM(CASE ...) over a single pass of request, feedback counts ride along as
+# scalar subqueries.
+
+def count_status(status):
+    return func.coalesce(func.sum(case((Request.status == status, 1), else_=0)), 0)
+
+def user_totals(user_id):
+    feedbacks = db.select(func.count()).select_from(Feedback).where(Feedback.user_id == user_id)
+    row = db.session.execute(
+        db.select(
+            func.count(Request.request_id),
+            count_status('granted'),
+            count_status('revoked'),
+            count_status('returned'),
+            feedbacks.scalar_subquery()
+        ).where(Request.user_id == user_id)
+    ).one()
+    return {
+        'books_requested': row[0],
+        'requests_granted': row[1],
+        'requests_revoked': row[2],
+        'books_returned': row[3],
+        'feedbacks_given': row[4]
+    }
+
+def library_totals():
+    feedbacks = db.select(func.count()).select_from(Feedback)
+    row = db.session.execute(
+        db.select(
+            count_status('requested'),
+            count_status('granted'),
+            count_status('revoked'),
+            count_status('returned'),
+            func.count(func.distinct(case((Request.status == 'granted', Request.user_id)))),
+            feedbacks.scalar_subquery()
+        )
+    ).one()
+    return dict(zip(('requested', 'granted', 'revoked', 'returned', 'active_users', 'feedbacks'), row))
+
+def counter_totals():
+    return dict(db.session.execute(db.select(DashboardCounter.name, DashboardCounter.value)).all())
+
+def refresh_dashboard_counters():
+    totals = library_totals()
+    for name in DASHBOARD_COUNTER_NAMES:
+        db.session.merge(DashboardCounter(name=name, value=totals[name]))
+
+def dashboard_totals(use_counters=False):
+    totals = counter_totals() if use_counters else library_totals()
+    return {
+        'active_users': totals['active_users'],
+        'pending_requests': totals['requested'],
+        'granted_requests': totals['granted'],
+        'revoked_requests': totals['revoked'],
+        'total_returns': totals['returned'],
+        'total_feedbacks': totals['feedbacks']
+    }
@@ -1,50 +1,151 @@
 from workers import celery
-from jinja2 import Template
-from sending_mail import sending_mail
-from models import Request, Ebook
-from sqlalchemy import func
+from celery import group
+from celery.utils.log import get_task_logger
+from templating import render, render_many, StageTimer
+from sending_mail import sending_mail, build_message, send_many, is_transient
+from models import db, User, Request, Ebook, MonthlyReport
+from rollups import refresh_daily_rollups, month_summary
+from database import retry_on_busy
+from borrowing import reconcile_loans
+from cascade import delete_section_chunks
+from recommendations import refresh_similar_ebooks
+from cache import bump
 from datetime import datetime, timedelta
 
+logger = get_task_logger(__name__)
+
+
+REMINDER_WINDOW = timedelta(days=2)
+REMINDER_BATCH_SIZE = 200
+REMINDER_RETRY_DELAY = 300
+
+def reminder_batches(now, batch_size=REMINDER_BATCH_SIZE):
+    """Stream recipients with loans due within REMINDER_WINDOW, grouped per
+    user and cut into batches, without loading them all at once."""
+    rows = db.session.execute(
+        db.select(User.user_id, User.email, User.username, Ebook.ebook_name, Request.return_date)
+        .join(Request, Request.user_id == User.user_id)
+        .join(Ebook, Request.ebook_id == Ebook.ebook_id)
+        .where(Request.status == 'granted', Request.return_date > now,
+               Request.return_date <= now + REMINDER_WINDOW)
+        .order_by(User.user_id, Request.return_date)
+        .execution_options(yield_per=1000)
+    )
+    batch = []
+    recipient = None
+    for row in rows:
+        if recipient is None or recipient['user_id'] != row.user_id:
+            if recipient:
+                batch.append(recipient)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            recipient = {'user_id': row.user_id, 'email': row.email, 'username': row.username, 'books': []}
+        recipient['books'].append({'ebook_name': row.ebook_name, 'return_date': row.return_date.strftime('%d %B %Y')})
+    if recipient:
+        batch.append(recipient)
+    if batch:
+        yield batch
+
+@celery.task(bind=True)
+def daily_reminders(self):
+    now = datetime.now()
+    progress = {'batches': 0, 'recipients': 0}
+
+    def signatures():
+        for batch in reminder_batches(now):
+            progress['batches'] += 1
+            progress['recipients'] += len(batch)
+            self.update_state(state='PROGRESS', meta=progress)
+            yield send_reminders.s(batch)
+
+    group(signatures()).apply_async()
+    return f"Daily reminders queued for {progress['recipients']} users in {progress['batches']} batches"
+
+@celery.task(bind=True, max_retries=3)
+def send_reminders(self, recipients):
+    timer = StageTimer()
+    with timer.stage('render'):
+        bodies = render_many('daily_reminders.html', [
+            {'user': recipient['username'], 'books': recipient['books']} for recipient in recipients
+        ])
+    messages = {}
+    for recipient, body in zip(recipients, bodies):
+        message = build_message(recipient['email'], 'Daily Library Reminder', body, content="html")
+        messages[id(message)] = (message, recipient)
+
+    with timer.stage('send'):
+        sent, failures = send_many(message for message, _ in messages.values())
+    undelivered = [messages[id(message)][1] for message, error in failures if is_transient(error)]
+    refused = len(failures) - len(undelivered)
+    result = {'sent': sent, 'refused': refused, 'undelivered': len(undelivered), 'retries': self.request.retries,
+              'timings': timer.stages}
+    logger.info(f"Reminder batch: {result}")
+
+    if undelivered:
+        # Only the recipients the server never took get another attempt
+        raise self.retry(args=(undelivered,), countdown=REMINDER_RETRY_DELAY)
+    return result
 
 @celery.task()
-def daily_reminders(email="pj@gmail.com", username="pj"):
-    with open('./templates/daily_reminders.html','r') as f:
-        template = Template(f.read())
-    sending_mail(email, 'Daily Library Reminder', template.render(user=username), content="html")
-    return f"Daily reminder sent to {username}"
+@retry_on_busy
+def refresh_rollups():
+    result = refresh_daily_rollups()
+    logger.info(f"Daily rollups refreshed: {result}")
+    return result
+
+@celery.task()
+@retry_on_busy
+def reconcile_loan_counts():
+    drift = reconcile_loans()
+    for row in drift:
+        logger.warning(f"User {row.user_id} had no_of_books={row.counted}, {row.actual} granted; reset")
+    return len(drift)
+
+@celery.task()
+@retry_on_busy
+def refresh_recommendations(full=False):
+    result = refresh_similar_ebooks(full=full)
+    logger.info(f"Similar ebooks refreshed: {result}")
+    return result
+
+@celery.task()
+def delete_section_in_background(section_id):
+    deleted = retry_on_busy(delete_section_chunks)(section_id)
+    bump('sections', 'ebooks', 'dashboard')
+    logger.info(f"Section {section_id} deleted with {deleted} ebooks")
+    return deleted
 
 @celery.task()
 def monthly_report(email="librarian@iitm.in"):
-    with open('./templates/monthly_report.html', 'r') as f:
-        template = Template(f.read())
-    
-    # Get the first day of the previous month
+    timer = StageTimer()
+
+    # The previous calendar month
     today = datetime.now()
-    first_day_of_month = today.replace(day=1)
+    first_day_of_month = today.replace(day=1).date()
     last_month = first_day_of_month - timedelta(days=1)
     start_date = last_month.replace(day=1)
-    
-    # Calculate report data
-    total_requests = Request.query.filter(Request.date_requested >= start_date, Request.date_requested < first_day_of_month).count()
-    total_returns = Request.query.filter(Request.return_date >= start_date, Request.return_date < first_day_of_month).count()
-    
-    top_ebooks = (
-        Request.query.with_entities(Ebook.ebook_name, func.count(Request.request_id).label('count'))
-        .join(Ebook)
-        .filter(Request.date_requested >= start_date, Request.date_requested < first_day_of_month)
-        .group_by(Ebook.ebook_id)
-        .order_by(func.count(Request.request_id).desc())
-        .limit(5)
-        .all()
-    )
+    month = start_date.strftime('%Y-%m')
+
+    # Generated once per month from the rollups, then only ever re-sent
+    report = db.session.get(MonthlyReport, month)
+    if report and report.date_sent:
+        return f"Monthly report for {month} already sent"
 
-    context = {
-        'month': last_month.strftime('%B %Y'),
-        'total_requests': total_requests,
-        'total_returns': total_returns,
-        'top_ebooks': top_ebooks,
-    }
+    if not report:
+        with timer.stage('query'):
+            refresh_daily_rollups()
+            context = month_summary(start_date, first_day_of_month)
+        context['month'] = last_month.strftime('%B %Y')
+        with timer.stage('render'):
+            body = render('monthly_report.html', **context)
+        report = MonthlyReport(month=month, body=body, date_generated=datetime.now())
+        db.session.add(report)
+        db.session.commit()
 
-    sending_mail(email, 'Monthly Library Report', template.render(**context), content="html")
-    print("Monthly report sent successfully")  # Add this line
+    with timer.stage('send'):
+        sending_mail(email, 'Monthly Library Report', report.body, content="html")
+    report.date_sent = datetime.now()
+    db.session.commit()
+    logger.info(f"Monthly report sent to {email}, timings: {timer.stages}")
     return f"Monthly report sent to {email}"
@@ -0,0 +1,38 @@
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+from contextlib import contextmanager
+import os
+import time
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# One environment per process. Compiled templates stay in memory and in the
+# bytecode cache; auto_reload only recompiles a template when its file's
+# mtime changes.
+env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    bytecode_cache=FileSystemBytecodeCache(),
+    auto_reload=True,
+    autoescape=select_autoescape(['html'])
+)
+
+def render(name, **context):
+    return env.get_template(name).render(**context)
+
+def render_many(name, contexts):
+    template = env.get_template(name)
+    return [template.render(**context) for context in contexts]
+
+class StageTimer:
+    """Accumulates wall time per named stage of a task."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = round(self.stages.get(name, 0) + elapsed, 4)
@@ -0,0 +1,58 @@
+import pytest
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import event
+from database import scratch_app
+from datagen import generate_library
+from models import db, User
+from auth import token_claims
+from cache import cache
+from api import api
+
+@pytest.fixture
+def library(tmp_path):
+    """A small generated library, with an app context on it."""
+    path = tmp_path / 'library.sqlite3'
+    generate_library(str(path), sections=3, ebooks=40, users=20, requests=300, feedback=120, content_kb=1)
+    app = scratch_app(str(path))
+    app.config.update(
+        JWT_SECRET_KEY='test', CACHE_TYPE='cache.LRUCache', CACHE_THRESHOLD=1024, CACHE_DEFAULT_TIMEOUT=300
+    )
+    JWTManager(app)
+    cache.init_app(app)
+    api.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+def bearer(user):
+    token = create_access_token(identity=user.user_id, additional_claims=token_claims(user))
+    return {'Authorization': 'Bearer ' + token}
+
+@pytest.fixture
+def librarian(library):
+    return bearer(db.session.get(User, 1))
+
+@pytest.fixture
+def reader(library):
+    """A reader with no loans, and a token for them."""
+    user = db.session.execute(
+        db.select(User).where(User.user_id > 1, User.no_of_books == 0).order_by(User.user_id)
+    ).scalars().first()
+    return user, bearer(user)
+
+@pytest.fixture
+def statements(library):
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+@pytest.fixture
+def deleted_user(library):
+    """A token for a user id that no longer exists, carrying no role claims."""
+    return {'Authorization': 'Bearer ' + create_access_token(identity=10 ** 6)}
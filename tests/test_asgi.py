@@ -0,0 +1,48 @@
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.testclient import TestClient
+import asgi
+from models import db
+
+@pytest.fixture
+def clients(library, monkeypatch):
+    """The Flask test client and an ASGI one reading the same library."""
+    engine = create_async_engine(f'sqlite+aiosqlite:///file:{db.engine.url.database}?mode=ro&uri=true')
+    monkeypatch.setattr(asgi, 'engine', engine)
+    with asgi.flask_app.app_context():
+        token = create_access_token(identity=1)
+    yield library.test_client(), TestClient(asgi.app), {'Authorization': f'Bearer {token}'}
+
+@pytest.mark.parametrize('url', [
+    '/api/section',
+    '/api/ebook?limit=7',
+    '/api/ebook?limit=5&fields=id,section_name,author',
+    '/api/search?q=river&limit=5',
+    '/api/search?q=sto*&section_id=2',
+])
+def test_reads_match_the_flask_endpoints(clients, url):
+    flask_client, asgi_client, _ = clients
+    expected = flask_client.get(url)
+    response = asgi_client.get(url)
+    assert response.status_code == expected.status_code == 200
+    assert response.json() == expected.json
+
+def test_pages_follow_the_same_cursor(clients):
+    flask_client, asgi_client, _ = clients
+    cursor = flask_client.get('/api/ebook?limit=10&fields=id').json['next_cursor']
+    assert asgi_client.get(f'/api/ebook?limit=10&fields=id&cursor={cursor}').json() == \
+        flask_client.get(f'/api/ebook?limit=10&fields=id&cursor={cursor}').json
+
+def test_content_ranges_match(clients, librarian):
+    flask_client, asgi_client, headers = clients
+    expected = flask_client.get('/api/ebook/1/content', headers={**librarian, 'Range': 'bytes=10-99'})
+    response = asgi_client.get('/api/ebook/1/content', headers={**headers, 'Range': 'bytes=10-99'})
+    assert response.status_code == expected.status_code == 206
+    assert response.content == expected.get_data()
+    assert response.headers['etag'] == expected.headers['ETag']
+    assert asgi_client.get('/api/ebook/1/content', headers={
+        **headers, 'If-None-Match': response.headers['etag']}).status_code == 304
+
+def test_content_needs_a_token(clients):
+    assert clients[1].get('/api/ebook/1/content').status_code == 401
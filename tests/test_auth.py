@@ -0,0 +1,28 @@
+import pytest
+from flask_jwt_extended import create_access_token
+from models import db, Role, User
+
+def test_claims_authorize_without_loading_the_user(library, librarian, statements):
+    response = library.test_client().get('/api/request?limit=5', headers=librarian)
+    assert response.status_code == 200
+    assert not [statement for statement in statements
+                if 'roles_users' in statement or '\nFROM user \n' in statement]
+
+def test_token_without_claims_falls_back_to_the_database(library, statements):
+    headers = {'Authorization': 'Bearer ' + create_access_token(identity=1)}
+    assert library.test_client().get('/api/request?limit=5', headers=headers).status_code == 200
+    assert [statement for statement in statements if 'roles_users' in statement]
+
+def test_role_removed_after_login_is_honoured(library, librarian):
+    client = library.test_client()
+    assert client.get('/api/librarian/dashboard', headers=librarian).status_code == 200
+    user = db.session.get(User, 1)
+    user.roles.remove(db.session.execute(db.select(Role).where(Role.name == 'librarian')).scalar())
+    db.session.commit()
+    assert client.get('/api/librarian/dashboard', headers=librarian).status_code == 403
+
+@pytest.mark.parametrize('url', ['/api/request', '/api/feedback', '/api/ebook/1/content'])
+def test_token_of_a_deleted_user_is_not_found(library, deleted_user, url):
+    response = library.test_client().get(url, headers=deleted_user)
+    assert response.status_code == 404
+    assert response.json == {'message': 'User not found'}
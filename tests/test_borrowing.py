@@ -0,0 +1,180 @@
+from datetime import datetime
+import random
+import threading
+import pytest
+import borrowing
+from database import retry_on_busy
+from models import db, Ebook, Request, User
+
+def unrequested_ebooks(user_id):
+    requested = db.select(Request.ebook_id).where(Request.user_id == user_id)
+    return db.session.execute(
+        db.select(Ebook.ebook_id).where(Ebook.ebook_id.not_in(requested)).order_by(Ebook.ebook_id)
+    ).scalars().all()
+
+def test_request_grant_and_return_move_the_counter(library, reader):
+    user, _ = reader
+    ebook_ids = unrequested_ebooks(user.user_id)
+    request_ids = [borrowing.request_ebook(user.user_id, ebook_id) for ebook_id in ebook_ids[:6]]
+    db.session.commit()
+    for request_id in request_ids[:5]:
+        borrowing.grant_request(request_id)
+    db.session.commit()
+
+    with pytest.raises(borrowing.BorrowingError):
+        borrowing.grant_request(request_ids[5])
+    with pytest.raises(borrowing.BorrowingError):
+        borrowing.request_ebook(user.user_id, ebook_ids[6])
+    db.session.rollback()
+    assert db.session.get(User, user.user_id, populate_existing=True).no_of_books == 5
+
+    borrowing.return_request(request_ids[0], user.user_id)
+    borrowing.revoke_request(request_ids[1])
+    db.session.commit()
+    assert db.session.get(User, user.user_id, populate_existing=True).no_of_books == 3
+    assert borrowing.loan_drift() == []
+
+def test_duplicate_pending_request_is_refused(library, reader):
+    user, _ = reader
+    ebook_id = unrequested_ebooks(user.user_id)[0]
+    borrowing.request_ebook(user.user_id, ebook_id)
+    with pytest.raises(borrowing.BorrowingError, match='already requested'):
+        borrowing.request_ebook(user.user_id, ebook_id)
+
+def test_reconcile_resets_drifted_counters(library):
+    db.session.execute(db.update(User).where(User.user_id.in_([2, 3])).values(no_of_books=User.no_of_books + 3))
+    db.session.commit()
+    assert {row.user_id for row in borrowing.reconcile_loans()} == {2, 3}
+    assert borrowing.loan_drift() == []
+
+def test_concurrent_grants_never_pass_the_loan_limit(library):
+    user_id = db.session.execute(
+        db.select(User.user_id).where(User.user_id > 1, User.no_of_books == 0).order_by(User.user_id)
+    ).scalars().first()
+    now = datetime.now()
+    request_ids = db.session.execute(db.insert(Request).returning(Request.request_id), [
+        {'user_id': user_id, 'ebook_id': ebook_id, 'status': 'requested', 'date_requested': now}
+        for ebook_id in range(1, 21)
+    ]).scalars().all()
+    db.session.commit()
+
+    threads = 8
+    barrier = threading.Barrier(threads + 1)
+    done = threading.Event()
+    granted = []
+    observed = []
+
+    @retry_on_busy(retries=20)
+    def grant(request_id):
+        try:
+            borrowing.grant_request(request_id)
+        except borrowing.BorrowingError:
+            db.session.rollback()
+            return
+        db.session.commit()
+        granted.append(request_id)
+
+    def worker(order):
+        with library.app_context():
+            barrier.wait()
+            for request_id in order:
+                grant(request_id)
+
+    def watch():
+        with library.app_context():
+            barrier.wait()
+            while not done.is_set():
+                observed.append(db.session.get(User, user_id, populate_existing=True).no_of_books)
+                db.session.rollback()
+
+    rng = random.Random(1)
+    workers = [threading.Thread(target=worker, args=(rng.sample(request_ids, len(request_ids)),))
+               for _ in range(threads)]
+    watcher = threading.Thread(target=watch)
+    for thread in workers + [watcher]:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    done.set()
+    watcher.join()
+
+    db.session.expire_all()
+    granted_rows = db.session.execute(
+        db.select(db.func.count()).where(Request.user_id == user_id, Request.status == 'granted')
+    ).scalar()
+    assert len(granted) == borrowing.MAX_ACTIVE_LOANS
+    assert max(observed) <= borrowing.MAX_ACTIVE_LOANS
+    assert db.session.get(User, user_id).no_of_books == granted_rows == borrowing.MAX_ACTIVE_LOANS
+
+def test_grant_requests_fills_each_users_remaining_loans_in_order(library, reader):
+    user, _ = reader
+    now = datetime.now()
+    request_ids = db.session.execute(db.insert(Request).returning(Request.request_id), [
+        {'user_id': user.user_id, 'ebook_id': ebook_id, 'status': 'requested', 'date_requested': now}
+        for ebook_id in unrequested_ebooks(user.user_id)[:7]
+    ]).scalars().all()
+    borrowing.grant_request(request_ids[0])
+    db.session.commit()
+
+    outcomes = borrowing.grant_requests(request_ids + [10 ** 6])
+    db.session.commit()
+
+    assert [outcomes[request_id] for request_id in request_ids] == (
+        ['already_granted'] + ['granted'] * 4 + ['limit_reached'] * 2)
+    assert outcomes[10 ** 6] == 'not_found'
+    assert db.session.get(User, user.user_id, populate_existing=True).no_of_books == borrowing.MAX_ACTIVE_LOANS
+    assert borrowing.loan_drift() == []
+
+def test_batch_endpoint_revokes_a_users_loans(library, librarian):
+    user_id = db.session.execute(
+        db.select(User.user_id).where(User.no_of_books > 1).order_by(User.user_id)
+    ).scalars().first()
+    response = library.test_client().post('/api/request/batch', headers=librarian, json={
+        'action': 'revoke', 'status': 'granted', 'user_id': user_id
+    })
+
+    assert response.status_code == 200
+    assert response.json['processed'] == len(response.json['results']) > 1
+    assert db.session.get(User, user_id).no_of_books == 0
+    assert borrowing.loan_drift() == []
+
+def test_batch_endpoint_is_for_librarians(library, reader):
+    response = library.test_client().post('/api/request/batch', headers=reader[1], json={'action': 'grant'})
+    assert response.status_code == 403
+
+def pending_requests():
+    return db.session.execute(
+        db.select(Request.request_id)
+        .join(User, User.user_id == Request.user_id)
+        .where(Request.status == 'requested', User.no_of_books == 0)
+        .order_by(Request.request_id)
+    ).scalars().all()
+
+def test_grant_requests_rejects_a_request_granted_during_the_batch(library, monkeypatch):
+    request_ids = pending_requests()[:3]
+    read_targets = borrowing._targets
+
+    def targets_then_concurrent_grant(ids):
+        targets = read_targets(ids)
+        # Another writer grants one of them after the batch has read its rows
+        borrowing.grant_request(request_ids[0])
+        db.session.commit()
+        return targets
+
+    monkeypatch.setattr(borrowing, '_targets', targets_then_concurrent_grant)
+    with pytest.raises(borrowing.BorrowingError):
+        borrowing.grant_requests(request_ids)
+    db.session.rollback()
+
+    assert borrowing.loan_drift() == []
+    statuses = db.session.execute(
+        db.select(Request.status).where(Request.request_id.in_(request_ids)).order_by(Request.request_id)
+    ).scalars().all()
+    assert statuses == ['granted', 'requested', 'requested']
+
+def test_grant_requests_moves_counters_by_what_it_granted(library):
+    request_ids = pending_requests()[:3]
+    outcomes = borrowing.grant_requests(request_ids)
+    db.session.commit()
+    assert set(outcomes.values()) == {'granted'}
+    assert borrowing.loan_drift() == []
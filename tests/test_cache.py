@@ -0,0 +1,36 @@
+import time
+from cache import LRUCache, read_through, bump
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    lru = LRUCache(threshold=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == (1, None, 3)
+
+def test_lru_cache_entries_expire(monkeypatch):
+    lru = LRUCache()
+    lru.set('a', 1, timeout=10)
+    later = time.monotonic() + 11
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    assert lru.get('a') is None
+
+def test_read_through_loads_once_until_bumped(library):
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert read_through('tests', 'key', loader) == 1
+    assert read_through('tests', 'key', loader) == 1
+    bump('tests')
+    assert read_through('tests', 'key', loader) == 2
+
+def test_a_write_is_visible_to_the_next_read(library, librarian):
+    client = library.test_client()
+    before = client.get('/api/section').json
+    client.post('/api/section', headers=librarian, json={'section_name': 'Maps'})
+    after = client.get('/api/section').json
+    assert [section['section_name'] for section in after] == [section['section_name'] for section in before] + ['Maps']
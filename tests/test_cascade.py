@@ -0,0 +1,59 @@
+from sqlalchemy import Delete
+from borrowing import grant_request, loan_drift
+from cascade import delete_ebooks, delete_section, delete_section_chunks
+from models import db, Section, Ebook, Request, Feedback, User
+
+def remaining(section_id):
+    books = db.select(Ebook.ebook_id).where(Ebook.section_id == section_id)
+    return [db.session.execute(db.select(db.func.count()).select_from(model).where(column.in_(books))).scalar()
+            for model, column in ((Ebook, Ebook.ebook_id), (Request, Request.ebook_id), (Feedback, Feedback.ebook_id))]
+
+def test_section_delete_takes_its_books_and_releases_their_loans(library, librarian):
+    assert all(remaining(1))
+    response = library.test_client().delete('/api/section/1', headers=librarian)
+    assert response.status_code == 200
+    assert remaining(1) == [0, 0, 0]
+    assert db.session.get(Section, 1) is None
+    assert loan_drift() == []
+
+def test_section_delete_is_a_fixed_number_of_statements(library, statements):
+    counts = []
+    for section_id in (1, 2):
+        statements.clear()
+        delete_section(section_id)
+        counts.append(len(statements))
+    db.session.commit()
+    assert counts[0] == counts[1]
+    assert loan_drift() == []
+
+def test_chunked_delete_matches_the_one_shot_delete(library):
+    books = len(db.session.execute(db.select(Ebook.ebook_id).where(Ebook.section_id == 2)).all())
+    assert delete_section_chunks(2, chunk_size=3) == books
+    assert remaining(2) == [0, 0, 0]
+    assert db.session.get(Section, 2) is None
+    assert loan_drift() == []
+
+
+def test_deleting_an_ebook_releases_a_loan_granted_just_before(library, monkeypatch):
+    pending = db.session.execute(
+        db.select(Request.request_id, Request.ebook_id)
+        .join(User, User.user_id == Request.user_id)
+        .where(Request.status == 'requested', User.no_of_books == 0)
+        .order_by(Request.request_id)
+    ).first()
+    execute = db.session.execute
+
+    def granted_first(statement, *args, **kwargs):
+        # A librarian grants a request for the book as the delete starts
+        if isinstance(statement, Delete) and not raced:
+            raced.append(pending.request_id)
+            grant_request(pending.request_id)
+        return execute(statement, *args, **kwargs)
+
+    raced = []
+    monkeypatch.setattr(db.session, 'execute', granted_first)
+    assert delete_ebooks([pending.ebook_id]) == 1
+    db.session.commit()
+
+    assert raced == [pending.request_id]
+    assert loan_drift() == []
@@ -0,0 +1,67 @@
+import io
+import json
+import pytest
+from catalog import parse_rows, import_catalog, export_catalog
+from models import db, Ebook
+
+def jsonl(*rows):
+    return io.BytesIO(''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8'))
+
+def catalog_records():
+    return [json.loads(line) for line in export_catalog('jsonl')]
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+def test_export_then_import_reproduces_the_catalog(library, fmt):
+    exported = catalog_records()
+    dump = ''.join(export_catalog(fmt)).encode('utf-8')
+
+    report = import_catalog(parse_rows(io.BytesIO(dump), fmt), batch_size=7)
+
+    assert report['imported'] == len(exported) and report['failed'] == 0
+    assert len(report['batches']) == -(-len(exported) // 7)
+    copies = catalog_records()[len(exported):]
+    strip = lambda record: {key: value for key, value in record.items() if key != 'id'}
+    assert [strip(record) for record in copies] == [strip(record) for record in exported]
+
+def test_bad_rows_are_reported_and_the_rest_imported(library):
+    before = db.session.execute(db.select(db.func.count()).select_from(Ebook)).scalar()
+    report = import_catalog(parse_rows(jsonl(
+        {'title': 'Kept', 'author': 'A', 'section': 'Imports', 'content': 'text'},
+        {'title': 'No author', 'section': 'Imports', 'content': 'text'},
+        {'title': 'Lost', 'author': 'A', 'section_id': 999, 'content': 'text'},
+        {'title': 'Also kept', 'author': 'B', 'section': 'Imports', 'content': 'text'},
+    ), 'jsonl'), batch_size=2)
+
+    assert report['imported'] == 2 and report['failed'] == 2
+    assert [batch['errors'] for batch in report['batches']] == [
+        [{'line': 2, 'error': 'title and author are required'}],
+        [{'line': 3, 'error': 'Unknown section_id 999'}],
+    ]
+    assert db.session.execute(db.select(db.func.count()).select_from(Ebook)).scalar() == before + 2
+
+def test_import_endpoint_is_for_librarians(library, librarian, reader):
+    client = library.test_client()
+    body = jsonl({'title': 'Posted', 'author': 'A', 'section': 'Imports', 'content': 'text'}).getvalue()
+    assert client.post('/api/ebook/import', headers=reader[1], data=body).status_code == 403
+    response = client.post('/api/ebook/import', headers=librarian, data=body, content_type='application/x-ndjson')
+    assert response.json['imported'] == 1
+    last = client.get('/api/ebook/export?content=false', headers=librarian).get_data(as_text=True).splitlines()[-1]
+    assert {key: value for key, value in json.loads(last).items() if key != 'id'} == {
+        'title': 'Posted', 'author': 'A', 'section': 'Imports'}
+
+def test_non_text_fields_are_row_errors_not_batch_failures(library):
+    before = db.session.execute(db.select(db.func.count()).select_from(Ebook)).scalar()
+    report = import_catalog(parse_rows(jsonl(
+        {'title': 'Kept', 'author': 'A', 'section': 'Imports', 'content': 'text'},
+        {'title': 42, 'author': 'A', 'section': 'Imports', 'content': 'text'},
+        {'title': 'Null author', 'author': None, 'section': 'Imports', 'content': 'text'},
+        {'title': 'List content', 'author': 'A', 'section': 'Imports', 'content': ['text']},
+    ), 'jsonl'))
+
+    assert report['imported'] == 1 and report['failed'] == 3
+    assert report['batches'][0]['errors'] == [
+        {'line': 2, 'error': 'title must be a string'},
+        {'line': 3, 'error': 'title and author are required'},
+        {'line': 4, 'error': 'content must be a string'},
+    ]
+    assert db.session.execute(db.select(db.func.count()).select_from(Ebook)).scalar() == before + 1
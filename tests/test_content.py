@@ -0,0 +1,85 @@
+import pytest
+from content import CONTENT_CHUNK_SIZE
+from models import db, Ebook, ContentBlob, ContentChunk
+
+BODY = 'The harbour lights went out one by one. ' * 4000
+
+@pytest.fixture
+def content_url(library, librarian):
+    created = library.test_client().post('/api/ebook', headers=librarian, json={
+        'title': 'Harbour Lights', 'author': 'A Keeper', 'section_id': 1, 'content': BODY
+    }).json
+    return f"/api/ebook/{created['id']}/content"
+
+def test_full_download_carries_validators(library, librarian, content_url):
+    response = library.test_client().get(content_url, headers=librarian)
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == BODY
+    assert response.content_length == len(BODY.encode())
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag']
+
+def test_byte_range_is_served_partially(library, librarian, content_url):
+    response = library.test_client().get(content_url, headers={**librarian, 'Range': 'bytes=100000-100199'})
+    assert response.status_code == 206
+    assert response.get_data() == BODY.encode()[100000:100200]
+    assert response.headers['Content-Range'] == f'bytes 100000-100199/{len(BODY.encode())}'
+
+def test_unsatisfiable_range(library, librarian, content_url):
+    length = len(BODY.encode())
+    response = library.test_client().get(content_url, headers={**librarian, 'Range': f'bytes={length}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{length}'
+
+def test_matching_etag_is_not_modified(library, librarian, content_url):
+    client = library.test_client()
+    etag = client.get(content_url, headers=librarian).headers['ETag']
+    response = client.get(content_url, headers={**librarian, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+def test_stale_if_range_gets_the_whole_body(library, librarian, content_url):
+    response = library.test_client().get(content_url, headers={
+        **librarian, 'Range': 'bytes=0-9', 'If-Range': '"stale"'
+    })
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == BODY
+
+def test_new_content_changes_the_etag(library, librarian, content_url):
+    client = library.test_client()
+    etag = client.get(content_url, headers=librarian).headers['ETag']
+    ebook_id = int(content_url.split('/')[3])
+    client.put(f'/api/ebook/{ebook_id}', headers=librarian, json={
+        'title': 'Harbour Lights', 'author': 'A Keeper', 'section_id': 1, 'content': 'Rewritten.'
+    })
+    response = client.get(content_url, headers={**librarian, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'Rewritten.'
+
+def test_identical_bodies_share_one_compressed_blob(library, librarian, content_url):
+    blobs = db.session.execute(db.select(db.func.count()).select_from(ContentBlob)).scalar()
+    copy = library.test_client().post('/api/ebook', headers=librarian, json={
+        'title': 'Harbour Lights, Again', 'author': 'A Keeper', 'section_id': 2, 'content': BODY
+    }).json
+    digest = db.session.get(Ebook, copy['id']).content_hash
+
+    assert digest == db.session.get(Ebook, int(content_url.split('/')[3])).content_hash
+    assert db.session.execute(db.select(db.func.count()).select_from(ContentBlob)).scalar() == blobs
+    blob = db.session.get(ContentBlob, digest)
+    assert blob.size == len(BODY.encode()) and blob.stored_size < blob.size / 10
+    chunks = db.session.execute(db.select(db.func.count()).where(ContentChunk.content_hash == digest)).scalar()
+    assert chunks == -(-blob.size // CONTENT_CHUNK_SIZE)
+
+def test_range_across_a_chunk_boundary(library, librarian, content_url):
+    start = CONTENT_CHUNK_SIZE - 10
+    response = library.test_client().get(content_url, headers={**librarian, 'Range': f'bytes={start}-{start + 19}'})
+    assert response.status_code == 206
+    assert response.get_data() == BODY.encode()[start:start + 20]
+
+def test_blob_goes_with_its_last_ebook(library, librarian, content_url):
+    client = library.test_client()
+    ebook_id = int(content_url.split('/')[3])
+    digest = db.session.get(Ebook, ebook_id).content_hash
+    client.delete(f'/api/ebook/{ebook_id}', headers=librarian)
+    assert db.session.get(ContentBlob, digest) is None
+    assert db.session.execute(db.select(db.func.count()).where(ContentChunk.content_hash == digest)).scalar() == 0
@@ -0,0 +1,61 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import database
+from models import db
+
+def busy():
+    return OperationalError('UPDATE request', {}, Exception('database is locked'))
+
+def test_production_profile_sets_pragmas_on_every_connection(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'tuned.sqlite3'}",
+                      SQLALCHEMY_ENGINE_OPTIONS=database.engine_options('production'),
+                      SQLITE_PROFILE='production')
+    db.init_app(app)
+    database.init_app(app)
+    with app.app_context():
+        connections = [db.engine.connect() for _ in range(2)]
+        for connection in connections:
+            assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert connection.execute(text('PRAGMA synchronous')).scalar() == 1
+            assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+            connection.close()
+        db.engine.dispose()
+
+def test_busy_work_is_retried_until_it_goes_through(library, monkeypatch):
+    monkeypatch.setattr(database, 'busy_backoff', lambda *args: None)
+    attempts = []
+
+    @database.retry_on_busy
+    def work():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise busy()
+        return 'done'
+
+    assert work() == 'done'
+    assert len(attempts) == 3
+
+def test_retries_give_up_and_other_errors_pass_straight_through(library, monkeypatch):
+    monkeypatch.setattr(database, 'busy_backoff', lambda *args: None)
+    attempts = []
+
+    @database.retry_on_busy(retries=2)
+    def always_busy():
+        attempts.append(1)
+        raise busy()
+
+    with pytest.raises(OperationalError):
+        always_busy()
+    assert len(attempts) == 3
+
+    @database.retry_on_busy
+    def broken():
+        attempts.append(1)
+        raise OperationalError('SELECT', {}, Exception('no such table: missing'))
+
+    with pytest.raises(OperationalError):
+        broken()
+    assert len(attempts) == 4
@@ -0,0 +1,49 @@
+from datetime import datetime
+import sqlite3
+import benchmark
+from borrowing import MAX_ACTIVE_LOANS, loan_drift
+from datagen import generate_library
+from models import db, User, Request, Feedback
+from stats import counter_totals, library_totals
+
+SNAPSHOT = {
+    'user': 'email, no_of_books, fs_uniquifier',
+    'section': 'section_name, date_created',
+    'ebook': 'ebook_name, author, section_id, content_hash',
+    'request': 'user_id, ebook_id, status, date_requested, date_granted, date_revoked, return_date',
+    'feedback': 'user_id, ebook_id, rating, comment, date_created',
+}
+
+def snapshot(path):
+    connection = sqlite3.connect(path)
+    try:
+        return {table: connection.execute(f'SELECT {columns} FROM {table} ORDER BY rowid').fetchall()
+                for table, columns in SNAPSHOT.items()}
+    finally:
+        connection.close()
+
+def test_same_seed_gives_the_same_library(tmp_path):
+    now = datetime(2026, 5, 1, 12)
+    paths = [str(tmp_path / f'{name}.sqlite3') for name in ('first', 'second')]
+    for path in paths:
+        generate_library(path, sections=2, ebooks=15, users=8, requests=80, feedback=20, content_kb=1, now=now)
+    first, second = (snapshot(path) for path in paths)
+    assert first == second
+    assert [len(first[table]) for table in ('user', 'section', 'ebook', 'request')] == [9, 2, 15, 80]
+
+def test_generated_library_is_consistent(library):
+    assert loan_drift() == []
+    assert db.session.execute(db.select(db.func.max(User.no_of_books))).scalar() <= MAX_ACTIVE_LOANS
+    assert counter_totals() == library_totals()
+    unreturned = db.session.execute(
+        db.select(db.func.count()).select_from(Feedback).where(~db.exists().where(
+            Request.user_id == Feedback.user_id, Request.ebook_id == Feedback.ebook_id, Request.status == 'returned'
+        ))
+    ).scalar()
+    assert unreturned == 0
+
+def test_suite_runs_every_scenario_through_the_test_client(library):
+    results = benchmark.run_suite(library, concurrency=2, total=10)
+    assert results['meta']['dataset']['ebook'] == 40
+    for name, summary in results['endpoints'].items():
+        assert summary['errors'] == 0, name
@@ -0,0 +1,41 @@
+from models import db, Ebook
+
+def test_cursor_pages_cover_the_catalog_once_in_order(library):
+    client = library.test_client()
+    ids = []
+    cursor = ''
+    while cursor is not None:
+        response = client.get(f'/api/ebook?limit=7&fields=id&cursor={cursor}')
+        assert response.status_code == 200
+        assert len(response.json['ebooks']) <= 7
+        ids += [ebook['id'] for ebook in response.json['ebooks']]
+        cursor = response.json['next_cursor']
+    assert ids == db.session.execute(db.select(Ebook.ebook_id).order_by(Ebook.ebook_id)).scalars().all()
+
+def test_fields_project_the_listing(library):
+    response = library.test_client().get('/api/ebook?limit=3&fields=id,section_name')
+    assert response.status_code == 200
+    for row in response.json['ebooks']:
+        ebook = db.session.get(Ebook, row['id'])
+        assert row == {'id': ebook.ebook_id, 'section_name': ebook.section.section_name}
+
+def test_listing_never_carries_book_bodies(library):
+    ebook = library.test_client().get('/api/ebook?limit=1').json['ebooks'][0]
+    assert 'content' not in ebook
+    response = library.test_client().get('/api/ebook?fields=id,content')
+    assert response.status_code == 400
+
+def test_malformed_cursor_is_rejected(library):
+    assert library.test_client().get('/api/ebook?cursor=not-a-cursor').status_code == 400
+
+def test_content_is_served_to_librarians_and_granted_readers_only(library, librarian, reader):
+    client = library.test_client()
+    created = client.post('/api/ebook', headers=librarian, json={
+        'title': 'Tide Tables', 'author': 'A Keeper', 'section_id': 1, 'content': 'high water ' * 5000
+    }).json
+    url = f"/api/ebook/{created['id']}/content"
+
+    response = client.get(url, headers=librarian)
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'high water ' * 5000
+    assert client.get(url, headers=reader[1]).status_code == 403
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from sqlalchemy import Update
+from sqlalchemy.exc import OperationalError
+import database
+import expiry
+from borrowing import loan_drift, return_request
+from models import db, User, Request
+
+def loans_by_user():
+    counted = dict(db.session.execute(
+        db.select(Request.user_id, db.func.count()).where(Request.status == 'granted').group_by(Request.user_id)
+    ).all())
+    return {user_id: counted.get(user_id, 0) for user_id in db.session.execute(db.select(User.user_id)).scalars()}
+
+def test_expiry_moves_every_match_in_batches_and_recounts_loans(library):
+    cutoff = datetime.now() + timedelta(days=4)
+    overdue = db.session.execute(
+        db.select(Request.request_id).where(Request.status == 'granted', Request.return_date <= cutoff)
+        .order_by(Request.request_id)
+    ).scalars().all()
+    untouched = db.session.execute(
+        db.select(db.func.count()).where(Request.status == 'granted', Request.return_date > cutoff)
+    ).scalar()
+    assert overdue and untouched
+
+    report = expiry.expire_requests(Request.return_date <= cutoff, 'revoked', batch_size=4, details=True)
+
+    assert report['processed'] == len(overdue)
+    assert [batch['rows'] for batch in report['batches']] == [len(overdue[start:start + 4])
+                                                              for start in range(0, len(overdue), 4)]
+    assert [row.request_id for row in report['requests']] == overdue
+    revoked = db.session.execute(
+        db.select(Request.request_id).where(Request.request_id.in_(overdue), Request.status == 'revoked')
+        .order_by(Request.request_id)
+    ).scalars().all()
+    assert revoked == overdue
+    assert db.session.execute(db.select(db.func.count()).where(Request.status == 'granted')).scalar() == untouched
+    assert loans_by_user() == dict(db.session.execute(db.select(User.user_id, User.no_of_books)).all())
+
+def test_auto_return_hands_back_loans_older_than_a_week(library):
+    granted = datetime.utcnow() - timedelta(days=8)
+    stale = db.select(Request.request_id).where(Request.status == 'granted').order_by(Request.request_id).limit(3)
+    db.session.execute(db.update(Request).where(Request.request_id.in_(stale)).values(date_granted=granted))
+    db.session.commit()
+    overdue = db.session.execute(
+        db.select(Request.request_id).where(Request.status == 'granted', Request.date_granted <= granted)
+        .order_by(Request.request_id)
+    ).scalars().all()
+
+    response = library.test_client().post('/api/auto-return')
+
+    assert response.status_code == 200
+    assert [book['request_id'] for book in response.json['returned_books']] == overdue
+    assert loans_by_user() == dict(db.session.execute(db.select(User.user_id, User.no_of_books)).all())
+
+def test_overdue_revocation_retries_a_busy_first_attempt(library, monkeypatch):
+    attempts = []
+    expire = expiry.expire_requests
+
+    def locked_once(*args, **kwargs):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise OperationalError('UPDATE request', {}, Exception('database is locked'))
+        return expire(*args, **kwargs)
+
+    monkeypatch.setattr(expiry, 'expire_requests', locked_once)
+    monkeypatch.setattr(database, 'busy_backoff', lambda *args: None)
+    granted = db.session.execute(
+        db.select(db.func.count()).where(Request.status == 'granted')
+    ).scalar()
+
+    report = expiry.revoke_overdue(now=datetime.now() + timedelta(days=365))
+
+    assert len(attempts) == 2
+    assert granted and report['processed'] == granted
+    assert loan_drift() == []
+
+def test_details_leave_out_requests_returned_during_the_batch(library, monkeypatch):
+    victim = db.session.execute(
+        db.select(Request.request_id, Request.user_id).where(Request.status == 'granted').order_by(Request.request_id)
+    ).first()
+    granted = db.session.execute(db.select(db.func.count()).where(Request.status == 'granted')).scalar()
+    execute = db.session.execute
+
+    def returned_first(statement, *args, **kwargs):
+        # The borrower returns the book between the batch's read and its UPDATE
+        if isinstance(statement, Update) and statement.table.name == 'request' and not raced:
+            raced.append(victim.request_id)
+            return_request(victim.request_id, victim.user_id)
+        return execute(statement, *args, **kwargs)
+
+    raced = []
+    monkeypatch.setattr(db.session, 'execute', returned_first)
+    report = expiry.expire_requests(Request.return_date <= datetime.now() + timedelta(days=365), 'revoked',
+                                    details=True)
+
+    assert raced == [victim.request_id]
+    assert report['processed'] == len(report['requests']) == granted - 1
+    assert victim.request_id not in {row.request_id for row in report['requests']}
+    assert loan_drift() == []
@@ -0,0 +1,45 @@
+import logging
+import pytest
+import instrumentation
+from instrumentation import Histogram
+
+@pytest.fixture
+def instrumented(library):
+    instrumentation.init_app(library)
+    return library.test_client()
+
+def series_value(text, name, endpoint):
+    prefix = f'{name}{{endpoint="{endpoint}",method="GET"}} '
+    values = [float(line[len(prefix):]) for line in text.splitlines() if line.startswith(prefix)]
+    return values[0] if values else 0
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', 'Test.', (0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe((('endpoint', 'x'),), value)
+    assert histogram.exposition()[2:] == [
+        'test_seconds_bucket{endpoint="x",le="0.1"} 1',
+        'test_seconds_bucket{endpoint="x",le="1"} 3',
+        'test_seconds_bucket{endpoint="x",le="+Inf"} 4',
+        'test_seconds_sum{endpoint="x"} 4.25',
+        'test_seconds_count{endpoint="x"} 4',
+    ]
+
+def test_metrics_count_each_requests_statements(instrumented, statements):
+    before = instrumented.get('/metrics').get_data(as_text=True)
+    statements.clear()
+    assert instrumented.get('/api/ebook?limit=3&fields=id,author').status_code == 200
+    executed = len(statements)
+    after = instrumented.get('/metrics').get_data(as_text=True)
+
+    count, total = 'lms_request_sql_statements_count', 'lms_request_sql_statements_sum'
+    assert series_value(after, count, 'ebookapi') == series_value(before, count, 'ebookapi') + 1
+    assert series_value(after, total, 'ebookapi') == series_value(before, total, 'ebookapi') + executed
+    assert executed
+
+def test_slow_requests_are_logged_with_their_slowest_statements(library, instrumented, caplog):
+    library.config['SLOW_REQUEST_SECONDS'] = 0
+    with caplog.at_level(logging.WARNING):
+        instrumented.get('/api/ebook?limit=3&fields=id')
+    assert 'Slow request GET /api/ebook?limit=3&fields=id (ebookapi)' in caplog.text
+    assert 'ms: SELECT' in caplog.text
@@ -0,0 +1,37 @@
+import pytest
+from models import db, Request
+
+# Each listing is a fixed handful of queries however many rows a page holds
+@pytest.mark.parametrize('url, key', [
+    ('/api/request', 'requests'),
+    ('/api/feedback', 'feedbacks'),
+    ('/api/users', 'users'),
+])
+def test_listing_query_count_does_not_grow_with_page_size(library, librarian, statements, url, key):
+    client = library.test_client()
+    assert client.get(url, headers=librarian).status_code == 200
+
+    counts = {}
+    for limit in (5, 15):
+        statements.clear()
+        response = client.get(f'{url}?limit={limit}', headers=librarian)
+        assert response.status_code == 200
+        assert len(response.json[key]) == limit
+        counts[limit] = len(statements)
+    assert counts[5] == counts[15]
+
+def test_readers_page_through_only_their_own_requests(library, reader):
+    user, headers = reader
+    client = library.test_client()
+    seen = []
+    cursor = ''
+    while cursor is not None:
+        response = client.get(f'/api/request?limit=4&status=returned&cursor={cursor}', headers=headers)
+        assert response.status_code == 200
+        seen += [row['request_id'] for row in response.json['requests']]
+        cursor = response.json['next_cursor']
+    assert seen == db.session.execute(
+        db.select(Request.request_id).where(Request.user_id == user.user_id, Request.status == 'returned')
+        .order_by(Request.request_id)
+    ).scalars().all()
+    assert seen
@@ -0,0 +1,7 @@
+import pytest
+import query_plans
+
+@pytest.mark.parametrize('name', sorted(query_plans.REGISTERED_QUERIES))
+def test_registered_query_uses_an_index(library, name):
+    plan = query_plans.explain(query_plans.REGISTERED_QUERIES[name]())
+    assert query_plans.table_scans(plan) == []
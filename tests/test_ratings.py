@@ -0,0 +1,65 @@
+from collections import defaultdict
+import pytest
+from models import db, Ebook, EbookStats, Feedback, Request, Section
+from ratings import refresh_ebook_stats, top_ebooks
+
+def stats_rows():
+    return [tuple(getattr(row, column.name) for column in EbookStats.__table__.columns)
+            for row in db.session.execute(db.select(EbookStats).order_by(EbookStats.ebook_id)).scalars()]
+
+def test_triggers_keep_ebook_stats_equal_to_a_full_refresh(library):
+    db.session.execute(db.update(Feedback).where(Feedback.feedback_id % 3 == 0)
+                       .values(rating=6 - Feedback.rating))
+    db.session.execute(db.delete(Feedback).where(Feedback.feedback_id % 5 == 0))
+    db.session.execute(db.update(Request).where(Request.status == 'requested')
+                       .values(status='granted', date_granted=db.func.datetime('now')))
+    moved = db.session.execute(db.select(Ebook).order_by(Ebook.ebook_id)).scalars().first()
+    moved.section_id = db.session.execute(
+        db.select(Section.section_id).where(Section.section_id != moved.section_id)
+    ).scalars().first()
+    removed = db.session.execute(db.select(Ebook.ebook_id).order_by(Ebook.ebook_id.desc())).scalars().first()
+    for model in (Feedback, Request):
+        db.session.execute(db.delete(model).where(model.ebook_id == removed))
+    db.session.execute(db.delete(Ebook).where(Ebook.ebook_id == removed))
+    db.session.flush()
+    by_trigger = stats_rows()
+    refresh_ebook_stats()
+    assert by_trigger == stats_rows()
+    assert removed not in [row[0] for row in by_trigger]
+
+def test_top_ebooks_ranks_each_section_by_average_then_count(library):
+    ratings = defaultdict(list)
+    for ebook_id, rating in db.session.execute(db.select(Feedback.ebook_id, Feedback.rating)):
+        ratings[ebook_id].append(rating)
+    sections = dict(db.session.execute(db.select(Ebook.ebook_id, Ebook.section_id)).all())
+    expected = defaultdict(list)
+    for ebook_id, given in sorted(ratings.items(), key=lambda item: (-sum(item[1]) / len(item[1]), -len(item[1]),
+                                                                      item[0])):
+        if len(given) >= 2 and len(expected[sections[ebook_id]]) < 3:
+            expected[sections[ebook_id]].append(ebook_id)
+
+    ranked = top_ebooks('rating', limit=3, min_ratings=2)
+    assert {section['section_id']: [ebook['id'] for ebook in section['ebooks']] for section in ranked} == expected
+    for section in ranked:
+        for ebook in section['ebooks']:
+            assert ebook['rating_count'] == sum(ebook['rating_histogram'].values()) == len(ratings[ebook['id']])
+
+def test_top_endpoint_ranks_one_section_by_borrows(library):
+    borrows = defaultdict(int)
+    for (ebook_id,) in db.session.execute(db.select(Request.ebook_id).where(Request.date_granted.is_not(None))):
+        borrows[ebook_id] += 1
+    in_section = db.session.execute(db.select(Ebook.ebook_id).where(Ebook.section_id == 2)).scalars().all()
+    expected = sorted(in_section, key=lambda ebook_id: (-borrows[ebook_id], ebook_id))[:4]
+
+    response = library.test_client().get('/api/ebook/top?by=borrows&section_id=2&limit=4')
+    assert response.status_code == 200
+    [section] = response.get_json()['sections']
+    assert [ebook['id'] for ebook in section['ebooks']] == expected
+    assert [ebook['borrow_count'] for ebook in section['ebooks']] == [borrows[ebook_id] for ebook_id in expected]
+
+@pytest.mark.parametrize('rating', [0, 6])
+def test_feedback_outside_one_to_five_is_refused(library, reader, rating):
+    user, headers = reader
+    response = library.test_client().post('/api/feedback', headers=headers,
+                                          json={'ebook_id': 1, 'rating': rating, 'comment': 'no'})
+    assert response.status_code == 400
@@ -0,0 +1,97 @@
+from collections import defaultdict
+from datetime import datetime
+from math import sqrt
+from models import db, Ebook, EbookSimilarity, Feedback, Request
+from recommendations import UNRATED_WEIGHT, refresh_similar_ebooks
+
+def brute_force_neighbours(neighbours):
+    """Each ebook's best ``neighbours`` by cosine, from plain dictionaries."""
+    ratings = defaultdict(int)
+    rows = db.session.execute(db.select(Feedback.user_id, Feedback.ebook_id, Feedback.rating))
+    for user_id, ebook_id, rating in rows:
+        ratings[user_id, ebook_id] = max(ratings[user_id, ebook_id], rating)
+    columns = defaultdict(dict)
+    for user_id, ebook_id in db.session.execute(
+        db.select(Request.user_id, Request.ebook_id).where(Request.date_granted.is_not(None)).distinct()
+    ):
+        columns[ebook_id][user_id] = ratings[user_id, ebook_id] or UNRATED_WEIGHT
+    norms = {ebook_id: sqrt(sum(weight * weight for weight in column.values()))
+             for ebook_id, column in columns.items()}
+    expected = {}
+    for ebook_id, column in columns.items():
+        scores = []
+        for other_id, other in columns.items():
+            dot = sum(weight * other[user_id] for user_id, weight in column.items() if user_id in other)
+            if other_id != ebook_id and dot > 0:
+                scores.append((round(dot / (norms[ebook_id] * norms[other_id]), 9), other_id))
+        expected[ebook_id] = [(other_id, score) for score, other_id in
+                              sorted(scores, key=lambda pair: (-pair[0], pair[1]))[:neighbours]]
+    return expected
+
+def stored_neighbours(ebook_ids=None):
+    query = db.select(EbookSimilarity).order_by(EbookSimilarity.ebook_id, EbookSimilarity.rank)
+    if ebook_ids is not None:
+        query = query.where(EbookSimilarity.ebook_id.in_(ebook_ids))
+    stored = defaultdict(list)
+    for row in db.session.execute(query).scalars():
+        stored[row.ebook_id].append((row.similar_ebook_id, round(row.score, 9)))
+    return stored
+
+def test_full_refresh_matches_a_brute_force_cosine(library):
+    summary = refresh_similar_ebooks(full=True, neighbours=5)
+    expected = {ebook_id: pairs for ebook_id, pairs in brute_force_neighbours(5).items() if pairs}
+    assert summary['mode'] == 'full'
+    assert summary['rows'] == sum(len(pairs) for pairs in expected.values())
+    assert stored_neighbours() == expected
+
+def test_incremental_refresh_rescores_the_ebooks_a_new_borrow_touches(library, reader):
+    user, _ = reader
+    refresh_similar_ebooks(full=True, neighbours=5)
+    borrowed = db.session.execute(
+        db.select(Ebook.ebook_id).where(Ebook.ebook_id.not_in(
+            db.select(Request.ebook_id).where(Request.user_id == user.user_id)
+        )).order_by(Ebook.ebook_id)
+    ).scalars().first()
+    db.session.add(Request(user_id=user.user_id, ebook_id=borrowed, status='granted', date_requested=datetime.now(),
+                           date_granted=datetime.now()))
+    db.session.commit()
+
+    summary = refresh_similar_ebooks(neighbours=5)
+    assert summary['mode'] == 'incremental'
+    touched = db.session.execute(
+        db.select(Request.ebook_id).where(Request.user_id == user.user_id, Request.date_granted.is_not(None))
+    ).scalars().all()
+    expected = brute_force_neighbours(5)
+    assert stored_neighbours(touched) == {ebook_id: expected[ebook_id] for ebook_id in touched if expected[ebook_id]}
+
+def test_endpoints_serve_neighbours_and_skip_what_the_reader_borrowed(library, reader):
+    user, headers = reader
+    db.session.add(Request(user_id=user.user_id, ebook_id=1, status='granted', date_requested=datetime.now(),
+                           date_granted=datetime.now()))
+    db.session.commit()
+    refresh_similar_ebooks(full=True)
+    client = library.test_client()
+    similar = client.get('/api/ebook/1/similar?limit=3').get_json()['similar']
+    assert [entry['id'] for entry in similar] == [pair[0] for pair in stored_neighbours([1])[1][:3]]
+
+    borrowed = set(db.session.execute(
+        db.select(Request.ebook_id).where(Request.user_id == user.user_id, Request.date_granted.is_not(None))
+    ).scalars())
+    summed = defaultdict(float)
+    for row in db.session.execute(db.select(EbookSimilarity).where(EbookSimilarity.ebook_id.in_(borrowed))).scalars():
+        if row.similar_ebook_id not in borrowed:
+            summed[row.similar_ebook_id] += row.score
+    recommended = client.get('/api/user/recommendations?limit=5', headers=headers).get_json()['recommendations']
+    assert recommended
+    assert [entry['id'] for entry in recommended] == sorted(summed, key=lambda ebook_id: (-summed[ebook_id],
+                                                                                           ebook_id))[:5]
+
+def test_deleting_an_ebook_drops_its_neighbour_rows(library):
+    refresh_similar_ebooks(full=True)
+    ebook_id = db.session.execute(db.select(EbookSimilarity.similar_ebook_id)).scalars().first()
+    for model in (Feedback, Request):
+        db.session.execute(db.delete(model).where(model.ebook_id == ebook_id))
+    db.session.execute(db.delete(Ebook).where(Ebook.ebook_id == ebook_id))
+    assert db.session.execute(db.select(EbookSimilarity).where(
+        (EbookSimilarity.ebook_id == ebook_id) | (EbookSimilarity.similar_ebook_id == ebook_id)
+    )).first() is None
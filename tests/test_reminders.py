@@ -0,0 +1,76 @@
+from datetime import datetime
+import smtplib
+import pytest
+import tasks
+from models import db, Request
+
+def test_reminder_batches_group_due_loans_per_user(library):
+    now = datetime.now()
+    due = db.session.execute(
+        db.select(Request.user_id, db.func.count()).where(
+            Request.status == 'granted', Request.return_date > now,
+            Request.return_date <= now + tasks.REMINDER_WINDOW
+        ).group_by(Request.user_id).order_by(Request.user_id)
+    ).all()
+    assert len(due) > 3
+
+    batches = list(tasks.reminder_batches(now, batch_size=3))
+
+    assert [len(batch) for batch in batches[:-1]] == [3] * (len(batches) - 1)
+    recipients = [recipient for batch in batches for recipient in batch]
+    assert [(recipient['user_id'], len(recipient['books'])) for recipient in recipients] == due
+
+def test_reminder_lists_the_books_due(monkeypatch):
+    outbox = []
+
+    def send_many(messages):
+        outbox.extend(messages)
+        return len(outbox), []
+
+    monkeypatch.setattr(tasks, 'send_many', send_many)
+    result = tasks.send_reminders.run([{'user_id': 2, 'email': 'reader1@example.com', 'username': 'reader1',
+                                        'books': [{'ebook_name': 'Tide Tables', 'return_date': '01 May 2026'}]}])
+
+    assert result['sent'] == 1 and result['undelivered'] == 0
+    body = outbox[0].get_payload()[0].get_payload(decode=True).decode()
+    assert 'reader1' in body and 'Tide Tables' in body and '01 May 2026' in body
+
+RECIPIENTS = [
+    {'user_id': 1, 'email': 'gone@example.com', 'username': 'gone', 'books': []},
+    {'user_id': 2, 'email': 'later@example.com', 'username': 'later', 'books': []},
+]
+
+@pytest.fixture
+def retried(monkeypatch):
+    calls = []
+
+    def retry(**kwargs):
+        calls.append(kwargs)
+        return RuntimeError('retry')
+
+    monkeypatch.setattr(tasks.send_reminders, 'retry', retry)
+    return calls
+
+def fail_with(monkeypatch, errors):
+    def send_many(messages):
+        return 0, [(message, errors[message['To']]) for message in messages]
+    monkeypatch.setattr(tasks, 'send_many', send_many)
+
+def test_refused_recipient_is_not_retried(monkeypatch, retried):
+    fail_with(monkeypatch, {
+        'gone@example.com': smtplib.SMTPRecipientsRefused({'gone@example.com': (550, b'No such user')}),
+        'later@example.com': smtplib.SMTPDataError(554, b'Rejected'),
+    })
+    result = tasks.send_reminders.run(RECIPIENTS)
+    assert result['refused'] == 2
+    assert result['undelivered'] == 0
+    assert retried == []
+
+def test_only_undelivered_recipients_are_retried(monkeypatch, retried):
+    fail_with(monkeypatch, {
+        'gone@example.com': smtplib.SMTPRecipientsRefused({'gone@example.com': (550, b'No such user')}),
+        'later@example.com': smtplib.SMTPServerDisconnected('Connection unexpectedly closed'),
+    })
+    with pytest.raises(RuntimeError):
+        tasks.send_reminders.run(RECIPIENTS)
+    assert [recipient['email'] for recipient in retried[0]['args'][0]] == ['later@example.com']
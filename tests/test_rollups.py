@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+from rollups import refresh_daily_rollups, month_summary
+from models import db, Request, DailyRequestRollup, DailyEbookRollup
+
+def per_day(column):
+    day = db.func.date(column)
+    return {date.fromisoformat(row[0]): row[1] for row in db.session.execute(
+        db.select(day, db.func.count()).where(column.is_not(None)).group_by(day)
+    )}
+
+def rollup_rows():
+    days = db.session.execute(db.select(DailyRequestRollup)).scalars().all()
+    requests = {row.day: row.requests for row in days if row.requests}
+    returns = {row.day: row.returns for row in days if row.returns}
+    ebooks = {(row.day, row.ebook_id): row.requests
+              for row in db.session.execute(db.select(DailyEbookRollup)).scalars()}
+    return requests, returns, ebooks
+
+def scanned_rows():
+    day = db.func.date(Request.date_requested)
+    ebooks = {(date.fromisoformat(row[0]), row[1]): row[2] for row in db.session.execute(
+        db.select(day, Request.ebook_id, db.func.count()).group_by(day, Request.ebook_id)
+    )}
+    return per_day(Request.date_requested), per_day(Request.return_date), ebooks
+
+def test_incremental_refresh_matches_a_full_scan(library):
+    now = datetime.now()
+    refresh_daily_rollups(now=now)
+    assert rollup_rows() == scanned_rows()
+
+    later = now + timedelta(hours=1)
+    db.session.add_all([Request(user_id=2, ebook_id=ebook_id, status='requested', date_requested=later)
+                        for ebook_id in (1, 2, 3)])
+    pending = db.session.execute(db.select(Request).where(Request.status == 'requested')).scalars().first()
+    pending.status = 'granted'
+    pending.date_granted = later
+    pending.return_date = later + timedelta(days=7)
+    db.session.commit()
+
+    report = refresh_daily_rollups(now=later)
+    assert date.fromisoformat(report['from']) >= (now - timedelta(days=1)).date()
+    assert rollup_rows() == scanned_rows()
+
+def test_month_summary_adds_up_the_days(library):
+    refresh_daily_rollups()
+    first = date.today().replace(day=1)
+    start, end = (first - timedelta(days=1)).replace(day=1), first
+    summary = month_summary(start, end)
+
+    requests, returns, ebooks = scanned_rows()
+    assert summary['total_requests'] == sum(count for day, count in requests.items() if start <= day < end)
+    assert summary['total_returns'] == sum(count for day, count in returns.items() if start <= day < end)
+    assert [count for _, count in summary['top_ebooks']] == sorted(
+        (sum(count for (day, ebook_id), count in ebooks.items() if start <= day < end and ebook_id == book)
+         for book in {ebook_id for _, ebook_id in ebooks}), reverse=True)[:5]
@@ -0,0 +1,71 @@
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import database
+from cache import cache, bump, read_through
+from models import db
+from routing import mark_write, use_primary, use_replica
+
+@pytest.fixture
+def replicated(library):
+    """An app on the library's file with the production read-only replica bind."""
+    path = db.engine.url.database
+    app = Flask(__name__)
+    binds = database.replica_binds([], path, 'production')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}',
+        SQLALCHEMY_ENGINE_OPTIONS=database.engine_options('production'),
+        SQLALCHEMY_BINDS=binds,
+        SQLALCHEMY_REPLICAS=list(binds),
+        SQLITE_PROFILE='production',
+        JWT_SECRET_KEY='test',
+        CACHE_TYPE='cache.LRUCache', CACHE_THRESHOLD=1024, CACHE_DEFAULT_TIMEOUT=300
+    )
+    db.init_app(app)
+    database.init_app(app)
+    JWTManager(app)
+    cache.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+def bound_to(app):
+    return 'replica' if db.session.get_bind() is db.engines['replica_0'] else 'primary'
+
+def token(app, user_id):
+    with app.app_context():
+        return {'Authorization': 'Bearer ' + create_access_token(identity=user_id)}
+
+def test_reads_in_get_requests_go_to_the_replica(replicated):
+    with replicated.test_request_context('/api/ebook', method='GET'):
+        assert bound_to(replicated) == 'replica'
+        with use_primary():
+            assert bound_to(replicated) == 'primary'
+    with replicated.test_request_context('/api/ebook', method='POST'):
+        assert bound_to(replicated) == 'primary'
+    assert bound_to(replicated) == 'primary'
+    with use_replica():
+        assert bound_to(replicated) == 'replica'
+
+def test_a_user_who_just_wrote_reads_from_the_primary(replicated):
+    headers = token(replicated, 2)
+    mark_write(2)
+    with replicated.test_request_context('/api/request', method='GET', headers=headers):
+        assert bound_to(replicated) == 'primary'
+    with replicated.test_request_context('/api/request', method='GET', headers=token(replicated, 3)):
+        assert bound_to(replicated) == 'replica'
+
+def test_misses_after_a_bump_load_from_the_primary(replicated):
+    with replicated.test_request_context('/api/section', method='GET'):
+        assert read_through('sections', 'all', lambda: bound_to(replicated)) == 'replica'
+        bump('sections')
+        assert read_through('sections', 'all', lambda: bound_to(replicated)) == 'primary'
+
+def test_the_replica_engine_cannot_write(replicated):
+    with db.engines['replica_0'].connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("UPDATE section SET section_name = 'Renamed'"))
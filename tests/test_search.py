@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import text
+from cascade import delete_ebooks
+from content import set_ebook_content
+from models import db, Ebook
+from search import match_expression, search_ebooks, snippet_html, HIGHLIGHT_START, HIGHLIGHT_END
+
+BOOKS = [
+    ('A Walk Through Stone', 'Ada Quokka', 'Tracks in the hills.'),
+    ('Quokka Island', 'Ben Tern', 'Ferries and salt.'),
+    ('Harbour Notes', 'Cy Gull', 'On the island a quokka watched the ferry.'),
+]
+
+@pytest.fixture
+def shelved(library, librarian):
+    client = library.test_client()
+    return [client.post('/api/ebook', headers=librarian, json={
+        'title': title, 'author': author, 'content': content, 'section_id': 2
+    }).json['id'] for title, author, content in BOOKS]
+
+def search(client, query):
+    response = client.get('/api/search', query_string={'q': query})
+    assert response.status_code == 200
+    return [result['id'] for result in response.json['results']]
+
+def test_title_outranks_author_outranks_body(library, shelved):
+    by_author, by_title, by_body = shelved
+    assert search(library.test_client(), 'quokka') == [by_title, by_author, by_body]
+
+def test_prefix_terms_and_section_filter(library, shelved):
+    client = library.test_client()
+    assert set(search(client, 'quok*')) == set(shelved)
+    response = client.get('/api/search', query_string={'q': 'quokka', 'section_id': 1})
+    assert response.json['results'] == []
+
+def test_index_follows_updates_and_deletes(library, librarian, shelved):
+    client = library.test_client()
+    by_author, by_title, by_body = shelved
+    client.put(f'/api/ebook/{by_title}', headers=librarian, json={
+        'title': 'Wallaby Island', 'author': 'Ben Tern', 'content': 'Ferries and salt.', 'section_id': 2
+    })
+    client.delete(f'/api/ebook/{by_body}', headers=librarian)
+    assert search(client, 'quokka') == [by_author]
+    assert search(client, 'wallaby') == [by_title]
+
+def test_results_page_with_a_cursor(library, shelved):
+    client = library.test_client()
+    first = client.get('/api/search', query_string={'q': 'quokka', 'limit': 2}).json
+    second = client.get('/api/search', query_string={'q': 'quokka', 'limit': 2, 'cursor': first['next_cursor']}).json
+    assert [result['id'] for result in first['results'] + second['results']] == search(client, 'quokka')
+    assert second['next_cursor'] is None
+
+def test_match_expression_quotes_every_term():
+    assert match_expression('salt "AND ferry* NEAR(') == '"salt" """AND" "ferry"* "NEAR("'
+    assert match_expression(' * ') == ''
+
+def test_snippet_is_escaped_around_highlights():
+    snippet = f'a {HIGHLIGHT_START}<img src=x onerror=alert(1)>{HIGHLIGHT_END} & b'
+    assert snippet_html(snippet) == 'a <b>&lt;img src=x onerror=alert(1)&gt;</b> &amp; b'
+
+def test_missing_snippet_stays_missing():
+    assert snippet_html(None) is None
+
+def check_index():
+    db.session.execute(text("INSERT INTO ebook_fts (ebook_fts, rank) VALUES ('integrity-check', 1)"))
+
+def test_index_follows_the_content_store(library):
+    check_index()
+    ebook, other = db.session.execute(db.select(Ebook).order_by(Ebook.ebook_id).limit(2)).scalars().all()
+    ebook.ebook_name = 'Renamed'
+    set_ebook_content(ebook, 'A tale of the quokka & its <island>')
+    delete_ebooks([other.ebook_id])
+    db.session.commit()
+    check_index()
+
+    results = search_ebooks('quokka', librarian=True)
+    assert [result['id'] for result in results] == [ebook.ebook_id]
+    assert results[0]['snippet'] == 'A tale of the <b>quokka</b> &amp; its &lt;island&gt;'
+    assert search_ebooks('quokka')[0]['snippet'] == 'Renamed'
+    # No second copy of the bodies beside the content store
+    assert db.session.execute(
+        text("SELECT count(*) FROM sqlite_master WHERE name = 'ebook_fts_content'")
+    ).scalar() == 0
@@ -0,0 +1,92 @@
+import smtplib
+import time
+from sending_mail import SMTPPool, SMTP_KEEPALIVE, build_message
+
+class FakeSession:
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def send_message(self, message):
+        if self.server.drop_after is not None and len(self.server.delivered) == self.server.drop_after:
+            self.server.drop_after = None
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if message['To'] in self.server.refuse:
+            raise smtplib.SMTPRecipientsRefused({message['To']: (550, b'No such user')})
+        self.server.delivered.append((self, message['To']))
+
+    def noop(self):
+        return 250, b'OK'
+
+    def close(self):
+        self.closed = True
+
+    quit = close
+
+class FakeServer:
+    def __init__(self, refuse=(), drop_after=None, reachable=True):
+        self.refuse = set(refuse)
+        self.drop_after = drop_after
+        self.reachable = reachable
+        self.sessions = []
+        self.delivered = []
+
+    def connect(self):
+        if not self.reachable:
+            raise ConnectionRefusedError('Connection refused')
+        self.sessions.append(FakeSession(self))
+        return self.sessions[-1]
+
+def pool_for(monkeypatch, server):
+    pool = SMTPPool()
+    monkeypatch.setattr(pool, '_connect', server.connect)
+    return pool
+
+def messages(count):
+    return [build_message(f'reader{number}@example.com', 'Reminder', 'Hello') for number in range(count)]
+
+def test_one_session_carries_the_whole_batch(monkeypatch):
+    server = FakeServer()
+    pool = pool_for(monkeypatch, server)
+    assert pool.send_many(messages(50)) == (50, [])
+    assert pool.send_many(messages(5)) == (5, [])
+    assert len(server.sessions) == 1
+
+def test_refused_recipient_does_not_stop_the_batch(monkeypatch):
+    server = FakeServer(refuse={'reader1@example.com'})
+    sent, failures = pool_for(monkeypatch, server).send_many(messages(3))
+    assert sent == 2
+    assert [(message['To'], type(error)) for message, error in failures] == [
+        ('reader1@example.com', smtplib.SMTPRecipientsRefused)]
+
+def test_dropped_session_is_replaced_and_sending_resumes(monkeypatch):
+    server = FakeServer(drop_after=4)
+    assert pool_for(monkeypatch, server).send_many(messages(10)) == (10, [])
+    assert len(server.sessions) == 2
+    assert [to for _, to in server.delivered] == [message['To'] for message in messages(10)]
+    assert server.sessions[0].closed
+
+def test_unreachable_server_fails_the_batch_without_looping(monkeypatch):
+    server = FakeServer(reachable=False)
+    sent, failures = pool_for(monkeypatch, server).send_many(messages(4))
+    assert sent == 0
+    assert len(failures) == 4
+
+class StaleSession:
+    closed = False
+
+    def noop(self):
+        raise ConnectionResetError('Connection reset by peer')
+
+    def close(self):
+        self.closed = True
+
+def test_checkout_replaces_a_session_reset_by_the_server(monkeypatch):
+    pool = SMTPPool()
+    fresh = object()
+    monkeypatch.setattr(pool, '_connect', lambda: fresh)
+    stale = StaleSession()
+    pool._idle.put((stale, time.monotonic() - SMTP_KEEPALIVE - 1))
+
+    assert pool._checkout() is fresh
+    assert stale.closed
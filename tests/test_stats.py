@@ -0,0 +1,47 @@
+from datetime import datetime
+from sqlalchemy import update, delete
+from stats import user_totals, library_totals, counter_totals, dashboard_totals
+from models import db, User, Request, Feedback
+
+def count(model, *criteria):
+    return db.session.execute(db.select(db.func.count()).select_from(model).where(*criteria)).scalar()
+
+def naive_library_totals():
+    totals = {status: count(Request, Request.status == status)
+              for status in ('requested', 'granted', 'revoked', 'returned')}
+    totals['active_users'] = db.session.execute(
+        db.select(db.func.count(db.func.distinct(Request.user_id))).where(Request.status == 'granted')
+    ).scalar()
+    totals['feedbacks'] = count(Feedback)
+    return totals
+
+def test_user_totals_match_per_status_counts(library):
+    for user_id in db.session.execute(db.select(User.user_id)).scalars():
+        assert user_totals(user_id) == {
+            'books_requested': count(Request, Request.user_id == user_id),
+            'requests_granted': count(Request, Request.user_id == user_id, Request.status == 'granted'),
+            'requests_revoked': count(Request, Request.user_id == user_id, Request.status == 'revoked'),
+            'books_returned': count(Request, Request.user_id == user_id, Request.status == 'returned'),
+            'feedbacks_given': count(Feedback, Feedback.user_id == user_id),
+        }
+
+def test_library_totals_match_per_status_counts(library):
+    assert library_totals() == naive_library_totals()
+
+def test_counters_follow_bulk_statements(library):
+    assert counter_totals() == naive_library_totals()
+    now = datetime.now()
+    db.session.execute(update(Request).where(Request.status == 'granted', Request.user_id % 2 == 0)
+                       .values(status='returned', date_revoked=now))
+    db.session.execute(update(Request).where(Request.status == 'requested', Request.user_id % 3 == 0)
+                       .values(status='granted', date_granted=now))
+    db.session.execute(delete(Feedback).where(Feedback.rating == 1))
+    db.session.add(Request(user_id=2, ebook_id=1, status='requested', date_requested=now))
+    db.session.commit()
+    assert counter_totals() == naive_library_totals()
+    assert dashboard_totals(use_counters=True) == dashboard_totals()
+
+def test_dashboard_endpoint(library, librarian):
+    response = library.test_client().get('/api/librarian/dashboard', headers=librarian)
+    assert response.status_code == 200
+    assert response.json == dashboard_totals()
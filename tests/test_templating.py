@@ -0,0 +1,26 @@
+from templating import env, render, render_many, StageTimer
+
+BOOKS = [{'ebook_name': 'Tide & Tables', 'return_date': '01 May 2026'}]
+
+def test_html_templates_are_autoescaped():
+    body = render('daily_reminders.html', user='<script>x</script>', books=BOOKS)
+    assert '&lt;script&gt;' in body and '<script>' not in body
+    assert 'Tide &amp; Tables' in body
+
+def test_render_many_matches_one_at_a_time():
+    contexts = [{'user': f'reader{number}', 'books': BOOKS} for number in range(3)]
+    assert render_many('daily_reminders.html', contexts) == [render('daily_reminders.html', **context)
+                                                             for context in contexts]
+
+def test_templates_are_compiled_once():
+    assert env.get_template('daily_reminders.html') is env.get_template('daily_reminders.html')
+
+def test_stage_timer_accumulates_per_stage():
+    timer = StageTimer()
+    for _ in range(2):
+        with timer.stage('render'):
+            pass
+    with timer.stage('send'):
+        pass
+    assert set(timer.stages) == {'render', 'send'}
+    assert all(seconds >= 0 for seconds in timer.stages.values())